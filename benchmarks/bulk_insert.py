@@ -0,0 +1,105 @@
+"""Benchmark of the crypto_price insert paths of lib.db.client.Client.
+
+Compares the ORM bulk_insert_mappings path (Client.insert) with the COPY
+paths (Client.copy_insert, through a staging table and directly) in
+rows/sec. The rows go into a scratch partition of crypto_price far in the
+future, which is dropped afterwards.
+
+Usage (from the repository root, against a DB set up by init.sql):
+    PYTHONPATH=. python benchmarks/bulk_insert.py -o localhost -n app_test \\
+        -u app -p secret
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from lib.db.client import Client
+from lib.db.models.schema import CryptoPrice
+
+PARTITION = "crypto_price_benchmark"
+PARTITION_START = datetime(2100, 1, 1)
+PARTITION_END = datetime(2101, 1, 1)
+
+
+def make_rows(count, offset=0):
+    return [
+        {
+            "symbol": "BENCH%03d" % (index % 100),
+            "price": 100 + index % 1000 / 10,
+            "datetime": PARTITION_START + timedelta(
+                seconds=(offset + index) // 100)
+        }
+        for index in range(count)
+    ]
+
+
+def execute(client, statement):
+    with client.engine.begin() as connection:
+        connection.execute(text(statement))
+
+
+def run(client, name, insert, rows, batch_size):
+    execute(client, f"TRUNCATE {PARTITION}")
+    start = time.perf_counter()
+    for index in range(0, len(rows), batch_size):
+        insert(rows[index:index + batch_size])
+    elapsed = time.perf_counter() - start
+    print("%-28s %12.0f rows/sec" % (name, len(rows) / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark bulk inserts into crypto_price")
+    parser.add_argument("-o", "--db_host", type=str, required=True)
+    parser.add_argument("-n", "--db_name", type=str, required=True)
+    parser.add_argument("-u", "--db_user_name", type=str, required=True)
+    parser.add_argument("-p", "--db_password", type=str, required=True)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--batch_size", type=int, default=10000)
+    args = parser.parse_args()
+
+    client = Client(db_name=args.db_name, host=args.db_host,
+                    user_name=args.db_user_name, password=args.db_password)
+    client.connect()
+    execute(client, f"CREATE TABLE {PARTITION} PARTITION OF crypto_price "
+                    f"FOR VALUES FROM ('{PARTITION_START}') "
+                    f"TO ('{PARTITION_END}')")
+    rows = make_rows(args.rows)
+    try:
+        run(client, "orm bulk_insert_mappings",
+            lambda batch: client.insert(CryptoPrice, batch),
+            rows, args.batch_size)
+        run(client, "copy direct",
+            lambda batch: client.copy_insert(CryptoPrice, batch,
+                                             ignore_duplicates=False),
+            rows, args.batch_size)
+        run(client, "copy via staging",
+            lambda batch: client.copy_insert(CryptoPrice, batch),
+            rows, args.batch_size)
+
+        # Half of every batch was already stored: the ORM path loses the
+        # whole batch on the first duplicate, COPY via staging keeps the
+        # new half
+        execute(client, f"TRUNCATE {PARTITION}")
+        client.copy_insert(CryptoPrice, rows)
+        overlapping = make_rows(args.rows, offset=args.rows // 2)
+        inserted = skipped = 0
+        start = time.perf_counter()
+        for index in range(0, len(overlapping), args.batch_size):
+            batch_inserted, batch_skipped = client.copy_insert(
+                CryptoPrice, overlapping[index:index + args.batch_size])
+            inserted += batch_inserted
+            skipped += batch_skipped
+        elapsed = time.perf_counter() - start
+        print("%-28s %12.0f rows/sec (%d inserted, %d skipped)" %
+              ("copy via staging, 50% dups", len(overlapping) / elapsed,
+               inserted, skipped))
+    finally:
+        execute(client, f"DROP TABLE {PARTITION}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Benchmark of per-symbol trade sockets against combined stream connections.
+
+Runs DataReceiver's socket tasks against a local fake Binance server in a
+separate process and reports messages/sec and receiver CPU normalised per
+1k symbols and per 1k messages. The fake server is a single process, so at
+high offered loads it may be the one capping messages/sec.
+
+Usage (from the repository root):
+    PYTHONPATH=. python benchmarks/combined_stream.py --symbols 1000
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+from array import array
+from types import SimpleNamespace
+
+from binance import BinanceSocketManager
+
+from lib.scheduler import FlushScheduler
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), "services", "data-receiver"))
+
+import fake_binance  # noqa: E402
+from bars import BarAggregator  # noqa: E402
+from binance_websock import DataReceiver  # noqa: E402
+from sources import BinanceSource  # noqa: E402
+
+
+class BenchReceiver(DataReceiver):
+    """DataReceiver wired to the fake server, without any DB"""
+
+    def __init__(self, symbols, stream_connections, url):
+        self.symbols = symbols
+        self.capture_interval = 1
+        self.stream_connections = stream_connections
+        self.bars = BarAggregator(self.symbols, self.capture_interval)
+        self.slots = self.bars.slots
+        self.last_recorded_times = array(
+            'q', [int(time.time())] * len(self.symbols))
+        self.last_recorded_prices = [None] * len(self.symbols)
+        self.dirty_symbols = set()
+        self.flush_scheduler = FlushScheduler(1)
+        self.init_metrics()
+        self.crypto_price_objects = []
+        bm = BinanceSocketManager(SimpleNamespace(tld="com", testnet=False))
+        bm.STREAM_URL = url
+        self.source = BinanceSource(bm)
+        self.received = 0
+
+    def handle_socket_messages(self, msgs):
+        self.received += len(msgs)
+        super(BenchReceiver, self).handle_socket_messages(msgs)
+        # Nothing gets flushed here
+        self.crypto_price_objects.clear()
+        self.bars.completed.clear()
+
+
+async def measure(receiver, combined, warmup, duration):
+    if combined:
+        for symbols in receiver.get_symbol_shards():
+            asyncio.ensure_future(receiver.task_multiplex_socket(symbols))
+    else:
+        for symbol in receiver.symbols:
+            asyncio.ensure_future(receiver.task_trade_socket(symbol))
+    await asyncio.sleep(warmup)
+    received, cpu, wall = receiver.received, time.process_time(), time.time()
+    await asyncio.sleep(duration)
+    received = receiver.received - received
+    cpu = time.process_time() - cpu
+    wall = time.time() - wall
+    return received / wall, cpu / wall
+
+
+def run_mode(conn, symbols, combined, connections, url, warmup, duration):
+    # Each mode runs in its own process which simply gets terminated
+    # afterwards, as closing hundreds of sockets gracefully takes ages
+    receiver = BenchReceiver(symbols, connections, url)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    rate, cpu = loop.run_until_complete(
+        measure(receiver, combined, warmup, duration))
+    mode = ("combined x%d" % len(receiver.get_symbol_shards())
+            if combined else "per-symbol x%d" % connections)
+    conn.send((mode, rate, cpu))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark combined stream ingestion")
+    parser.add_argument("--symbols", type=int, default=1000)
+    parser.add_argument("--rate",
+                        help='Trades per second sent for every symbol',
+                        type=float, default=5)
+    parser.add_argument("--connections", type=str, default="5,10",
+                        help='Comma separated combined connection counts')
+    parser.add_argument("--skip_per_symbol",
+                        help='Skip the one socket per symbol mode',
+                        action='store_true')
+    parser.add_argument("--port", type=int, default=9443)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    url = f"ws://127.0.0.1:{args.port}/"
+    symbols = ["SYM%04dUSDT" % index for index in range(args.symbols)]
+    modes = [(True, int(count)) for count in args.connections.split(",")]
+    if not args.skip_per_symbol:
+        modes.insert(0, (False, len(symbols)))
+
+    print("offered load: %d symbols x %.1f trades/s = %d msgs/s" %
+          (args.symbols, args.rate, args.symbols * args.rate))
+    print("%-24s %12s %10s %16s %18s" %
+          ("mode", "msgs/sec", "cpu %", "cpu % / 1k sym", "cpu ms / 1k msgs"))
+    for combined, connections in modes:
+        # A fresh server per mode, so that connections left over from the
+        # previous mode don't eat into its capacity
+        server = multiprocessing.Process(
+            target=fake_binance.run, args=("127.0.0.1", args.port, args.rate),
+            daemon=True)
+        server.start()
+        time.sleep(1)
+        reader, writer = multiprocessing.Pipe(duplex=False)
+        worker = multiprocessing.Process(
+            target=run_mode,
+            args=(writer, symbols, combined, connections, url,
+                  args.warmup, args.duration))
+        worker.start()
+        try:
+            mode, rate, cpu = reader.recv()
+        finally:
+            worker.terminate()
+            worker.join()
+            server.terminate()
+            server.join()
+        print("%-24s %12.0f %10.1f %16.2f %18.1f" %
+              (mode, rate, cpu * 100, cpu * 100 * 1000 / args.symbols,
+               cpu * 1e6 / rate if rate else 0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""A local stand-in for the Binance trade websocket streams.
+
+Serves both the raw stream endpoint (/ws/<symbol>@trade) and the combined
+stream endpoint (/stream?streams=<symbol>@trade/...) with synthetic trades,
+so that ingestion can be exercised without talking to Binance.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import parse_qs, urlparse
+
+import websockets
+
+# Pacing granularity of the generated trades in seconds
+TICK = 0.01
+
+
+def parse_streams(path):
+    """Returns the list of uppercase symbols requested by the given path
+
+    Args:
+      path (str): Request path of either a raw or a combined stream
+    """
+    url = urlparse(path)
+    if url.path.startswith("/ws/"):
+        streams = [url.path[len("/ws/"):]]
+    else:
+        streams = parse_qs(url.query).get("streams", [""])[0].split("/")
+    return [stream.split("@")[0].upper() for stream in streams if stream]
+
+
+def trade_message(symbol, trade_id, combined):
+    now_ms = int(time.time() * 1e3)
+    data = {
+        "e": "trade",
+        "E": now_ms,
+        "s": symbol,
+        "t": trade_id,
+        "p": "%.2f" % random.uniform(100, 200),
+        "q": "%.5f" % random.uniform(0.001, 1),
+        "b": trade_id,
+        "a": trade_id,
+        "T": now_ms,
+        "m": False,
+        "M": True
+    }
+    if combined:
+        return {"stream": f"{symbol.lower()}@trade", "data": data}
+    return data
+
+
+def make_handler(rate):
+    """Builds a connection handler sending 'rate' trades/sec per symbol"""
+
+    async def handler(websocket, path=None):
+        if path is None:
+            path = getattr(websocket, "path", None) or websocket.request.path
+        symbols = parse_streams(path)
+        combined = not path.startswith("/ws/")
+        per_tick = rate * len(symbols) * TICK
+        trade_id = 0
+        owed = 0.0
+        deadline = time.monotonic()
+        try:
+            while True:
+                owed += per_tick
+                while owed >= 1:
+                    owed -= 1
+                    symbol = symbols[trade_id % len(symbols)]
+                    trade_id += 1
+                    await websocket.send(json.dumps(
+                        trade_message(symbol, trade_id, combined)))
+                deadline += TICK
+                await asyncio.sleep(max(0, deadline - time.monotonic()))
+        except websockets.ConnectionClosed:
+            pass
+
+    return handler
+
+
+async def serve(host, port, rate):
+    async with websockets.serve(make_handler(rate), host, port,
+                                max_queue=None):
+        await asyncio.Future()
+
+
+def run(host, port, rate):
+    asyncio.run(serve(host, port, rate))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fake Binance trade stream server")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9443)
+    parser.add_argument("--rate",
+                        help='Trades per second sent for every symbol',
+                        type=float, default=10)
+    parsed_args = parser.parse_args()
+    run(parsed_args.host, parsed_args.port, parsed_args.rate)
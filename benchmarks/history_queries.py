@@ -0,0 +1,353 @@
+"""Benchmark of the index options for the history queries of the API, and
+a regression check of their plans.
+
+Loads synthetic prices, as captured every --interval seconds for --symbols
+symbols over --days days, into a copy of the crypto_price schema in a
+scratch schema. Then, for each index option, times the queries the API
+issues for CryptoPriceFilter ranges:
+- the page and count of the price list, and a page of its keyset
+  pagination halfway through the range;
+- the single aggregate query of the statistics;
+- the aggregates of the statistics but the median, as for the raw edges
+  of a range.
+
+Each option also reports its index size and the cost it adds to the
+receiver's COPY inserts.
+
+The plans of the queries are checked for every option:
+- only the partitions overlapping the range are scanned;
+- queries for a symbol never scan a partition sequentially, nor do ranges
+  of up to a day across all symbols when there is a datetime index;
+- queries whose order must come from an index don't sort more rows than
+  they return.
+Finally the oldest partition is rolled up and compacted, and its datetime
+column is checked to still follow the physical order of the rows, which
+the BRIN index relies on.
+The script exits with 1 if any check fails, so that a pruning or index
+regression fails loudly.
+
+Usage (from the repository root):
+    PYTHONPATH=. python benchmarks/history_queries.py -o localhost \\
+        -n app_test -u app -p secret
+"""
+
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine, text
+
+from lib.db import partitions, rollup
+from lib.db.client import Client
+from lib.db.models.schema import CryptoPrice
+
+SCHEMA = "history_benchmark"
+SYMBOL_FORMAT = "HIST%03dUSDT"
+
+# Indexes on top of the (id, datetime) primary key and the
+# (symbol, datetime) unique constraint, created on crypto_price and so on
+# every partition, and whether ranges across all symbols should use them
+INDEX_OPTIONS = {
+    "constraints only": ([], False),
+    "brin(datetime), as in init.sql": ([
+        "CREATE INDEX crypto_price_datetime_brin ON crypto_price "
+        "USING brin (datetime) WITH (pages_per_range = 32)"], True),
+    "btree(datetime)": ([
+        "CREATE INDEX crypto_price_datetime ON crypto_price (datetime)"],
+        True),
+    "btree(symbol, datetime) include (price)": ([
+        "CREATE INDEX crypto_price_symbol_datetime_price ON crypto_price "
+        "(symbol, datetime) INCLUDE (price)"], False),
+}
+# Longest range across all symbols expected to use a datetime index, a
+# sequential scan may well be cheaper beyond that
+MAX_INDEXED_RANGE = timedelta(days=1)
+
+# The queries Django issues for the API, as (name, SQL, whether it filters
+# by symbol, whether its order must come from an index)
+RANGE = "datetime >= :start AND datetime <= :end"
+SYMBOL_RANGE = f"symbol = :symbol AND {RANGE}"
+KEYSET = "datetime >= :cursor AND (datetime > :cursor OR id > 0)"
+QUERIES = [
+    ("list page", f"SELECT id, datetime, symbol, price FROM crypto_price "
+                  f"WHERE {SYMBOL_RANGE} LIMIT 50", True, False),
+    ("keyset page", f"SELECT id, datetime, symbol, price FROM crypto_price "
+                    f"WHERE {SYMBOL_RANGE} AND {KEYSET} "
+                    f"ORDER BY datetime, id LIMIT 1001", True, True),
+    ("list count", f"SELECT count(*) FROM crypto_price "
+                   f"WHERE {SYMBOL_RANGE}", True, False),
+    ("statistics", f"SELECT count(id), avg(price), percentile_cont(0.5) "
+                   f"WITHIN GROUP (ORDER BY price), stddev_pop(price), "
+                   f"(min(ARRAY[extract(epoch FROM datetime), price]))[2], "
+                   f"(max(ARRAY[extract(epoch FROM datetime), price]))[2] "
+                   f"FROM crypto_price WHERE {SYMBOL_RANGE}", True, False),
+    ("raw aggregates", f"SELECT count(id), avg(price), "
+                       f"stddev_pop(price), min(price), max(price) "
+                       f"FROM crypto_price WHERE {SYMBOL_RANGE}",
+     True, False),
+    ("all symbols page", f"SELECT id, datetime, symbol, price "
+                         f"FROM crypto_price WHERE {RANGE} LIMIT 50",
+     False, False),
+    ("all symbols count", f"SELECT count(*) FROM crypto_price "
+                          f"WHERE {RANGE}", False, False),
+]
+RANGES = {"1 hour": timedelta(hours=1), "1 day": timedelta(days=1),
+          "1 week": timedelta(days=7)}
+# Lowest correlation of datetime with the physical order of the rows for
+# the BRIN index to stay selective
+MIN_CORRELATION = 0.9
+
+
+def execute(engine, statement, **params):
+    with engine.begin() as connection:
+        return connection.execute(text(statement), params)
+
+
+def vacuum(engine):
+    # Also sets the visibility map, which index only scans depend on
+    with engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("VACUUM ANALYZE crypto_price"))
+
+
+def load(engine, symbols, days, interval, end):
+    start = end - timedelta(days=days)
+    execute(engine, f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    execute(engine, f"CREATE SCHEMA {SCHEMA}")
+    # Same as in init.sql, but without its indexes
+    execute(engine, """
+        CREATE TABLE crypto_price (
+            id SERIAL,
+            symbol VARCHAR(20),
+            price FLOAT,
+            datetime TIMESTAMP,
+            PRIMARY KEY (id, datetime),
+            CONSTRAINT unique_symbol_datetime UNIQUE (symbol, datetime)
+        ) PARTITION BY RANGE (datetime)""")
+    partitions.ensure_partitions(SimpleNamespace(engine=engine),
+                                 ahead_days=days + 7, now=start)
+    # In time order, every symbol at every capture, the way the receiver
+    # writes them
+    count = int(days * 86400 / interval)
+    load_start = time.perf_counter()
+    execute(engine, f"""
+        INSERT INTO crypto_price (symbol, price, datetime)
+        SELECT 'HIST' || lpad(CAST(s AS text), 3, '0') || 'USDT',
+               100 + s + 10 * sin(g / 1000.0) + random(),
+               CAST(:start AS timestamp) + g * CAST(:interval AS interval)
+        FROM generate_series(0, :count - 1) g,
+             generate_series(0, :symbols - 1) s
+        ORDER BY g, s""", start=start, count=count, symbols=symbols,
+            interval=f"{interval} seconds")
+    vacuum(engine)
+    print("loaded %d rows in %.0f s" %
+          (count * symbols, time.perf_counter() - load_start))
+    return start
+
+
+def plan_of(engine, statement, params):
+    with engine.connect() as connection:
+        plan = connection.execute(text(
+            f"EXPLAIN (FORMAT JSON) {statement}"), params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+
+def plan_nodes(plan):
+    nodes = [plan]
+    for child in plan.get("Plans", []):
+        nodes.extend(plan_nodes(child))
+    return nodes
+
+
+def check_plan(engine, name, statement, by_symbol, ordered, range_indexed,
+               params):
+    """Returns the failed checks of the plan of the query"""
+    plan = plan_of(engine, statement, params)
+    nodes = plan_nodes(plan)
+    failures = []
+    scanned = sorted({node["Relation Name"] for node in nodes
+                      if "Relation Name" in node})
+    # A cursor prunes the partitions before it
+    range_start = params["start"]
+    if ":cursor" in statement:
+        range_start = max(range_start, params["cursor"])
+    with engine.connect() as connection:
+        expected = sorted(
+            partition for partition, start, end
+            in partitions.get_partitions(connection)
+            if start <= params["end"] and end > range_start)
+    if scanned != expected:
+        failures.append(f"scans {scanned} instead of {expected}")
+    if by_symbol or range_indexed:
+        sequential = [node["Relation Name"] for node in nodes
+                      if node["Node Type"] == "Seq Scan"]
+        if sequential:
+            failures.append(f"scans {sequential} sequentially")
+    # An incremental sort only orders the rows of the same datetime, as
+    # the index returns them, and sorting the range is fine when it's
+    # smaller than what the query returns anyway
+    if ordered and any(node["Node Type"] == "Sort" and
+                       node["Plan Rows"] > plan["Plan Rows"]
+                       for node in nodes):
+        failures.append("sorts instead of reading an index in order")
+    return [f"{name}: {failure}" for failure in failures]
+
+
+def check_compaction(client):
+    """Compacts the oldest partition and returns the failed checks of it"""
+    # Same as in init.sql
+    execute(client.engine, """
+        CREATE TABLE crypto_price_rollup (
+            id SERIAL PRIMARY KEY,
+            symbol VARCHAR(20),
+            resolution INTEGER,
+            datetime TIMESTAMP,
+            price_count INTEGER,
+            price_sum FLOAT,
+            price_sum_of_squares FLOAT,
+            price_min FLOAT,
+            price_max FLOAT,
+            first_price FLOAT,
+            first_datetime TIMESTAMP,
+            last_price FLOAT,
+            last_datetime TIMESTAMP,
+            CONSTRAINT unique_symbol_resolution_datetime
+                UNIQUE (symbol, resolution, datetime))""")
+    execute(client.engine, """
+        CREATE TABLE settings (
+            name VARCHAR(255) PRIMARY KEY,
+            value TEXT)""")
+    with client.engine.connect() as connection:
+        name, start, end = partitions.get_partitions(connection)[0]
+    # Only partitions whose prices are all rolled up get compacted
+    rollup.rebuild(client, start, end)
+    compact_start = time.perf_counter()
+    if partitions.compact_partitions(client, 0, now=end) != [name]:
+        return [f"compaction: {name} wasn't compacted"]
+    compact_time = time.perf_counter() - compact_start
+    vacuum(client.engine)
+    correlation = execute(client.engine, """
+        SELECT correlation FROM pg_stats
+        WHERE schemaname = :schema AND tablename = :name
+        AND attname = 'datetime'""", schema=SCHEMA, name=name).scalar()
+    print("\ncompacted %s in %.1f s, datetime correlation %.3f" % (
+        name, compact_time, correlation))
+    if correlation < MIN_CORRELATION:
+        return [f"compaction: datetime correlation of {name} is "
+                f"{correlation:.3f}, its rows are out of time order"]
+    return []
+
+
+def timed(engine, statement, params, repeat):
+    timings = []
+    with engine.connect() as connection:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            connection.execute(text(statement), params).all()
+            timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def insert_cost(client, symbols, end, batches, batch_size):
+    # COPY batches the size of a receiver flush, as the receiver writes
+    # them, into the newest partition
+    start = time.perf_counter()
+    for batch in range(batches):
+        client.copy_insert(CryptoPrice, [
+            {"symbol": SYMBOL_FORMAT % (index % symbols), "price": 100.0,
+             "datetime": end + timedelta(
+                 seconds=(batch * batch_size + index) // symbols)}
+            for index in range(batch_size)])
+    elapsed = time.perf_counter() - start
+    execute(client.engine, "DELETE FROM crypto_price WHERE datetime >= :end",
+            end=end)
+    return batches * batch_size / elapsed
+
+
+def index_size(engine, statements):
+    if not statements:
+        return 0
+    # The indexes on crypto_price only exist in the partitions
+    return sum(execute(engine, """
+        SELECT sum(pg_relation_size(relid))
+        FROM pg_partition_tree(CAST(:name AS regclass))""",
+                       name=statement.split()[2]).scalar()
+               for statement in statements)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark index options for the history queries and "
+                    "check their plans")
+    parser.add_argument("-o", "--db_host", type=str, required=True)
+    parser.add_argument("-n", "--db_name", type=str, required=True)
+    parser.add_argument("-u", "--db_user_name", type=str, required=True)
+    parser.add_argument("-p", "--db_password", type=str, required=True)
+    parser.add_argument("--symbols", type=int, default=10)
+    parser.add_argument("--days", type=int, default=28)
+    parser.add_argument("--interval",
+                        help='Seconds between the captured prices',
+                        type=float, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--insert_batches", type=int, default=5)
+    parser.add_argument("--insert_batch_size", type=int, default=10000)
+    parser.add_argument("--keep", action='store_true',
+                        help='Keep the scratch schema')
+    args = parser.parse_args()
+
+    client = Client(db_name=args.db_name, host=args.db_host,
+                    user_name=args.db_user_name, password=args.db_password)
+    # Everything runs against the tables of the scratch schema
+    client.engine = engine = create_engine(
+        client.url, connect_args={"options": f"-csearch_path={SCHEMA}"})
+    end = datetime.now().replace(microsecond=0) - timedelta(days=1)
+    start = load(engine, args.symbols, args.days, args.interval, end)
+    # Ranges ending in the middle of the data, across a partition bound
+    # for the week
+    middle = start + (end - start) / 2
+    symbol = SYMBOL_FORMAT % (args.symbols // 2)
+    failures = []
+    try:
+        for option, (statements, range_indexed) in INDEX_OPTIONS.items():
+            for statement in statements:
+                execute(engine, statement)
+            vacuum(engine)
+            print("\n%s: indexes %.1f MiB, inserts %.0f rows/sec" % (
+                option, index_size(engine, statements) / 2 ** 20,
+                insert_cost(client, args.symbols, end, args.insert_batches,
+                            args.insert_batch_size)))
+            print("%-22s" % "" + "".join("%12s" % name for name in RANGES))
+            for name, statement, by_symbol, ordered in QUERIES:
+                timings = []
+                for span_name, span in RANGES.items():
+                    params = {"symbol": symbol, "start": middle - span,
+                              "end": middle, "cursor": middle - span / 2}
+                    indexed = range_indexed and span <= MAX_INDEXED_RANGE
+                    failures.extend(
+                        f"{option}, {span_name}, {failure}" for failure in
+                        check_plan(engine, name, statement, by_symbol,
+                                   ordered, indexed, params))
+                    timings.append(timed(engine, statement, params,
+                                         args.repeat))
+                print("%-22s" % name + "".join(
+                    "%9.2f ms" % (timing * 1e3) for timing in timings))
+            for statement in statements:
+                execute(engine, f"DROP INDEX {statement.split()[2]}")
+        failures.extend(check_compaction(client))
+    finally:
+        if not args.keep:
+            execute(engine, f"DROP SCHEMA {SCHEMA} CASCADE")
+
+    if failures:
+        print("\nPlan checks failed:\n" + "\n".join(failures))
+        raise SystemExit(1)
+    print("\nPlan checks passed")
+
+
+if __name__ == "__main__":
+    main()
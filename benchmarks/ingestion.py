@@ -0,0 +1,220 @@
+"""End-to-end ingestion benchmark of DataReceiver, without Binance.
+
+Feeds DataReceiver from an in-process ReplaySource, synthetic or replaying a
+file recorded with binance_websock.py --record_file, and stores everything
+in a local Postgres set up by init.sql. Reports the sustained messages/sec,
+the trade-to-commit latency of the captured prices and the memory used.
+With --workers the trades are captured by that many worker processes of
+a Supervisor, whose latency is taken from the start of the second of each
+trade, as the trade times stay in the workers.
+
+The rows use symbols starting with BENCH and are removed afterwards.
+
+Usage (from the repository root):
+    PYTHONPATH=. python benchmarks/ingestion.py -o localhost -n app_test \\
+        -u app -p secret --symbols 1000 --rate 0 --combined
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), "services", "data-receiver"))
+
+from binance_websock import DataReceiver  # noqa: E402
+from sources import ReplaySource  # noqa: E402
+from supervisor import Supervisor  # noqa: E402
+
+SYMBOL_PREFIX = "BENCH"
+
+
+class BenchReceiver(DataReceiver):
+    """DataReceiver which keeps track of when every captured trade got
+    committed"""
+
+    def __init__(self, *args, **kwargs):
+        self.received = 0
+        # (symbol, epoch seconds) of a captured price -> trade time in
+        # epoch milliseconds
+        self.trade_times = {}
+        self.latencies = []
+        super(BenchReceiver, self).__init__(*args, **kwargs)
+
+    def handle_socket_messages(self, msgs):
+        self.received += len(msgs)
+        captured = len(self.crypto_price_objects)
+        super(BenchReceiver, self).handle_socket_messages(msgs)
+        for symbol, timestamp, _ in self.crypto_price_objects[captured:]:
+            self.trade_times[(symbol, timestamp // 1000)] = timestamp
+
+    def insert_crypto_prices(self, crypto_price_objects):
+        super(BenchReceiver, self).insert_crypto_prices(crypto_price_objects)
+        now = time.time() * 1e3
+        for row in crypto_price_objects:
+            trade_time = self.trade_times.pop(
+                (row["symbol"], int(row["datetime"].timestamp())), None)
+            if trade_time is not None:
+                self.latencies.append(now - trade_time)
+
+
+class BenchSupervisor(Supervisor):
+    """Supervisor which keeps track of when captured prices got
+    committed"""
+
+    def __init__(self, *args, **kwargs):
+        self.latencies = []
+        super(BenchSupervisor, self).__init__(*args, **kwargs)
+
+    @property
+    def received(self):
+        return sum(self.message_counts)
+
+    def insert_crypto_prices(self, crypto_price_objects):
+        super(BenchSupervisor, self).insert_crypto_prices(
+            crypto_price_objects)
+        now = time.time()
+        for row in crypto_price_objects:
+            self.latencies.append((now - row["datetime"].timestamp()) * 1e3)
+
+
+def execute(client, statement, **params):
+    with client.engine.begin() as connection:
+        connection.execute(text(statement), params)
+
+
+def cleanup(client):
+    for table in ("crypto_price", "crypto_price_bar", "crypto_price_rollup",
+                  "latest_crypto_price"):
+        execute(client, f"DELETE FROM {table} WHERE symbol LIKE :prefix",
+                prefix=SYMBOL_PREFIX + "%")
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def rss_mb(pid="self"):
+    with open(f"/proc/{pid}/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+async def measure(receiver, warmup, duration, results):
+    await asyncio.sleep(warmup)
+    received, cpu, wall = (receiver.received, time.process_time(),
+                           time.perf_counter())
+    receiver.latencies = []
+    await asyncio.sleep(duration)
+    wall = time.perf_counter() - wall
+    results.update(
+        rate=(receiver.received - received) / wall,
+        cpu=(time.process_time() - cpu) / wall,
+        latencies=receiver.latencies,
+        rss=rss_mb() + sum(rss_mb(process.pid) for process in
+                           getattr(receiver, "processes", {}).values()),
+        writer=receiver.db_writer.stats(),
+        spool_pending=receiver.spool.pending)
+    for task in asyncio.all_tasks():
+        if task is not asyncio.current_task():
+            task.cancel()
+    receiver.loop.call_soon(receiver.loop.stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark DataReceiver ingestion into a local DB")
+    parser.add_argument("-o", "--db_host", type=str, required=True)
+    parser.add_argument("-n", "--db_name", type=str, required=True)
+    parser.add_argument("-u", "--db_user_name", type=str, required=True)
+    parser.add_argument("-p", "--db_password", type=str, required=True)
+    parser.add_argument("--symbols", type=int, default=100)
+    parser.add_argument("--rate",
+                        help='Total trades per second, 0 for as fast as '
+                             'possible',
+                        type=float, default=0)
+    parser.add_argument("--replay_file",
+                        help='Replay this recording instead of synthetic '
+                             'trades. Its symbols are used, --symbols is '
+                             'ignored',
+                        type=str, default=None)
+    parser.add_argument("--combined", action='store_true',
+                        help='Use combined stream sockets')
+    parser.add_argument("--stream_connections", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=0,
+                        help='Capture in this many worker processes')
+    parser.add_argument("--interval", type=int, default=1,
+                        help='Capture interval in seconds')
+    parser.add_argument("--db_update_interval", type=int, default=1)
+    parser.add_argument("--flush_batch_size", type=int, default=10000,
+                        help='Captured prices flushing them early')
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--duration", type=float, default=30)
+    args = parser.parse_args()
+
+    symbols = ["%s%04dUSDT" % (SYMBOL_PREFIX, index)
+               for index in range(args.symbols)]
+    source = ReplaySource(symbols, rate=args.rate,
+                          replay_file=args.replay_file)
+    if args.replay_file:
+        symbols = sorted(source.recorded)
+    spool_dir = tempfile.mkdtemp(prefix="ingestion-benchmark-")
+    options = dict(
+        api_key=None, api_secret=None, interval=args.interval,
+        symbols=",".join(symbols), db_name=args.db_name,
+        db_host=args.db_host, db_user_name=args.db_user_name,
+        db_password=args.db_password,
+        db_update_interval=args.db_update_interval,
+        combined_stream=args.combined,
+        stream_connections=args.stream_connections,
+        spool_dir=spool_dir, flush_batch_size=args.flush_batch_size)
+    if args.workers:
+        receiver = BenchSupervisor(
+            workers=args.workers,
+            source_options=dict(replay_file=args.replay_file,
+                                synthetic=True, replay_rate=args.rate),
+            **options)
+    else:
+        receiver = BenchReceiver(source=source, **options)
+    results = {}
+    asyncio.ensure_future(
+        measure(receiver, args.warmup, args.duration, results))
+    try:
+        receiver.do_work()
+    finally:
+        cleanup(receiver.db_client)
+        shutil.rmtree(spool_dir)
+
+    latencies = results["latencies"]
+    print("symbols:               %d (%s%s)" %
+          (len(symbols), "combined" if args.combined else "per-symbol",
+           ", %d workers" % args.workers if args.workers else ""))
+    print("offered:               %s" %
+          ("%.0f msgs/sec" % args.rate if args.rate else "as fast as possible"))
+    print("sustained:             %.0f msgs/sec" % results["rate"])
+    print("cpu:                   %.1f %%%s" %
+          (results["cpu"] * 100, " of the supervisor" if args.workers else ""))
+    if latencies:
+        print("trade-to-commit:       p50 %.0f ms, p99 %.0f ms, max %.0f ms "
+              "(%d rows)" % (percentile(latencies, 0.5),
+                             percentile(latencies, 0.99), max(latencies),
+                             len(latencies)))
+    else:
+        print("trade-to-commit:       nothing committed")
+    print("rss:                   %.1f MiB (peak %.1f MiB in this process)" %
+          (results["rss"],
+           resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+    print("db writer:             %s" % results["writer"])
+    print("flush scheduler:       %s" % receiver.flush_scheduler.stats())
+    print("spool backlog at end:  %s" % results["spool_pending"])
+
+
+if __name__ == "__main__":
+    main()
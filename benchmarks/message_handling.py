@@ -0,0 +1,195 @@
+"""Microbenchmarks of the per-trade work of DataReceiver.
+
+Compares the previous per-message handler (nested dicts, a datetime and a
+timedelta per trade, and the DEBUG message built and its caller looked up
+even with debug off) with the batched handler working on integer epoch
+milliseconds and array-backed state. Also compares taking messages off a
+python-binance socket one recv() at a time with recv_batch().
+
+Usage (from the repository root):
+    PYTHONPATH=. python benchmarks/message_handling.py
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+import traceback
+from array import array
+from datetime import datetime, timedelta
+
+from binance.streams import ReconnectingWebsocket
+
+from lib.scheduler import FlushScheduler
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), "services", "data-receiver"))
+
+from bars import BarAggregator  # noqa: E402
+from binance_websock import DataReceiver  # noqa: E402
+from sources import recv_batch  # noqa: E402
+
+
+def make_messages(symbols, count, seconds):
+    start = int(time.time() * 1e3)
+    return [
+        {
+            "e": "trade",
+            "s": symbols[index % len(symbols)],
+            "t": index,
+            "p": "%.8f" % random.uniform(10, 1000),
+            "q": "%.5f" % random.uniform(0.001, 1),
+            "E": start + index * seconds * 1000 // count,
+            "T": start + index * seconds * 1000 // count,
+            "m": False,
+            "M": True
+        }
+        for index in range(count)
+    ]
+
+
+class LegacyReceiver(object):
+    """The per-message handler as it was before the fast path"""
+
+    def __init__(self, symbols):
+        self.capture_interval = 1
+        self.last_recorded = {}
+        for symbol in symbols:
+            self.last_recorded[symbol] = {
+                "dt": datetime.now().replace(microsecond=0),
+                "price": None
+            }
+        self.dirty_symbols = set()
+        self.bars = BarAggregator(symbols, self.capture_interval)
+        self.crypto_price_objects = []
+
+    def handle_socket_message(self, msg):
+        symbol = msg['s']
+        timestamp = msg['T']
+        price = msg['p']
+        self.bars.add(self.bars.slots[symbol], timestamp, float(price),
+                      float(msg['q']))
+        trade_dt = datetime.fromtimestamp(
+            timestamp / 1e3).replace(microsecond=0)
+
+        if trade_dt >= self.last_recorded[symbol]["dt"] + timedelta(seconds=self.capture_interval):
+            self.last_recorded[symbol]["dt"] = trade_dt
+            self.last_recorded[symbol]["price"] = price
+            self.dirty_symbols.add(symbol)
+        else:
+            return
+
+        self.crypto_price_objects.append(
+            {
+                "symbol": symbol,
+                "price": price,
+                "datetime": trade_dt
+            }
+        )
+        legacy_debug(f"{trade_dt}: {symbol} ----> {price}")
+
+
+def legacy_debug(msg):
+    # What lib.logger.DEBUG used to do before checking the level
+    frame = traceback.extract_stack()[-2]
+    logging.app_logger.debug(msg, extra={
+        'file_line': "%s:%s" % (frame[0].split("/")[-1], frame[1])})
+
+
+class FastReceiver(DataReceiver):
+    """DataReceiver with just the state the message handler needs"""
+
+    def __init__(self, symbols):
+        self.symbols = symbols
+        self.capture_interval = 1
+        self.bars = BarAggregator(symbols, self.capture_interval)
+        self.slots = self.bars.slots
+        self.last_recorded_times = array(
+            'q', [int(time.time())] * len(symbols))
+        self.last_recorded_prices = [None] * len(symbols)
+        self.dirty_symbols = set()
+        self.crypto_price_objects = []
+        self.flush_scheduler = FlushScheduler(1)
+        self.init_metrics()
+
+
+def bench(name, func, count, repeat):
+    best = min(timed(func) for _ in range(repeat))
+    print("%-40s %10.0f msgs/sec %8.2f us/msg" %
+          (name, count / best, best * 1e6 / count))
+    return best
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def bench_handlers(symbols, msgs, batch_size, repeat):
+    def legacy():
+        receiver = LegacyReceiver(symbols)
+        for msg in msgs:
+            receiver.handle_socket_message(msg)
+
+    def fast_single():
+        receiver = FastReceiver(symbols)
+        for msg in msgs:
+            receiver.handle_socket_message(msg)
+
+    def fast_batched():
+        receiver = FastReceiver(symbols)
+        for index in range(0, len(msgs), batch_size):
+            receiver.handle_socket_messages(msgs[index:index + batch_size])
+
+    baseline = bench("previous handler", legacy, len(msgs), repeat)
+    for name, func in (("fast path, one message at a time", fast_single),
+                       ("fast path, batches of %d" % batch_size,
+                        fast_batched)):
+        elapsed = bench(name, func, len(msgs), repeat)
+        print("%40s %10.1fx" % ("speedup", baseline / elapsed))
+
+
+def bench_recv(msgs, batch_size, repeat):
+    async def drain(batched):
+        socket = ReconnectingWebsocket(url="ws://127.0.0.1/")
+        for msg in msgs:
+            socket._queue.put_nowait(msg)
+        received = 0
+        while received < len(msgs):
+            if batched:
+                received += len(await recv_batch(socket, batch_size))
+            else:
+                await socket.recv()
+                received += 1
+
+    baseline = bench("socket recv()", lambda: asyncio.run(drain(False)),
+                     len(msgs), repeat)
+    elapsed = bench("recv_batch(), up to %d" % batch_size,
+                    lambda: asyncio.run(drain(True)), len(msgs), repeat)
+    print("%40s %10.1fx" % ("speedup", baseline / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Microbenchmarks of trade message handling")
+    parser.add_argument("--symbols", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--seconds",
+                        help='Time span the trades are spread over',
+                        type=int, default=60)
+    parser.add_argument("--batch_size", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    symbols = ["SYM%04dUSDT" % index for index in range(args.symbols)]
+    msgs = make_messages(symbols, args.messages, args.seconds)
+    bench_handlers(symbols, msgs, args.batch_size, args.repeat)
+    bench_recv(msgs, args.batch_size, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
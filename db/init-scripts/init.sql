@@ -7,6 +7,12 @@ CREATE TABLE crypto_price (
     CONSTRAINT unique_symbol_datetime UNIQUE (symbol, datetime)
 ) PARTITION BY RANGE (datetime);
 
+-- Ranges across all symbols. The prices are inserted in time order, so a
+-- BRIN index is as selective as a B-tree at a fraction of the size and of
+-- the insert cost, see benchmarks/history_queries.py
+CREATE INDEX crypto_price_datetime_brin ON crypto_price
+    USING brin (datetime) WITH (pages_per_range = 32);
+
 CREATE TABLE latest_crypto_price (
     id SERIAL PRIMARY KEY,
     symbol VARCHAR(20) UNIQUE,
@@ -14,6 +20,38 @@ CREATE TABLE latest_crypto_price (
     datetime TIMESTAMP
 );
 
+CREATE TABLE crypto_price_bar (
+    id SERIAL PRIMARY KEY,
+    symbol VARCHAR(20),
+    interval INTEGER,
+    datetime TIMESTAMP,
+    open FLOAT,
+    high FLOAT,
+    low FLOAT,
+    close FLOAT,
+    volume FLOAT,
+    vwap FLOAT,
+    trade_count INTEGER,
+    CONSTRAINT unique_symbol_interval_datetime UNIQUE (symbol, interval, datetime)
+);
+
+CREATE TABLE crypto_price_rollup (
+    id SERIAL PRIMARY KEY,
+    symbol VARCHAR(20),
+    resolution INTEGER,
+    datetime TIMESTAMP,
+    price_count INTEGER,
+    price_sum FLOAT,
+    price_sum_of_squares FLOAT,
+    price_min FLOAT,
+    price_max FLOAT,
+    first_price FLOAT,
+    first_datetime TIMESTAMP,
+    last_price FLOAT,
+    last_datetime TIMESTAMP,
+    CONSTRAINT unique_symbol_resolution_datetime UNIQUE (symbol, resolution, datetime)
+);
+
 CREATE TABLE settings (
     name VARCHAR(255) PRIMARY KEY,
     value TEXT
@@ -39,10 +77,5 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
--- Creating weekly partitions manually for April month. This is just a quickfix solution -- 
-SELECT create_partitions('2024-03-24 00:00:00', '2024-03-30 23:59:59');
-SELECT create_partitions('2024-03-31 00:00:00', '2024-04-06 23:59:59');
-SELECT create_partitions('2024-04-07 00:00:00', '2024-04-13 23:59:59');
-SELECT create_partitions('2024-04-14 00:00:00', '2024-04-20 23:59:59');
-SELECT create_partitions('2024-04-21 00:00:00', '2024-04-27 23:59:59');
-SELECT create_partitions('2024-04-28 00:00:00', '2024-05-04 23:59:59');
\ No newline at end of file
+-- Partitions are created ahead of time by lib/db/partitions.py, which the
+-- data-receiver runs when it starts and every hour after that --
\ No newline at end of file
@@ -1,84 +1,342 @@
 # base_sql.py
-import os
-from sqlalchemy import create_engine, select
-from sqlalchemy.engine import URL
-from sqlalchemy.orm import Session
+import csv
+import io
+from contextlib import asynccontextmanager, contextmanager
+
+import numpy as np
+from sqlalchemy import BigInteger, cast, create_engine, extract, func, inspect, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import URL, CursorResult
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
 
 import lib.logger as logger
 from lib.db.models import BASE
+from lib.db.models.schema import CryptoPrice
+
+
+class BaseClient(object):
+    DRIVER = "postgresql"
 
+    def __init__(self, db_name, host, user_name, password, pool_size=5,
+                 max_overflow=10, pool_timeout=30, pool_recycle=1800):
+        """Initialize the DB client. Connections come from a pool of the
+        engine and every operation runs in a session of its own, which
+        commits when it succeeds and rolls back when it fails.
 
-class Client(object):
-    def __init__(self, db_name, host, user_name, password):
+        Args:
+          db_name (str): DB Name
+          host (str): DB Host
+          user_name (str): Username to access DB
+          password (str): Password to access DB
+          pool_size (int): Connections kept open in the pool. Default: 5
+          max_overflow (int): Connections opened beyond pool_size when all
+                              pooled ones are in use. Default: 10
+          pool_timeout (int): Seconds to wait for a connection when all are
+                              in use. Default: 30
+          pool_recycle (int): Seconds after which a pooled connection is
+                              replaced, before the server or a proxy drops
+                              it. Default: 1800
+        """
         self.db_name = db_name
         self.host = host
         self.user_name = user_name
         self.password = password
         self.url = URL.create(
-            drivername="postgresql",
+            drivername=self.DRIVER,
             username=self.user_name,
             host=self.host,
             database=self.db_name,
             password=self.password)
+        # Connections are checked before being handed out, so that a DB
+        # restart costs a reconnect rather than a failed operation
+        self.engine_options = dict(
+            pool_size=pool_size, max_overflow=max_overflow,
+            pool_timeout=pool_timeout, pool_recycle=pool_recycle,
+            pool_pre_ping=True)
         self.engine = None
-        self.session = None
+        self.session_factory = None
+
+    @staticmethod
+    def _upsert_statement(table, objects, index_elements, update_columns):
+        statement = pg_insert(table).values(objects)
+        if update_columns:
+            return statement.on_conflict_do_update(
+                index_elements=index_elements,
+                set_={column: statement.excluded[column]
+                      for column in update_columns})
+        return statement.on_conflict_do_nothing(index_elements=index_elements)
+
+    @staticmethod
+    def _rows(table, columns, output):
+        if columns:
+            return [dict(zip(columns, entry)) for entry in output]
+        # Only the mapped columns, not the ORM state of the instances
+        keys = [attribute.key for attribute in inspect(table).column_attrs]
+        return [{key: getattr(entry, key) for key in keys}
+                for entry in output]
+
+
+class Client(BaseClient):
 
     def connect(self):
         logger.DEBUG(f"Attempting connection {self.url}")
-        self.engine = create_engine(self.url)
-        self.engine.connect()
+        self.engine = create_engine(self.url, **self.engine_options)
+        with self.engine.connect():
+            pass
         logger.DEBUG("Connection successful")
-        self.session = Session(self.engine)
-        logger.DEBUG("Session Established")
+        self.session_factory = sessionmaker(self.engine)
 
-    def create_all_tables(self):
-        with self.session:
+    def close(self):
+        self.engine.dispose()
+
+    @contextmanager
+    def session(self):
+        """A session of its own for one operation, committed at the end or
+        rolled back on error"""
+        with self.session_factory() as session:
             try:
-                # Generate schema
-                BASE.metadata.create_all(self.engine)
-                self.session.commit()
-                logger.DEBUG(f"connected & db populated")
+                yield session
+                session.commit()
             except Exception as e:
-                self.session.rollback()
+                session.rollback()
                 logger.ERROR(e)
                 raise e
 
+    def create_all_tables(self):
+        # Generate schema
+        BASE.metadata.create_all(self.engine)
+        logger.DEBUG(f"connected & db populated")
+
     def insert(self, table, objects, ignore_duplicates=False):
-        with self.session:
-            try:
-                self.session.bulk_insert_mappings(table, objects)
-                self.session.commit()
-                logger.DEBUG(f"Added objects")
-            except Exception as e:
-                if isinstance(e, IntegrityError) and ignore_duplicates:
-                    logger.DEBUG("Ignoring Duplicate inserts exception"
-                                 " as ignore_duplicates=True")
-                else:
-                    self.session.rollback()
-                    logger.ERROR(e)
-                    raise e
+        try:
+            with self.session() as session:
+                session.bulk_insert_mappings(table, objects)
+            logger.DEBUG(f"Added objects")
+        except IntegrityError as e:
+            if not ignore_duplicates:
+                raise e
+            logger.DEBUG("Ignoring Duplicate inserts exception"
+                         " as ignore_duplicates=True")
+
+    def copy_insert(self, table, objects, ignore_duplicates=True,
+                    batch_size=10000, on_inserted=None):
+        """Bulk loads the given objects through Postgres COPY.
+
+        With ignore_duplicates, the objects are copied into a temporary
+        staging table first and merged into the table with
+        ON CONFLICT DO NOTHING, so rows violating a unique constraint are
+        skipped instead of failing the whole load. Otherwise they are
+        copied directly into the table, which is only safe when no
+        duplicates are possible.
+
+        Args:
+          table (class): Model class of the target table
+          objects (list): Dicts mapping column names to values, all with
+                          the same keys
+          ignore_duplicates (bool): Skip rows that conflict with existing
+                                    ones. Default: True
+          batch_size (int): Number of rows sent per COPY. Default: 10000
+          on_inserted (list): SQL statements run as part of the merge, which
+                              read the rows that actually got inserted from
+                              'inserted'. Useful to keep derived tables in
+                              sync. Needs ignore_duplicates.
+
+        Returns:
+          tuple: Number of inserted rows and number of skipped rows
+        """
+        if on_inserted and not ignore_duplicates:
+            raise ValueError("on_inserted needs ignore_duplicates")
+        if not objects:
+            return 0, 0
+        table_name = table.__tablename__
+        columns = ", ".join(objects[0].keys())
+        connection = self.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            target = table_name
+            if ignore_duplicates:
+                target = f"{table_name}_staging"
+                cursor.execute(
+                    f"CREATE TEMPORARY TABLE {target} ON COMMIT DROP AS "
+                    f"SELECT {columns} FROM {table_name} WITH NO DATA")
+            for start in range(0, len(objects), batch_size):
+                cursor.copy_expert(
+                    f"COPY {target} ({columns}) FROM STDIN WITH (FORMAT csv)",
+                    self._to_csv(objects[start:start + batch_size]))
+            inserted = len(objects)
+            if ignore_duplicates:
+                derived = "".join(
+                    f", derived_{index} AS ({statement})"
+                    for index, statement in enumerate(on_inserted or []))
+                cursor.execute(
+                    f"WITH inserted AS (INSERT INTO {table_name} ({columns}) "
+                    f"SELECT {columns} FROM {target} ON CONFLICT DO NOTHING "
+                    f"RETURNING {columns}){derived} "
+                    f"SELECT count(*) FROM inserted")
+                inserted = cursor.fetchone()[0]
+            connection.commit()
+            logger.DEBUG(f"Copied {inserted} objects into {table_name}")
+        except Exception as e:
+            connection.rollback()
+            logger.ERROR(e)
+            raise e
+        finally:
+            connection.close()
+        return inserted, len(objects) - inserted
+
+    @staticmethod
+    def _to_csv(objects):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for entry in objects:
+            writer.writerow(entry.values())
+        buffer.seek(0)
+        return buffer
+
+    def upsert(self, table, objects, index_elements, update_columns=None):
+        """Inserts the given objects with a single INSERT ... ON CONFLICT
+        statement.
+
+        Args:
+          table (class): Model class of the target table
+          objects (list): Dicts mapping column names to values
+          index_elements (list): Columns of the unique index that decides
+                                 whether a row already exists
+          update_columns (list): Columns to overwrite in the already
+                                 existing rows. If not given, existing rows
+                                 are left untouched.
+        """
+        if not objects:
+            return
+        with self.session() as session:
+            session.execute(self._upsert_statement(
+                table, objects, index_elements, update_columns))
+        logger.DEBUG(f"Upserted objects")
 
     def update(self, table, objects):
-        with self.session:
+        with self.session() as session:
+            session.bulk_update_mappings(table, objects)
+        logger.DEBUG(f"Updated objects")
+
+    def notify(self, channel, payload=""):
+        """Sends a Postgres notification to the sessions listening on the
+        channel. The payload must stay below 8000 bytes."""
+        with self.session() as session:
+            session.execute(select(func.pg_notify(channel, payload)))
+        logger.DEBUG(f"Notified {channel}")
+
+    def get_all(self, table, columns=None):
+        col_list = [getattr(table, name) for name in columns or []]
+        with self.session() as session:
+            output = session.execute(
+                select(*col_list) if col_list else select(table))
+            return self._rows(table, columns,
+                              output if columns else output.scalars())
+
+    def scan_prices(self, symbol, start, end, chunk_size=100000):
+        """Streams the prices of a symbol in a time range, in time order,
+        through a server-side cursor. Only one chunk is held in memory at a
+        time, so arbitrarily long ranges can be scanned. The connection
+        stays checked out until the generator is exhausted or closed.
+
+        Args:
+          symbol (str): Symbol to scan
+          start (datetime): Start of the range, inclusive
+          end (datetime): End of the range, exclusive
+          chunk_size (int): Rows per chunk. Default: 100000
+
+        Yields:
+          tuple: NumPy arrays of the timestamps (datetime64[us]) and the
+                 prices (float64) of up to chunk_size rows
+        """
+        # Timestamps come as integer microseconds, which converts to NumPy
+        # without going through a datetime object per row
+        statement = select(
+            cast(extract("epoch", CryptoPrice.datetime) * 1000000,
+                 BigInteger),
+            CryptoPrice.price
+        ).where(
+            CryptoPrice.symbol == symbol,
+            CryptoPrice.datetime >= start,
+            CryptoPrice.datetime < end
+        ).order_by(CryptoPrice.datetime)
+        with self.engine.connect() as connection:
+            result = connection.execution_options(
+                stream_results=True, max_row_buffer=chunk_size
+            ).execute(statement)
+            for rows in result.partitions(chunk_size):
+                timestamps = np.fromiter((row[0] for row in rows),
+                                         dtype=np.int64, count=len(rows))
+                prices = np.fromiter((row[1] for row in rows),
+                                     dtype=np.float64, count=len(rows))
+                yield timestamps.view("datetime64[us]"), prices
+
+
+class AsyncClient(BaseClient):
+    """Client on SQLAlchemy's asyncio engine, for concurrent DB work from an
+    event loop without a thread per operation. Needs asyncpg."""
+    DRIVER = "postgresql+asyncpg"
+
+    async def connect(self):
+        logger.DEBUG(f"Attempting connection {self.url}")
+        self.engine = create_async_engine(self.url, **self.engine_options)
+        async with self.engine.connect():
+            pass
+        logger.DEBUG("Connection successful")
+        self.session_factory = async_sessionmaker(self.engine)
+
+    async def close(self):
+        await self.engine.dispose()
+
+    @asynccontextmanager
+    async def session(self):
+        """A session of its own for one operation, committed at the end or
+        rolled back on error"""
+        async with self.session_factory() as session:
             try:
-                self.session.bulk_update_mappings(table, objects)
-                self.session.commit()
-                logger.DEBUG(f"Updated objects")
+                yield session
+                await session.commit()
             except Exception as e:
-                self.session.rollback()
+                await session.rollback()
                 logger.ERROR(e)
                 raise e
 
-    def get_all(self, table, columns=None):
-        result = []
-        if columns:
-            col_list = list(map(lambda name: getattr(table, name), columns))
-            output = self.session.query(*col_list).all()
-            for entry in output:
-                result.append(dict(zip(col_list, entry)))
-        else:
-            output = self.session.query(table).all()
-            for entry in output:
-                result.append(vars(entry))
-        return result
+    async def execute(self, statement, params=None):
+        """Executes the statement in a session of its own
+
+        Returns:
+          list: The result rows, if the statement returns any
+        """
+        async with self.session() as session:
+            result = await session.execute(statement, params)
+            # Only plain statements may return no rows, ORM ones always do
+            if isinstance(result, CursorResult) and not result.returns_rows:
+                return []
+            return result.all()
+
+    async def insert(self, table, objects):
+        if not objects:
+            return
+        async with self.session() as session:
+            await session.execute(pg_insert(table), objects)
+        logger.DEBUG(f"Added objects")
+
+    async def upsert(self, table, objects, index_elements,
+                     update_columns=None):
+        """Async version of Client.upsert"""
+        if not objects:
+            return
+        async with self.session() as session:
+            await session.execute(self._upsert_statement(
+                table, objects, index_elements, update_columns))
+        logger.DEBUG(f"Upserted objects")
+
+    async def get_all(self, table, columns=None):
+        col_list = [getattr(table, name) for name in columns or []]
+        async with self.session() as session:
+            output = await session.execute(
+                select(*col_list) if col_list else select(table))
+            return self._rows(table, columns,
+                              output if columns else output.scalars())
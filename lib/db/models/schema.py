@@ -1,4 +1,5 @@
-from sqlalchemy import DateTime, Column, Integer, String, Float
+from sqlalchemy import (DateTime, Column, Integer, String, Float,
+                        UniqueConstraint)
 from lib.db.models import BASE
 
 
@@ -30,6 +31,65 @@ class LatestCryptoPrice(BASE):
         self.datetime = datetime
 
 
+class CryptoPriceBar(BASE):
+    __tablename__ = "crypto_price_bar"
+    __table_args__ = (
+        UniqueConstraint("symbol", "interval", "datetime",
+                         name="unique_symbol_interval_datetime"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    symbol = Column(String(20))
+    # Bar interval in seconds
+    interval = Column(Integer)
+    # Start of the bar interval
+    datetime = Column(DateTime())
+    open = Column(Float())
+    high = Column(Float())
+    low = Column(Float())
+    close = Column(Float())
+    volume = Column(Float())
+    vwap = Column(Float())
+    trade_count = Column(Integer)
+
+    def __init__(self, symbol, interval, datetime, open, high, low, close,
+                 volume, vwap, trade_count):
+        self.symbol = symbol
+        self.interval = interval
+        self.datetime = datetime
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.vwap = vwap
+        self.trade_count = trade_count
+
+
+class CryptoPriceRollup(BASE):
+    __tablename__ = "crypto_price_rollup"
+    __table_args__ = (
+        UniqueConstraint("symbol", "resolution", "datetime",
+                         name="unique_symbol_resolution_datetime"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    symbol = Column(String(20))
+    # Bucket size in seconds
+    resolution = Column(Integer)
+    # Start of the bucket
+    datetime = Column(DateTime())
+    price_count = Column(Integer)
+    price_sum = Column(Float())
+    price_sum_of_squares = Column(Float())
+    price_min = Column(Float())
+    price_max = Column(Float())
+    first_price = Column(Float())
+    first_datetime = Column(DateTime())
+    last_price = Column(Float())
+    last_datetime = Column(DateTime())
+
+
 class Settings(BASE):
     __tablename__ = 'settings'
     name = Column(String, primary_key=True)
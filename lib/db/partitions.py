@@ -0,0 +1,427 @@
+"""Rolling range partitions of crypto_price.
+
+Partitions are created ahead of time at day, week (ISO weeks, from Monday)
+or month granularity, and partitions whose data is older than the
+retention are detached, or dropped. Ranges that are already covered by an
+existing partition are left alone, so partitions created by other means
+can coexist with these.
+
+Partitions older than the compaction age are downsampled to the average
+price of every symbol in each bucket. The compacted rows are built into a
+temporary table, the partition is truncated and filled with them, so no
+space is left to vacuum. The rollups keep the statistics of all the raw
+prices, which is why only partitions whose prices are all rolled up are
+compacted. The ranges of the compacted partitions, as their comments record
+them, are kept in the settings for the API to label the prices it serves
+from them.
+
+The data receiver creates partitions ahead when it starts and every hour
+after that. Compaction, retention and the pruning check are run with:
+
+    PYTHONPATH=. python lib/db/partitions.py -o <host> -n <db> -u <user> \\
+        -p <password> --compact_after_days 30 --retention_days 365 --check
+"""
+
+import argparse
+import json
+import re
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+import lib.logger as logger
+from lib.db import rollup
+from lib.db.client import Client
+
+TABLE = "crypto_price"
+GRANULARITIES = ("day", "week", "month")
+# Comment marking a compacted partition, with the bucket size in seconds
+COMPACTED = "compacted:%d"
+# Settings entry holding the ranges of the compacted partitions, as a JSON
+# list of [start, end, bucket seconds], end being exclusive
+COMPACTED_RANGES_SETTING = "compacted_ranges"
+
+_BOUND = re.compile(r"FOR VALUES FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def period_start(dt, granularity):
+    """Returns the start of the period of the given granularity that the
+    given time falls into"""
+    start = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "week":
+        return start - timedelta(days=start.weekday())
+    if granularity == "month":
+        return start.replace(day=1)
+    return start
+
+
+def next_period(start, granularity):
+    if granularity == "week":
+        return start + timedelta(days=7)
+    if granularity == "month":
+        return (start + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def partition_name(start, end):
+    # Same naming as the generate_partition_name DB function, which names
+    # a partition by its first and last day
+    return "%s_%s_%s" % (TABLE, start.strftime("%Y_%m_%d"),
+                         (end - timedelta(seconds=1)).strftime("%Y_%m_%d"))
+
+
+def get_partitions(connection):
+    """Returns the range partitions of crypto_price
+
+    Returns:
+      list: (name, start, end) tuples sorted by start, end being exclusive
+    """
+    result = connection.execute(text(
+        "SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) "
+        "FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = CAST(:table AS regclass)"),
+        {"table": TABLE})
+    partitions = []
+    for name, bound in result:
+        match = _BOUND.search(bound)
+        # The default partition has no range
+        if match:
+            partitions.append((name,
+                               datetime.fromisoformat(match.group(1)),
+                               datetime.fromisoformat(match.group(2))))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def _uncovered(start, end, partitions):
+    # Sub-ranges of [start, end) that no existing partition covers
+    gaps = []
+    for _, partition_start, partition_end in partitions:
+        if partition_end <= start or partition_start >= end:
+            continue
+        if partition_start > start:
+            gaps.append((start, partition_start))
+        start = max(start, partition_end)
+    if start < end:
+        gaps.append((start, end))
+    return gaps
+
+
+def ensure_partitions(client, ahead_days=14, granularity="week", now=None):
+    """Creates the partitions needed from the current period up to
+    'ahead_days' from now
+
+    Args:
+      client (Client): Connected DB client
+      ahead_days (int): How far ahead partitions should exist.
+                        Default: 14
+      granularity (str): One of GRANULARITIES. Default: week
+      now (datetime): Current time. Default: Now
+
+    Returns:
+      list: Names of the partitions created
+    """
+    now = now or datetime.now()
+    created = []
+    with client.engine.begin() as connection:
+        partitions = get_partitions(connection)
+        start = period_start(now, granularity)
+        while start <= now + timedelta(days=ahead_days):
+            end = next_period(start, granularity)
+            for gap_start, gap_end in _uncovered(start, end, partitions):
+                name = partition_name(gap_start, gap_end)
+                connection.execute(text(
+                    f'CREATE TABLE "{name}" PARTITION OF {TABLE} '
+                    f"FOR VALUES FROM ('{gap_start}') TO ('{gap_end}')"))
+                created.append(name)
+            start = end
+    for name in created:
+        logger.INFO(f"Created partition {name}")
+    return created
+
+
+def apply_retention(client, retention_days, drop=False, now=None):
+    """Detaches, or drops, the partitions holding only data older than
+    'retention_days'. Detached partitions stay around as plain tables.
+    The rollups of their data are kept either way.
+
+    Args:
+      client (Client): Connected DB client
+      retention_days (int): Days of data to keep
+      drop (bool): Drop the partitions instead of detaching them.
+                   Default: False
+      now (datetime): Current time. Default: Now
+
+    Returns:
+      list: Names of the partitions detached or dropped
+    """
+    cutoff = (now or datetime.now()) - timedelta(days=retention_days)
+    expired = []
+    with client.engine.begin() as connection:
+        for name, _, end in get_partitions(connection):
+            if end > cutoff:
+                continue
+            connection.execute(text(
+                f'ALTER TABLE {TABLE} DETACH PARTITION "{name}"'))
+            if drop:
+                connection.execute(text(f'DROP TABLE "{name}"'))
+            expired.append(name)
+    for name in expired:
+        logger.INFO(f"{'Dropped' if drop else 'Detached'} partition {name}")
+    return expired
+
+
+def get_compaction(connection, name):
+    """Returns the bucket size in seconds the partition was compacted to,
+    or None if it holds raw prices"""
+    comment = connection.execute(text(
+        "SELECT obj_description(CAST(:name AS regclass), 'pg_class')"),
+        {"name": f'"{name}"'}).scalar()
+    prefix = COMPACTED.split("%")[0]
+    if comment and comment.startswith(prefix):
+        return int(comment[len(prefix):])
+    return None
+
+
+def get_compacted_partitions(connection):
+    """Returns the compacted range partitions of crypto_price
+
+    Returns:
+      list: (name, start, end) tuples sorted by start, end being exclusive
+    """
+    return [(name, start, end)
+            for name, start, end in get_partitions(connection)
+            if get_compaction(connection, name) is not None]
+
+
+def get_compacted_ranges(connection):
+    """Returns the ranges of the compacted partitions, contiguous ones of
+    the same bucket size merged
+
+    Returns:
+      list: [start, end, bucket seconds] lists sorted by start, end being
+            exclusive
+    """
+    ranges = []
+    for name, start, end in get_partitions(connection):
+        bucket = get_compaction(connection, name)
+        if bucket is None:
+            continue
+        if ranges and ranges[-1][1] == start and ranges[-1][2] == bucket:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end, bucket])
+    return ranges
+
+
+def _update_compacted_ranges(connection):
+    # Derived from the comments of the partitions rather than kept up to
+    # date piecemeal, so a partition that was refused is never included
+    value = json.dumps([[start.isoformat(sep=" "), end.isoformat(sep=" "),
+                         bucket] for start, end, bucket
+                        in get_compacted_ranges(connection)])
+    connection.execute(text(
+        "INSERT INTO settings (name, value) VALUES (:name, :value) "
+        "ON CONFLICT (name) DO UPDATE SET value = excluded.value"),
+        {"name": COMPACTED_RANGES_SETTING, "value": value})
+
+
+def compact_partitions(client, compact_after_days, bucket_seconds=60,
+                       now=None):
+    """Downsamples the partitions holding only data older than
+    'compact_after_days' to the average price of every symbol in each
+    bucket of 'bucket_seconds', dated at the start of the bucket and with
+    the smallest id of the bucket's prices.
+
+    Only partitions whose prices are all rolled up are compacted, so that
+    the rollups still answer exactly for them. The others are left as they
+    are and logged.
+
+    Args:
+      client (Client): Connected DB client
+      compact_after_days (int): Age in days after which data is compacted
+      bucket_seconds (int): Bucket size in seconds. Default: 60, in line
+                            with the finest rollups
+      now (datetime): Current time. Default: Now
+
+    Returns:
+      list: Names of the partitions compacted
+    """
+    cutoff = (now or datetime.now()) - timedelta(days=compact_after_days)
+    with client.engine.connect() as connection:
+        # Compacting again would average averages of different weights
+        candidates = [
+            (name, start, end)
+            for name, start, end in get_partitions(connection)
+            if end <= cutoff and get_compaction(connection, name) is None]
+    compacted = []
+    for name, start, end in candidates:
+        result = _compact_partition(client, name, start, end, bucket_seconds)
+        if result is None:
+            continue
+        kept, removed = result
+        logger.INFO(f"Compacted partition {name}: kept {kept} rows, "
+                    f"removed {removed}")
+        compacted.append(name)
+    return compacted
+
+
+def _compact_partition(client, name, start, end, bucket_seconds):
+    staging = f"{name}_compacting"
+    with client.engine.begin() as connection:
+        # Inserts into the partition, e.g. of a late replay, wait for the
+        # compaction, so the rollups and the prices can't differ in between
+        connection.execute(text(f'LOCK TABLE "{name}" IN SHARE MODE'))
+        rollup_start = connection.execute(text(
+            "SELECT value FROM settings WHERE name = :name"),
+            {"name": rollup.ROLLUP_START_SETTING}).scalar()
+        if rollup_start is None or \
+                datetime.fromisoformat(rollup_start) > start:
+            logger.ERROR(f"Not compacting partition {name}, the rollups "
+                         f"start at {rollup_start}, after {start}")
+            return None
+        total = connection.execute(text(
+            f'SELECT count(*) FROM "{name}"')).scalar()
+        rolled_up = connection.execute(text(
+            "SELECT coalesce(sum(price_count), 0) FROM crypto_price_rollup "
+            "WHERE resolution = :resolution AND datetime >= :start "
+            "AND datetime < :end"),
+            {"resolution": min(rollup.RESOLUTIONS), "start": start,
+             "end": end}).scalar()
+        if rolled_up != total:
+            logger.ERROR(f"Not compacting partition {name}, its rollups "
+                         f"count {rolled_up} prices instead of {total}")
+            return None
+        connection.execute(text(
+            f'CREATE TEMPORARY TABLE "{staging}" ON COMMIT DROP AS '
+            f"SELECT min(id) AS id, symbol, avg(price) AS price, "
+            f"date_bin(CAST(:bucket AS interval), datetime, "
+            f"TIMESTAMP '1970-01-01') AS datetime "
+            f'FROM "{name}" GROUP BY 2, 4'),
+            {"bucket": f"{bucket_seconds} seconds"})
+        kept = connection.execute(text(
+            f'SELECT count(*) FROM "{staging}"')).scalar()
+        # Truncating locks the partition only, unlike detaching it, and
+        # gives its space back right away
+        connection.execute(text(f'TRUNCATE "{name}"'))
+        # In time order, as the receiver inserts, which the BRIN index on
+        # datetime relies on to keep its block ranges narrow
+        connection.execute(text(
+            f'INSERT INTO "{name}" (id, symbol, price, datetime) '
+            f'SELECT id, symbol, price, datetime FROM "{staging}" '
+            f"ORDER BY datetime, symbol"))
+        connection.execute(text(
+            f'COMMENT ON TABLE "{name}" IS :comment'),
+            {"comment": COMPACTED % bucket_seconds})
+        _update_compacted_ranges(connection)
+    return kept, total - kept
+
+
+def check_pruning(client, start, end, symbol=None):
+    """Verifies that a range query as built by CryptoPriceFilter
+    (datetime >= start AND datetime <= end) only scans the partitions
+    overlapping the range
+
+    Args:
+      client (Client): Connected DB client
+      start (datetime): start_datetime of the query
+      end (datetime): end_datetime of the query
+      symbol (str): symbol of the query. Default: No symbol filter
+
+    Returns:
+      tuple: Sorted names of the partitions scanned and of the ones
+             expected to be scanned
+    """
+    where = "datetime >= :start AND datetime <= :end"
+    params = {"start": start, "end": end}
+    if symbol:
+        where += " AND symbol = :symbol"
+        params["symbol"] = symbol
+    with client.engine.connect() as connection:
+        plan = connection.execute(text(
+            f"EXPLAIN (FORMAT JSON) SELECT * FROM {TABLE} WHERE {where} "
+            f"ORDER BY datetime"), params).scalar()
+        expected = sorted(
+            name for name, partition_start, partition_end
+            in get_partitions(connection)
+            if partition_start <= end and partition_end > start)
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return sorted(_scanned_relations(plan[0]["Plan"])), expected
+
+
+def _scanned_relations(plan):
+    relations = set()
+    if "Relation Name" in plan:
+        relations.add(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        relations |= _scanned_relations(child)
+    return relations
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="A script to manage the partitions of crypto_price")
+    parser.add_argument("-o", "--db_host",
+                        help='DB Host',
+                        type=str, required=True)
+    parser.add_argument("-n", "--db_name",
+                        help='DB Name',
+                        type=str, required=True)
+    parser.add_argument("-u", "--db_user_name",
+                        help='Username to access DB',
+                        type=str, required=True)
+    parser.add_argument("-p", "--db_password",
+                        help='Password to access DB',
+                        type=str, required=True)
+    parser.add_argument("-g", "--granularity",
+                        help='Range of a partition. Default: week',
+                        choices=GRANULARITIES, default="week")
+    parser.add_argument("-a", "--ahead_days",
+                        help='Days ahead to create partitions for. '
+                             'Default: 14',
+                        type=int, default=14)
+    parser.add_argument("-c", "--compact_after_days",
+                        help='Downsample the partitions holding only data '
+                             'older than this many days. Default: Keep all '
+                             'prices',
+                        type=int, default=None)
+    parser.add_argument("-b", "--compact_bucket",
+                        help='Seconds of prices compacted into their average. '
+                             'Default: 60',
+                        type=int, default=60)
+    parser.add_argument("-r", "--retention_days",
+                        help='Detach the partitions holding only data older '
+                             'than this many days. Default: Keep everything',
+                        type=int, default=None)
+    parser.add_argument("--drop",
+                        help='Drop expired partitions instead of detaching '
+                             'them',
+                        required=False, action='store_true')
+    parser.add_argument("--check",
+                        help='Verify that a range query over the last day '
+                             'only scans the partitions it needs',
+                        required=False, action='store_true')
+    parsed_args = parser.parse_args()
+    db_client = Client(db_name=parsed_args.db_name,
+                       user_name=parsed_args.db_user_name,
+                       password=parsed_args.db_password,
+                       host=parsed_args.db_host)
+    db_client.connect()
+    ensure_partitions(db_client, ahead_days=parsed_args.ahead_days,
+                      granularity=parsed_args.granularity)
+    if parsed_args.compact_after_days is not None:
+        compact_partitions(db_client, parsed_args.compact_after_days,
+                           bucket_seconds=parsed_args.compact_bucket)
+    if parsed_args.retention_days is not None:
+        apply_retention(db_client, parsed_args.retention_days,
+                        drop=parsed_args.drop)
+    if parsed_args.check:
+        check_end = datetime.now()
+        scanned, expected = check_pruning(
+            db_client, check_end - timedelta(days=1), check_end)
+        if scanned != expected:
+            logger.ERROR(f"Partition pruning failed: scanned {scanned}, "
+                         f"expected {expected}")
+            raise SystemExit(1)
+        logger.INFO(f"Partition pruning works: scanned {scanned}")
@@ -0,0 +1,145 @@
+"""Rollups of crypto_price at 1 minute, 1 hour and 1 day resolution.
+
+Every bucket keeps the count, sum, sum of squares, min, max, first and last
+price, which is enough to answer count/average/standard deviation/range and
+percentage change queries over whole buckets exactly.
+
+The data receiver keeps the rollups up to date as part of every crypto_price
+insert (see ON_INSERTED). Data stored before that can be rolled up with:
+
+    PYTHONPATH=. python lib/db/rollup.py -o <host> -n <db> -u <user> \\
+        -p <password> --start 2024-04-01 --end 2024-05-01
+"""
+
+import argparse
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+import lib.logger as logger
+from lib.db.client import Client
+
+# Bucket size in seconds -> date_trunc field
+RESOLUTIONS = {60: "minute", 3600: "hour", 86400: "day"}
+
+# Settings entry holding the time from which on the rollups are complete
+ROLLUP_START_SETTING = "rollup_start_date"
+
+_ROLLUP = """
+INSERT INTO crypto_price_rollup (
+    symbol, resolution, datetime, price_count, price_sum,
+    price_sum_of_squares, price_min, price_max, first_price, first_datetime,
+    last_price, last_datetime)
+SELECT symbol, {resolution}, date_trunc('{field}', datetime), count(*),
+    sum(price), sum(price * price), min(price), max(price),
+    (array_agg(price ORDER BY datetime))[1], min(datetime),
+    (array_agg(price ORDER BY datetime DESC))[1], max(datetime)
+FROM {source} {where}
+GROUP BY symbol, date_trunc('{field}', datetime)
+ON CONFLICT (symbol, resolution, datetime) DO UPDATE SET
+    price_count = crypto_price_rollup.price_count + excluded.price_count,
+    price_sum = crypto_price_rollup.price_sum + excluded.price_sum,
+    price_sum_of_squares = crypto_price_rollup.price_sum_of_squares
+        + excluded.price_sum_of_squares,
+    price_min = LEAST(crypto_price_rollup.price_min, excluded.price_min),
+    price_max = GREATEST(crypto_price_rollup.price_max, excluded.price_max),
+    first_price = CASE
+        WHEN excluded.first_datetime < crypto_price_rollup.first_datetime
+        THEN excluded.first_price ELSE crypto_price_rollup.first_price END,
+    first_datetime = LEAST(crypto_price_rollup.first_datetime,
+                           excluded.first_datetime),
+    last_price = CASE
+        WHEN excluded.last_datetime > crypto_price_rollup.last_datetime
+        THEN excluded.last_price ELSE crypto_price_rollup.last_price END,
+    last_datetime = GREATEST(crypto_price_rollup.last_datetime,
+                             excluded.last_datetime)
+"""
+
+
+def rollup_statements(source, where=""):
+    """Returns one statement per resolution, merging the rows of 'source'
+    into the rollups"""
+    return [_ROLLUP.format(resolution=resolution, field=field,
+                           source=source, where=where)
+            for resolution, field in RESOLUTIONS.items()]
+
+
+# To be passed to Client.copy_insert for crypto_price, so that only the rows
+# which actually got inserted are rolled up, in the same transaction
+ON_INSERTED = rollup_statements("inserted")
+
+
+def rebuild(client, start, end):
+    """Recomputes the rollups of the days in [start, end) from crypto_price.
+    The rollups of compacted partitions are kept as they are, they were
+    computed from the raw prices.
+
+    Args:
+      client (Client): Connected DB client
+      start (datetime): First day to roll up
+      end (datetime): Day after the last day to roll up
+    """
+    # Imported here as partitions builds on this module
+    from lib.db import partitions
+
+    start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    end = end.replace(hour=0, minute=0, second=0, microsecond=0)
+    params = {"start": start, "end": end}
+    with client.engine.begin() as connection:
+        compacted = partitions.get_compacted_partitions(connection)
+        for name, partition_start, partition_end in compacted:
+            if partition_start < end and partition_end > start:
+                logger.INFO(f"Keeping the rollups of compacted partition "
+                            f"{name}")
+        for gap_start, gap_end in partitions._uncovered(start, end,
+                                                        compacted):
+            gap = {"start": gap_start, "end": gap_end}
+            connection.execute(text(
+                "DELETE FROM crypto_price_rollup "
+                "WHERE datetime >= :start AND datetime < :end"), gap)
+            for statement in rollup_statements(
+                    "crypto_price",
+                    "WHERE datetime >= :start AND datetime < :end"):
+                connection.execute(text(statement), gap)
+        connection.execute(text(
+            "INSERT INTO settings (name, value) "
+            "VALUES (:name, to_char(:start, 'YYYY-MM-DD HH24:MI:SS')) "
+            "ON CONFLICT (name) DO UPDATE SET value = to_char(LEAST("
+            "settings.value::timestamp, excluded.value::timestamp), "
+            "'YYYY-MM-DD HH24:MI:SS')"),
+            dict(params, name=ROLLUP_START_SETTING))
+    logger.INFO(f"Rebuilt rollups from {start} to {end}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="A script to roll up already stored crypto prices")
+    parser.add_argument("-o", "--db_host",
+                        help='DB Host',
+                        type=str, required=True)
+    parser.add_argument("-n", "--db_name",
+                        help='DB Name',
+                        type=str, required=True)
+    parser.add_argument("-u", "--db_user_name",
+                        help='Username to access DB',
+                        type=str, required=True)
+    parser.add_argument("-p", "--db_password",
+                        help='Password to access DB',
+                        type=str, required=True)
+    parser.add_argument("--start",
+                        help='First day to roll up, as YYYY-MM-DD',
+                        type=str, required=True)
+    parser.add_argument("--end",
+                        help='Last day to roll up, as YYYY-MM-DD. '
+                             'Default: today',
+                        type=str, default=None)
+    parsed_args = parser.parse_args()
+    db_client = Client(db_name=parsed_args.db_name,
+                       user_name=parsed_args.db_user_name,
+                       password=parsed_args.db_password,
+                       host=parsed_args.db_host)
+    db_client.connect()
+    end_date = (datetime.strptime(parsed_args.end, '%Y-%m-%d')
+                if parsed_args.end else datetime.now())
+    rebuild(db_client, datetime.strptime(parsed_args.start, '%Y-%m-%d'),
+            end_date + timedelta(days=1))
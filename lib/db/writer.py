@@ -0,0 +1,129 @@
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import lib.logger as logger
+
+# Overflow policies, applied when a write is submitted to a full queue
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+
+class Writer(object):
+    """Runs blocking DB writes on a dedicated thread so that the asyncio
+    loop is never stalled by a slow commit.
+
+    Writes are fed through a bounded queue and executed one at a time, in
+    submission order.
+    """
+
+    def __init__(self, max_queue_size=100, overflow_policy=BLOCK):
+        """Initialize Writer object
+
+        Args:
+          max_queue_size (int): Maximum number of writes waiting to be
+                                executed. Default: 100
+          overflow_policy (str): What to do when the queue is full.
+                                 'block' makes the submitter wait for a free
+                                 slot, 'drop_oldest' discards the oldest
+                                 pending write and 'drop_newest' discards the
+                                 write being submitted. Default: 'block'
+        """
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow_policy}")
+        self.max_queue_size = max_queue_size
+        self.overflow_policy = overflow_policy
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+        self.executor = ThreadPoolExecutor(max_workers=1,
+                                           thread_name_prefix="db-writer")
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    @property
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    async def submit(self, func, *args, on_dropped=None, on_failed=None,
+                     **kwargs):
+        """Queues func(*args, **kwargs) to be run on the writer thread
+
+        Args:
+          on_dropped (callable): Called without arguments on the event loop
+                                 if the write gets dropped because of
+                                 overflow, now or while it waits in the
+                                 queue. Default: None
+          on_failed (callable): Called without arguments on the event loop
+                                if the write raises. Default: None
+
+        Returns:
+          bool: False if the write got dropped because of overflow
+        """
+        job = (functools.partial(func, *args, **kwargs), on_dropped,
+               on_failed)
+        if not self.queue.full():
+            self.queue.put_nowait(job)
+            return True
+        if self.overflow_policy == BLOCK:
+            logger.DEBUG("DB write queue is full, waiting for a free slot")
+            await self.queue.put(job)
+            return True
+        self.dropped += 1
+        if self.overflow_policy == DROP_OLDEST:
+            logger.ERROR("DB write queue is full, dropping the oldest write")
+            dropped_job = self.queue.get_nowait()
+            self.queue.task_done()
+            self.queue.put_nowait(job)
+        else:
+            logger.ERROR("DB write queue is full, dropping the new write")
+            dropped_job = job
+        _, dropped_callback, _ = dropped_job
+        if dropped_callback is not None:
+            dropped_callback()
+        return dropped_job is not job
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            job, _, failed_callback = await self.queue.get()
+            start = time.monotonic()
+            try:
+                await loop.run_in_executor(self.executor, job)
+                self.written += 1
+            except Exception as e:
+                # Client already logged the details
+                self.failed += 1
+                logger.ERROR(f"DB write failed: {e}")
+                if failed_callback is not None:
+                    failed_callback()
+            finally:
+                self.last_flush_latency = time.monotonic() - start
+                self.max_flush_latency = max(self.max_flush_latency,
+                                             self.last_flush_latency)
+                self.total_flush_latency += self.last_flush_latency
+                self.queue.task_done()
+
+    async def drain(self):
+        await self.queue.join()
+
+    def stats(self):
+        completed = self.written + self.failed
+        return {
+            "queue_depth": self.queue_depth,
+            "written": self.written,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "last_flush_latency": self.last_flush_latency,
+            "max_flush_latency": self.max_flush_latency,
+            "avg_flush_latency": (self.total_flush_latency / completed
+                                  if completed else 0.0)
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -3,7 +3,6 @@
 import logging
 import os
 import sys
-import traceback
 from datetime import datetime
 
 
@@ -103,13 +102,22 @@ def DEBUG(msg):
     Args:
         msg(str): Message to be logged
     """
-    logging.app_logger.debug(msg, extra=__extra())
+    if logging.app_logger.isEnabledFor(logging.DEBUG):
+        logging.app_logger.debug(msg, extra=__extra())
+
+
+def is_debug_enabled():
+    """Tells whether DEBUG messages get logged, so that hot paths can skip
+    building them altogether
+    """
+    return logging.app_logger.isEnabledFor(logging.DEBUG)
 
 
 def __extra():
-    frame = traceback.extract_stack()[-3]
-    file_name = frame[0].split("/")[-1]
-    file_line = frame[1]
+    # Frame of the caller of INFO/ERROR/DEBUG
+    frame = sys._getframe(2)
+    file_name = frame.f_code.co_filename.split("/")[-1]
+    file_line = frame.f_lineno
     return {
         'file_line': "%s:%s" % (file_name, file_line)
     }
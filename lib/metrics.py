@@ -0,0 +1,178 @@
+"""Metrics in the Prometheus text format, served over HTTP from an asyncio
+event loop.
+
+Metrics are registered with a Registry and either updated as things happen
+(inc/set/observe) or read from a function at scrape time (set_function),
+which keeps the cost off hot paths that already count things their own way.
+"""
+
+import asyncio
+import bisect
+import threading
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Buckets of histograms of durations, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                    30, 60, 300)
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        if any(existing.name == metric.name for existing in self.metrics):
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Returns all metrics in the Prometheus text format"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.TYPE}")
+            for suffix, labels, value in metric.samples():
+                lines.append("%s%s%s %s" % (metric.name, suffix,
+                                            _format_labels(labels),
+                                            _format_value(value)))
+        return "\n".join(lines) + "\n"
+
+
+class Metric(object):
+    TYPE = None
+
+    def __init__(self, registry, name, documentation, label_names=()):
+        """Initialize Metric object and register it
+
+        Args:
+          registry (Registry): Registry to add the metric to
+          name (str): Metric name
+          documentation (str): Help text of the metric
+          label_names (tuple): Names of the labels of the metric.
+                               Default: No labels
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.function = None
+        self.lock = threading.Lock()
+        registry.register(self)
+
+    def set_function(self, function):
+        """Reads the values from the given function at scrape time instead.
+        Without labels it returns a value, otherwise a dict of label value
+        tuples to values."""
+        self.function = function
+
+    def samples(self):
+        if self.function is None:
+            with self.lock:
+                values = dict(self.values)
+        elif self.label_names:
+            values = self.function()
+        else:
+            values = {(): self.function()}
+        return [("", dict(zip(self.label_names, labels)), value)
+                for labels, value in values.items()]
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, amount=1, labels=()):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def set(self, value, labels=()):
+        with self.lock:
+            self.values[labels] = value
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(self, registry, name, documentation,
+                 buckets=DURATION_BUCKETS):
+        super(Histogram, self).__init__(registry, name, documentation)
+        self.buckets = tuple(sorted(buckets))
+        # One count per bucket plus one for +Inf, not cumulative
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += count
+            samples.append(("_bucket", {"le": _format_value(bound)},
+                            cumulative))
+        samples.append(("_sum", {}, total))
+        samples.append(("_count", {}, cumulative))
+        return samples
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (name, str(value).replace("\\", r"\\")
+                     .replace("\n", r"\n").replace('"', r'\"'))
+        for name, value in labels.items())
+
+
+def _format_value(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return "%.1f" % value
+    return repr(value)
+
+
+async def serve(registry, port, host="0.0.0.0"):
+    """Serves the metrics of the registry on http://host:port/metrics from
+    the running event loop
+
+    Args:
+      registry (Registry): Metrics to serve
+      port (int): Port to listen on
+      host (str): Address to listen on. Default: All addresses
+
+    Returns:
+      asyncio.Server: The server, to be closed when done
+    """
+    async def handle(reader, writer):
+        try:
+            request = await reader.readline()
+            # Headers are not needed
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request.split()
+            if len(parts) >= 2 and parts[1].split(b"?")[0] == b"/metrics":
+                status, body = "200 OK", registry.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+            writer.write(("HTTP/1.1 %s\r\nContent-Type: %s\r\n"
+                          "Content-Length: %d\r\nConnection: close\r\n\r\n" %
+                          (status, CONTENT_TYPE, len(body))).encode() + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
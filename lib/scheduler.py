@@ -0,0 +1,133 @@
+"""Flush scheduling for asyncio producers.
+
+FlushScheduler calls a flush function on a fixed grid of deadlines, so that
+the time spent flushing doesn't add up into drift, or as soon as a fixed
+number of items are pending, whichever comes first. Apart from that, it
+adapts the size of the batches the flushed items are written in to the
+write latency reported back to it.
+"""
+
+import asyncio
+
+DEADLINE = "deadline"
+SIZE = "size"
+
+# Weight of the latest observation in the average write rate
+RATE_SMOOTHING = 0.3
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class FlushScheduler(object):
+
+    def __init__(self, interval, batch_size=10000, write_batch_size=10000,
+                 min_write_batch_size=100, max_write_batch_size=50000,
+                 target_latency=None):
+        """Initialize FlushScheduler object
+
+        Args:
+          interval (float): Seconds between deadlines
+          batch_size (int): Number of pending items triggering a flush
+                            before the deadline. Default: 10000
+          write_batch_size (int): Initial number of items to write in one
+                                  batch. Default: 10000
+          min_write_batch_size (int): Lower bound of the adapted write
+                                      batch size. Default: 100
+          max_write_batch_size (int): Upper bound of the adapted write
+                                      batch size. Default: 50000
+          target_latency (float): Seconds writing a batch should take.
+                                  Default: Half the interval
+        """
+        self.interval = interval
+        self.batch_size = batch_size
+        self.write_batch_size = write_batch_size
+        self.min_write_batch_size = min_write_batch_size
+        self.max_write_batch_size = max_write_batch_size
+        self.target_latency = target_latency or interval / 2
+        self.pending = 0
+        self.wakeup = None
+        # Statistics
+        self.flushes = {DEADLINE: 0, SIZE: 0}
+        self.overruns = 0
+        self.missed_deadlines = 0
+        self.last_flush_duration = 0.0
+        self.max_flush_duration = 0.0
+        self.total_flush_duration = 0.0
+        self.write_rate = None
+
+    def add(self, count):
+        """Reports 'count' more pending items, flushing early once they
+        reach the batch size"""
+        self.pending += count
+        if self.pending >= self.batch_size and self.wakeup is not None:
+            _wake(self.wakeup)
+
+    def observe_latency(self, seconds, size):
+        """Reports that writing a batch of 'size' items took 'seconds',
+        adapting the write batch size so that a batch takes about
+        target_latency to write. The flush trigger stays as it is. May be
+        called from other threads."""
+        if not size or seconds <= 0:
+            return
+        rate = size / seconds
+        if self.write_rate is None:
+            self.write_rate = rate
+        else:
+            self.write_rate += RATE_SMOOTHING * (rate - self.write_rate)
+        self.write_batch_size = int(min(self.max_write_batch_size, max(
+            self.min_write_batch_size, self.write_rate * self.target_latency)))
+
+    async def run(self, func, *args, **kwargs):
+        """Calls 'func' on every deadline or early flush, awaiting it if it
+        returns a coroutine"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.interval
+        while True:
+            if self.pending < self.batch_size and loop.time() < deadline:
+                self.wakeup = loop.create_future()
+                timer = loop.call_at(deadline, _wake, self.wakeup)
+                await self.wakeup
+                timer.cancel()
+                self.wakeup = None
+            start = loop.time()
+            trigger = DEADLINE if start >= deadline else SIZE
+            self.pending = 0
+            result = func(*args, **kwargs)
+            if asyncio.iscoroutine(result):
+                await result
+            now = loop.time()
+            self.record_flush(trigger, now - start)
+            if trigger == DEADLINE:
+                deadline += self.interval
+            if now >= deadline:
+                # The flush ran past the next deadline, skip the deadlines
+                # missed rather than flushing back to back
+                missed = int((now - deadline) // self.interval) + 1
+                self.overruns += 1
+                self.missed_deadlines += missed
+                deadline += missed * self.interval
+
+    def record_flush(self, trigger, duration):
+        self.flushes[trigger] += 1
+        self.last_flush_duration = duration
+        self.max_flush_duration = max(self.max_flush_duration, duration)
+        self.total_flush_duration += duration
+
+    def stats(self):
+        flushes = sum(self.flushes.values())
+        return {
+            "batch_size": self.batch_size,
+            "write_batch_size": self.write_batch_size,
+            "deadline_flushes": self.flushes[DEADLINE],
+            "size_flushes": self.flushes[SIZE],
+            "overruns": self.overruns,
+            "missed_deadlines": self.missed_deadlines,
+            "last_flush_duration": self.last_flush_duration,
+            "max_flush_duration": self.max_flush_duration,
+            "avg_flush_duration": (self.total_flush_duration / flushes
+                                   if flushes else 0.0),
+            "write_rate": self.write_rate
+        }
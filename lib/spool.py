@@ -0,0 +1,192 @@
+"""Durable, append-only spool of records on local disk.
+
+Records are appended to memory-mapped segment files of a fixed size, a new
+segment being started whenever the current one is full. Consumers read
+records from a checkpoint on and commit a new checkpoint once they have
+processed them, after which fully consumed segments are removed.
+
+Records can be appended on one thread while they are read and committed on
+another. The positions and the open segment are only changed under a lock,
+and records are read from the segment files, whose part before the write
+position never changes.
+"""
+
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+# Every record is preceded by its length and CRC32. A zero length marks the
+# end of the data written to a segment.
+HEADER = struct.Struct("<II")
+SEGMENT_SUFFIX = ".seg"
+CHECKPOINT_FILE = "checkpoint"
+
+
+class Spool(object):
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024, sync=True):
+        """Initialize Spool object, picking up any records left behind by a
+        previous run
+
+        Args:
+          directory (str): Directory holding the segments and the checkpoint
+          segment_size (int): Size of a segment file in bytes.
+                              Default: 64 MiB
+          sync (bool): Flush appended records to disk before returning.
+                       Default: True
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.sync = sync
+        self.lock = threading.Lock()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.checkpoint = self._load_checkpoint()
+        segments = self._segments()
+        segment = segments[-1] if segments else self.checkpoint[0]
+        self._open_segment(segment)
+        # (segment, offset) right after the last appended record
+        self.write_position = (segment, self._scan(segment))
+
+    def append(self, records):
+        """Appends the given records
+
+        Args:
+          records (list): Records as bytes
+        """
+        for record in records:
+            if 2 * HEADER.size + len(record) > self.segment_size:
+                raise ValueError(f"Record of {len(record)} bytes does not fit "
+                                 f"in a segment")
+        with self.lock:
+            segment, offset = self.write_position
+            for record in records:
+                size = HEADER.size + len(record)
+                if offset + size + HEADER.size > self.segment_size:
+                    self._sync()
+                    segment, offset = segment + 1, 0
+                    self._open_segment(segment)
+                # The header goes in last so that a torn write is never
+                # taken for a record
+                self.mmap[offset + HEADER.size:offset + size] = record
+                self.mmap[offset:offset + HEADER.size] = HEADER.pack(
+                    len(record), zlib.crc32(record))
+                offset += size
+            self._sync()
+            self.write_position = (segment, offset)
+
+    def read(self, position, max_records):
+        """Reads records appended after the given position
+
+        Args:
+          position (tuple): (segment, offset) to read from, usually the
+                            checkpoint
+          max_records (int): Maximum number of records to return
+
+        Returns:
+          tuple: List of records and the position right after the last one
+        """
+        records = []
+        segment, offset = position
+        with self.lock:
+            write_segment, write_offset = self.write_position
+        while len(records) < max_records and \
+                (segment, offset) < (write_segment, write_offset):
+            path = self._segment_path(segment)
+            with open(path, "rb") as f:
+                while len(records) < max_records:
+                    if segment == write_segment and offset >= write_offset:
+                        break
+                    f.seek(offset)
+                    length, crc = HEADER.unpack(f.read(HEADER.size))
+                    if not length:
+                        break
+                    records.append(f.read(length))
+                    offset += HEADER.size + length
+            if len(records) < max_records and segment < write_segment:
+                segment, offset = segment + 1, 0
+        return records, (segment, offset)
+
+    def commit(self, position):
+        """Records that everything before the given position is processed
+        and removes the segments which are not needed anymore"""
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        with self.lock:
+            if position <= self.checkpoint:
+                return
+            with open(path + ".tmp", "w") as f:
+                f.write("%d %d\n" % position)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+            self.checkpoint = position
+            for segment in self._segments():
+                if segment < position[0]:
+                    os.remove(self._segment_path(segment))
+
+    @property
+    def pending(self):
+        with self.lock:
+            return self.checkpoint < self.write_position
+
+    @property
+    def pending_bytes(self):
+        # Segment space from the checkpoint to the last appended record,
+        # including the unused ends of full segments
+        with self.lock:
+            (segment, offset), (write_segment, write_offset) = \
+                self.checkpoint, self.write_position
+        return (write_segment - segment) * self.segment_size + \
+            write_offset - offset
+
+    def close(self):
+        with self.lock:
+            self._sync()
+            self.mmap.close()
+            self.file.close()
+
+    def _load_checkpoint(self):
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        if not os.path.exists(path):
+            segments = self._segments()
+            return (segments[0] if segments else 0, 0)
+        with open(path) as f:
+            segment, offset = f.read().split()
+        return int(segment), int(offset)
+
+    def _segments(self):
+        return sorted(int(name[:-len(SEGMENT_SUFFIX)])
+                      for name in os.listdir(self.directory)
+                      if name.endswith(SEGMENT_SUFFIX))
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory,
+                            "%012d%s" % (segment, SEGMENT_SUFFIX))
+
+    def _open_segment(self, segment):
+        if getattr(self, "mmap", None):
+            self.mmap.close()
+            self.file.close()
+        self.file = open(self._segment_path(segment), "a+b")
+        if os.fstat(self.file.fileno()).st_size < self.segment_size:
+            self.file.truncate(self.segment_size)
+        self.mmap = mmap.mmap(self.file.fileno(), self.segment_size)
+
+    def _scan(self, segment):
+        # Finds the end of the valid records, a record cut short by a crash
+        # fails its CRC check and is overwritten by the next append
+        offset = 0
+        while offset + HEADER.size <= self.segment_size:
+            length, crc = HEADER.unpack_from(self.mmap, offset)
+            end = offset + HEADER.size + length
+            if not length or end > self.segment_size or \
+                    zlib.crc32(self.mmap[offset + HEADER.size:end]) != crc:
+                break
+            offset = end
+        return offset
+
+    def _sync(self):
+        if self.sync:
+            self.mmap.flush()
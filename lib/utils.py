@@ -2,5 +2,22 @@ import asyncio
 
 async def every(seconds: float, func, *args, **kwargs):
     while True:
-        func(*args, **kwargs)
-        await asyncio.sleep(seconds)
\ No newline at end of file
+        result = func(*args, **kwargs)
+        # Coroutine functions are awaited before the next round
+        if asyncio.iscoroutine(result):
+            await result
+        await asyncio.sleep(seconds)
+
+
+def shard(items, count):
+    """Splits the given items into at most 'count' round-robin shards
+
+    Args:
+      items (list): Items to be distributed
+      count (int): Number of shards wanted
+
+    Returns:
+      list: Non-empty lists of items, one per shard
+    """
+    count = max(1, min(count, len(items)))
+    return [items[index::count] for index in range(count)]
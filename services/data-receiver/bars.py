@@ -0,0 +1,111 @@
+from array import array
+from datetime import datetime
+
+
+class BarAggregator(object):
+    """Aggregates every trade into open/high/low/close/volume/VWAP bars of
+    a fixed interval, per symbol.
+
+    The bar being built for each symbol lives in a slot of flat arrays
+    instead of per-symbol dicts, which keeps the per-trade work down to a
+    few indexed updates.
+    """
+
+    def __init__(self, symbols, interval):
+        """Initialize BarAggregator object
+
+        Args:
+          symbols (list): Symbols to build bars for
+          interval (int): Bar interval in seconds
+        """
+        self.interval = interval
+        self.slots = {symbol: slot for slot, symbol in enumerate(symbols)}
+        self.symbols = list(symbols)
+        size = len(self.symbols)
+        # Start of the bar interval in epoch seconds, -1 when no bar is open
+        self.starts = array('q', [-1] * size)
+        # Start of the last completed bar, -1 when there is none
+        self.completed_starts = array('q', [-1] * size)
+        self.opens = array('d', [0.0] * size)
+        self.highs = array('d', [0.0] * size)
+        self.lows = array('d', [0.0] * size)
+        self.closes = array('d', [0.0] * size)
+        self.volumes = array('d', [0.0] * size)
+        # Sum of price * quantity, for the VWAP
+        self.notionals = array('d', [0.0] * size)
+        self.counts = array('q', [0] * size)
+        # Trades left out as late for their bar
+        self.late_trades = array('q', [0] * size)
+        self.completed = []
+
+    def add(self, slot, timestamp, price, quantity):
+        """Adds a trade to the bar of its symbol
+
+        Args:
+          slot (int): Slot of the symbol of the trade, see self.slots
+          timestamp (int): Trade time in epoch milliseconds
+          price (float): Trade price
+          quantity (float): Traded quantity
+        """
+        start = timestamp // 1000 // self.interval * self.interval
+        # Trades of a symbol mostly arrive in order. One from before the
+        # open bar belongs to a bar completed already, it is left out and
+        # counted rather than filed under a later interval.
+        if start < self.starts[slot] or start <= self.completed_starts[slot]:
+            self.late_trades[slot] += 1
+            return
+        if start > self.starts[slot]:
+            if self.starts[slot] >= 0:
+                self._complete(slot)
+            self.starts[slot] = start
+            self.opens[slot] = price
+            self.highs[slot] = price
+            self.lows[slot] = price
+            self.volumes[slot] = 0.0
+            self.notionals[slot] = 0.0
+            self.counts[slot] = 0
+        elif price > self.highs[slot]:
+            self.highs[slot] = price
+        elif price < self.lows[slot]:
+            self.lows[slot] = price
+        self.closes[slot] = price
+        self.volumes[slot] += quantity
+        self.notionals[slot] += price * quantity
+        self.counts[slot] += 1
+
+    def take_completed(self, now):
+        """Returns the completed bars and forgets about them. Bars whose
+        interval has already passed are completed as well, so that a symbol
+        without new trades doesn't hold back its last bar.
+
+        Args:
+          now (float): Current time in epoch seconds
+
+        Returns:
+          list: Bars as dicts of crypto_price_bar columns
+        """
+        for slot in range(len(self.symbols)):
+            if 0 <= self.starts[slot] and \
+                    self.starts[slot] + self.interval <= now:
+                self._complete(slot)
+                self.starts[slot] = -1
+        completed = self.completed
+        self.completed = []
+        return completed
+
+    def _complete(self, slot):
+        self.completed_starts[slot] = self.starts[slot]
+        volume = self.volumes[slot]
+        self.completed.append({
+            "symbol": self.symbols[slot],
+            "interval": self.interval,
+            "datetime": datetime.fromtimestamp(self.starts[slot]),
+            "open": self.opens[slot],
+            "high": self.highs[slot],
+            "low": self.lows[slot],
+            "close": self.closes[slot],
+            "volume": volume,
+            "vwap": (self.notionals[slot] / volume if volume
+                     else self.closes[slot]),
+            "trade_count": self.counts[slot]
+        })
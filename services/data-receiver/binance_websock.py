@@ -1,103 +1,328 @@
 import argparse
 import asyncio
+import functools
+import json
+import math
+import os
 import re
-from binance import AsyncClient, BinanceSocketManager
-from datetime import datetime, timedelta
+import time
+from array import array
+from datetime import datetime
 from pprint import pformat
 
 import lib.logger as logger
+import lib.metrics as metrics
 from lib.db.client import Client
-from lib.db.models.schema import CryptoPrice, LatestCryptoPrice, Settings
-from lib.utils import every
+from lib.db import partitions, rollup
+from lib.db.models.schema import (CryptoPrice, CryptoPriceBar,
+                                  LatestCryptoPrice, Settings)
+from lib.db.writer import BLOCK, OVERFLOW_POLICIES, Writer
+from lib.scheduler import FlushScheduler
+from lib.spool import Spool
+from lib.utils import every, shard
+
+import records
+from bars import BarAggregator
+from sources import BinanceSource, ReplaySource, recv_batch
+
+# Binance allows up to 1024 streams on a combined stream connection, but all
+# of them go into the connection URL, which gets too long well before that
+MAX_STREAMS_PER_CONNECTION = 200
+# Maximum number of received messages handled in one go
+MESSAGE_BATCH_SIZE = 500
+# Maximum number of spooled records written to DB in one transaction, the
+# batch size adapted to the write latency stays below it
+SPOOL_BATCH_SIZE = 50000
+# How often to check that the crypto_price partitions ahead exist, in seconds
+PARTITION_CHECK_INTERVAL = 3600
+# Channel notified with the updated latest prices after every flush
+LATEST_PRICE_CHANNEL = "latest_price"
+# Postgres limits notification payloads to 8000 bytes
+MAX_NOTIFY_PAYLOAD = 8000
 
 
 class DataReceiver(object):
 
     def __init__(self, api_key, api_secret, interval, symbols,
                  db_name, db_host, db_user_name, db_password,
-                 db_update_interval):
+                 db_update_interval, combined_stream=False,
+                 stream_connections=1, db_write_queue_size=100,
+                 db_write_overflow_policy=BLOCK, spool_dir=None,
+                 spool_segment_size=64, source=None, metrics_port=None,
+                 partition_granularity="week", partition_ahead_days=14,
+                 flush_batch_size=10000):
         self.api_key = api_key
         self.api_secret = api_secret
         self.symbols = re.split(r'\s*,\s*', symbols)
         self.capture_interval = interval
         self.db_update_interval = db_update_interval
-        self.last_recorded = {}
-        for symbol in self.symbols:
-            self.last_recorded[symbol] = {
-                "dt": datetime.now().replace(microsecond=0),
-                "price": None,
-                "id": None
-            }
-
-        # asyncio.run can be used if no other eventloops of asyncio are running
-        client = asyncio.run(AsyncClient.create(self.api_key, self.api_secret))
-        self.bm = BinanceSocketManager(client)
+        self.combined_stream = combined_stream
+        self.stream_connections = max(
+            stream_connections,
+            math.ceil(len(self.symbols) / MAX_STREAMS_PER_CONNECTION))
+        # Every trade goes into a bar of the capture interval
+        self.bars = BarAggregator(self.symbols, self.capture_interval)
+        # Time in epoch seconds and price of the last captured trade of each
+        # symbol, indexed by the same slots as the bars
+        self.slots = self.bars.slots
+        self.last_recorded_times = array(
+            'q', [int(time.time())] * len(self.symbols))
+        self.last_recorded_prices = [None] * len(self.symbols)
+        # Symbols with a new price since the last flush
+        self.dirty_symbols = set()
+        # Whether a drain of the spool is queued and not started yet
+        self.drain_queued = False
+        # Flushes every db_update_interval, or early once flush_batch_size
+        # prices are captured. The spool is drained into DB in batches that
+        # follow the DB write latency, aiming for a write to take half the
+        # interval.
+        self.flush_scheduler = FlushScheduler(
+            db_update_interval, batch_size=flush_batch_size,
+            write_batch_size=flush_batch_size,
+            max_write_batch_size=SPOOL_BATCH_SIZE)
+        self.metrics_port = metrics_port
+        self.init_metrics()
+        self.partition_granularity = partition_granularity
+        self.partition_ahead_days = partition_ahead_days
+
+        # Where the trade streams come from, Binance unless told otherwise
+        if source is None:
+            source = self.create_source()
+        self.source = source
         self.loop = asyncio.get_event_loop()
-        self.initialize_db(db_name, db_host, db_user_name, db_password)
+        # Captured trades as (symbol, epoch milliseconds, price), they are
+        # only turned into rows when flushing
         self.crypto_price_objects = []
+        self.initialize_storage(
+            db_name, db_host, db_user_name, db_password,
+            db_write_queue_size, db_write_overflow_policy, spool_dir,
+            spool_segment_size)
+
+    def create_source(self):
+        return BinanceSource.create(self.api_key, self.api_secret)
+
+    def initialize_storage(self, db_name, db_host, db_user_name, db_password,
+                           db_write_queue_size, db_write_overflow_policy,
+                           spool_dir, spool_segment_size):
+        self.initialize_db(db_name, db_host, db_user_name, db_password)
+        # DB writes run on the writer's thread so that slow commits
+        # don't hold up reading from the sockets
+        self.db_writer = Writer(max_queue_size=db_write_queue_size,
+                                overflow_policy=db_write_overflow_policy)
+        # Captured rows are spooled to disk before they go to DB, so that
+        # nothing is lost while DB is unavailable or across restarts
+        if spool_dir is None:
+            spool_dir = os.path.join(os.getcwd(), "spool")
+        self.spool = Spool(spool_dir,
+                           segment_size=spool_segment_size * 1024 * 1024)
+        if self.spool.pending:
+            logger.INFO("Spooled records of a previous run will be "
+                        "replayed to DB")
+        self.init_storage_metrics()
+
+    def init_metrics(self):
+        # The handler of every trade only counts into an array and observes
+        # once per batch, everything else is read when scraped
+        self.metrics = metrics.Registry()
+        self.message_counts = array('q', [0] * len(self.symbols))
+        metrics.Counter(
+            self.metrics, "receiver_messages_total",
+            "Trade messages received", ("symbol",)).set_function(
+            lambda: {(symbol,): self.message_counts[slot]
+                     for symbol, slot in self.slots.items()})
+        metrics.Counter(
+            self.metrics, "receiver_late_trades_total",
+            "Trades left out of the bars as their bar was completed "
+            "already", ("symbol",)).set_function(
+            lambda: {(symbol,): self.bars.late_trades[slot]
+                     for symbol, slot in self.slots.items()})
+        self.receive_lag_histogram = metrics.Histogram(
+            self.metrics, "receiver_receive_lag_seconds",
+            "Time from the exchange event to handling it, taken once per "
+            "message batch")
+        self.batch_size_histogram = metrics.Histogram(
+            self.metrics, "receiver_message_batch_size",
+            "Messages handled in one go",
+            buckets=(1, 2, 5, 10, 20, 50, 100, 200, MESSAGE_BATCH_SIZE))
+        metrics.Gauge(
+            self.metrics, "receiver_pending_trades",
+            "Captured prices waiting for the next flush").set_function(
+            lambda: len(self.crypto_price_objects))
+        metrics.Counter(
+            self.metrics, "receiver_reconnects_total",
+            "Reconnect attempts of the trade stream sockets").set_function(
+            lambda: self.source.reconnects)
+        metrics.Counter(
+            self.metrics, "receiver_flushes_total",
+            "Flushes by what triggered them", ("trigger",)).set_function(
+            lambda: {(trigger,): count for trigger, count
+                     in self.flush_scheduler.flushes.items()})
+        metrics.Counter(
+            self.metrics, "receiver_flush_overruns_total",
+            "Flushes that ran past the next deadline").set_function(
+            lambda: self.flush_scheduler.overruns)
+        metrics.Gauge(
+            self.metrics, "receiver_flush_batch_size",
+            "Captured prices triggering a flush before the deadline"
+            ).set_function(lambda: self.flush_scheduler.batch_size)
+        metrics.Gauge(
+            self.metrics, "receiver_db_write_batch_size",
+            "Most spooled records written to DB in one transaction, adapted "
+            "to the write latency").set_function(
+            lambda: self.flush_scheduler.write_batch_size)
+
+    def init_storage_metrics(self):
+        self.commit_lag_histogram = metrics.Histogram(
+            self.metrics, "receiver_commit_lag_seconds",
+            "Time from the trade to committing its price to DB, counted "
+            "from the start of the second of the trade")
+        self.flush_duration_histogram = metrics.Histogram(
+            self.metrics, "receiver_flush_duration_seconds",
+            "Time spent in flush_to_db on the event loop, including waiting "
+            "for room in the DB write queue")
+        self.db_write_duration_histogram = metrics.Histogram(
+            self.metrics, "receiver_db_write_duration_seconds",
+            "Duration of writing a batch of spooled records to DB")
+        self.db_write_records_histogram = metrics.Histogram(
+            self.metrics, "receiver_db_write_records",
+            "Spooled records written to DB in one transaction",
+            buckets=(10, 100, 1000, 10000, SPOOL_BATCH_SIZE))
+        metrics.Gauge(
+            self.metrics, "receiver_spool_pending_bytes",
+            "Spooled bytes not written to DB yet").set_function(
+            lambda: self.spool.pending_bytes)
+        metrics.Gauge(
+            self.metrics, "receiver_db_write_queue_depth",
+            "DB writes waiting to be executed").set_function(
+            lambda: self.db_writer.queue_depth)
+        metrics.Counter(
+            self.metrics, "receiver_db_writes_total",
+            "DB writes by result", ("result",)).set_function(
+            lambda: {(result,): self.db_writer.stats()[result]
+                     for result in ("written", "failed", "dropped")})
 
     def initialize_db(self, db_name, db_host, db_user_name, db_password):
+        # Once running, the writer thread is the only one using DB
         self.db_client = Client(db_name=db_name, user_name=db_user_name,
-                                password=db_password, host=db_host)
+                                password=db_password, host=db_host,
+                                pool_size=2, max_overflow=2)
         self.db_client.connect()
         self.db_client.create_all_tables()
-        # To initialize table with rows for each symbol so that later
-        # we can always do "update" operation
-        self.db_client.insert(LatestCryptoPrice, self.get_latest_crypto_price_objects(),
-                              ignore_duplicates=True)
-        rows = self.db_client.get_all(LatestCryptoPrice)
-        for row in rows:
-            self.last_recorded[row["symbol"]]["id"] = row["id"]
+        if self.partition_ahead_days:
+            self.ensure_partitions()
+        # To initialize table with a row for each symbol so that the symbol
+        # is known as supported right away. Rows of symbols that were
+        # tracked before are left as they are.
+        self.db_client.upsert(
+            LatestCryptoPrice, self.get_latest_crypto_price_objects(self.symbols),
+            index_elements=["symbol"])
         self.initialize_settings()
 
     def initialize_settings(self):
         dt = datetime.now().replace(microsecond=0)
-        self.db_client.insert(
+        # Rollups are maintained along with every insert from now on
+        self.db_client.upsert(
             Settings,
-            [{"name": "data_collection_start_date", "value": dt}],
-            ignore_duplicates=True
+            [{"name": "data_collection_start_date", "value": dt},
+             {"name": rollup.ROLLUP_START_SETTING, "value": dt}],
+            index_elements=["name"]
         )
 
-    def handle_socket_message(self, msg):
-        symbol = msg['s']
-        timestamp = msg['T']
-        price = msg['p']
-        trade_dt = datetime.fromtimestamp(
-            timestamp / 1e3).replace(microsecond=0)
-
-        if trade_dt >= self.last_recorded[symbol]["dt"] + timedelta(seconds=self.capture_interval):
-            self.last_recorded[symbol]["dt"] = trade_dt
-            self.last_recorded[symbol]["price"] = price
-        else:
-            # Nothing to do, as for this interval of the time, data was already
-            # captured for the respective symbol.
-            return
+    def ensure_partitions(self):
+        # crypto_price inserts fail for times no partition covers
+        partitions.ensure_partitions(
+            self.db_client, ahead_days=self.partition_ahead_days,
+            granularity=self.partition_granularity)
 
-        # Create DB object
-        self.crypto_price_objects.append(
-            {
-                "symbol": symbol,
-                "price": price,
-                "datetime": trade_dt
-            }
-        )
-        logger.DEBUG(f"{trade_dt}: {symbol} ----> {price}")
+    async def schedule_ensure_partitions(self):
+        await self.db_writer.submit(self.ensure_partitions)
+
+    def handle_socket_messages(self, msgs):
+        # Runs for every single trade, so the per-symbol state is kept in
+        # arrays and trade times are compared as integers
+        slots = self.slots
+        add_to_bar = self.bars.add
+        last_times = self.last_recorded_times
+        last_prices = self.last_recorded_prices
+        interval = self.capture_interval
+        captured = self.crypto_price_objects
+        dirty_symbols = self.dirty_symbols
+        message_counts = self.message_counts
+        debug = logger.is_debug_enabled()
+        pending = len(captured)
+        if msgs:
+            self.batch_size_histogram.observe(len(msgs))
+            self.receive_lag_histogram.observe(
+                time.time() - msgs[-1]['E'] / 1e3)
+        for msg in msgs:
+            symbol = msg['s']
+            timestamp = msg['T']
+            price = msg['p']
+            slot = slots[symbol]
+            message_counts[slot] += 1
+            add_to_bar(slot, timestamp, float(price), float(msg['q']))
+            trade_time = timestamp // 1000
+            if trade_time < last_times[slot] + interval:
+                # Nothing to do, as for this interval of the time, data was
+                # already captured for the respective symbol.
+                continue
+            last_times[slot] = trade_time
+            last_prices[slot] = price
+            dirty_symbols.add(symbol)
+            captured.append((symbol, timestamp, price))
+            if debug:
+                logger.DEBUG(f"{datetime.fromtimestamp(trade_time)}: "
+                             f"{symbol} ----> {price}")
+        self.flush_scheduler.add(len(captured) - pending)
+
+    def handle_socket_message(self, msg):
+        self.handle_socket_messages((msg,))
 
     async def task_trade_socket(self, symbol):
-        ts = self.bm.trade_socket(symbol)
+        ts = self.source.trade_socket(symbol)
         async with ts as trade_socket:
             while True:
-                msg = await trade_socket.recv()
-                self.handle_socket_message(msg)
+                msgs = await recv_batch(trade_socket, MESSAGE_BATCH_SIZE)
+                self.handle_socket_messages(msgs)
 
-    def flush_to_db(self):
+    async def task_multiplex_socket(self, symbols):
+        streams = [f"{symbol.lower()}@trade" for symbol in symbols]
+        ms = self.source.multiplex_socket(streams)
+        async with ms as multiplex_socket:
+            while True:
+                trades = []
+                for msg in await recv_batch(multiplex_socket,
+                                            MESSAGE_BATCH_SIZE):
+                    # Combined stream events are wrapped as
+                    # {"stream": "<streamName>", "data": <rawPayload>}
+                    if "data" not in msg:
+                        logger.ERROR(f"Combined stream error: {msg}")
+                        continue
+                    trades.append(msg["data"])
+                self.handle_socket_messages(trades)
+
+    def get_symbol_shards(self):
+        return shard(self.symbols, self.stream_connections)
+
+    async def flush_to_db(self):
+        start = time.perf_counter()
         # No need for accessing self.crypto_price_objects with locks
-        # as here we are dealing with cooperative multitasking (Coro)
-        if self.crypto_price_objects:
-            logger.DEBUG("Inserting %d records in DB" %
-                         (len(self.crypto_price_objects)))
-            self.db_client.insert(CryptoPrice, self.crypto_price_objects)
-            self.crypto_price_objects = []
+        # as here we are dealing with cooperative multitasking (Coro).
+        # Captured rows are appended to the spool and the writer thread
+        # drains the spool into DB. Whatever it fails to write stays in the
+        # spool and is retried on the next flush, so memory use stays
+        # bounded while DB is unavailable.
+        spool_records = self.take_spool_records()
+        if spool_records:
+            logger.DEBUG("Spooling %d records" % len(spool_records))
+            self.spool.append(spool_records)
+        # A drain writes everything spooled by the time it runs, so there
+        # is no need for another one while one is still waiting in the
+        # queue, e.g. when DB hangs
+        if self.spool.pending and not self.drain_queued:
+            self.drain_queued = True
+            await self.db_writer.submit(self.drain_spool,
+                                        on_dropped=self.drain_dropped)
         # Updating current latest price in a separate table so that
         # its super quick for the callers who need this info.
         # Indexing would be highly inefficient as the data gets updated for
@@ -106,38 +331,157 @@ class DataReceiver(object):
         # Also even to update the latest data in a separate table, triggers
         # were not chosen as we dont want the latest value to be updated for every
         # row insert, rather it should be done once for every group of objects
-        # added together.
-        if self.last_recorded[self.symbols[0]]["price"]:
+        # added together. Only the symbols that got a new price since the
+        # last flush are upserted, in a single statement.
+        if self.dirty_symbols:
+            dirty_symbols = self.dirty_symbols
+            latest_crypto_price_objects = self.get_latest_crypto_price_objects(
+                dirty_symbols)
+            self.dirty_symbols = set()
             logger.DEBUG("Updating latest price table with data:\n%s" %
-                         pformat(self.last_recorded, indent=2))
-            self.db_client.update(
-                LatestCryptoPrice, self.get_latest_crypto_price_objects())
+                         pformat(latest_crypto_price_objects, indent=2))
+            # Should either write be dropped by the overflow policy or fail,
+            # e.g. while DB is down, the symbols are upserted and notified
+            # again on the next flush rather than staying stale until their
+            # next trade
+            mark_dirty = functools.partial(self.mark_dirty, dirty_symbols)
+            await self.db_writer.submit(
+                self.db_client.upsert, LatestCryptoPrice,
+                latest_crypto_price_objects, index_elements=["symbol"],
+                update_columns=["price", "datetime"],
+                on_dropped=mark_dirty, on_failed=mark_dirty)
+            # One notification per flush, whatever the number of listeners,
+            # for the webservers to push the new prices to their clients
+            await self.db_writer.submit(
+                self.db_client.notify, LATEST_PRICE_CHANNEL,
+                self.get_latest_price_payload(latest_crypto_price_objects),
+                on_dropped=mark_dirty, on_failed=mark_dirty)
+        logger.DEBUG("DB writer stats: %s" % self.db_writer.stats())
+        logger.DEBUG("Flush stats: %s" % self.flush_scheduler.stats())
+        self.flush_duration_histogram.observe(time.perf_counter() - start)
+
+    def mark_dirty(self, symbols):
+        self.dirty_symbols.update(symbols)
+
+    def drain_dropped(self):
+        self.drain_queued = False
 
-    def get_latest_crypto_price_objects(self):
+    def take_spool_records(self):
+        # The captured trades and the completed bars as spool records
+        spool_records = [
+            records.encode_price(symbol, timestamp // 1000, price)
+            for symbol, timestamp, price in self.crypto_price_objects]
+        self.crypto_price_objects = []
+        spool_records.extend(records.encode_bar(bar)
+                             for bar in self.bars.take_completed(time.time()))
+        return spool_records
+
+    def drain_spool(self):
+        # Runs on the writer thread. The checkpoint only moves past the
+        # records once they are committed. Should a replay write some of
+        # them again, the inserts skip the rows that already exist.
+        # Records spooled from here on get a drain queued again, should
+        # this one miss them.
+        self.drain_queued = False
+        while True:
+            spool_records, position = self.spool.read(
+                self.spool.checkpoint, self.flush_scheduler.write_batch_size)
+            if not spool_records:
+                break
+            start = time.perf_counter()
+            rows = {records.CRYPTO_PRICE: [], records.CRYPTO_PRICE_BAR: []}
+            for record in spool_records:
+                kind, row = records.decode(record)
+                rows[kind].append(row)
+            logger.DEBUG("Inserting %d records in DB" % len(spool_records))
+            self.insert_crypto_prices(rows[records.CRYPTO_PRICE])
+            self.db_client.copy_insert(CryptoPriceBar,
+                                       rows[records.CRYPTO_PRICE_BAR])
+            self.spool.commit(position)
+            duration = time.perf_counter() - start
+            self.flush_scheduler.observe_latency(duration, len(spool_records))
+            self.db_write_duration_histogram.observe(duration)
+            self.db_write_records_histogram.observe(len(spool_records))
+            now = time.time()
+            for row in rows[records.CRYPTO_PRICE]:
+                self.commit_lag_histogram.observe(
+                    now - row["datetime"].timestamp())
+
+    def insert_crypto_prices(self, crypto_price_objects):
+        # Runs on the writer thread. Rows already present in the table,
+        # e.g. when a batch gets retried, are skipped rather than failing
+        # the whole batch on the unique (symbol, datetime) constraint.
+        # The 1m/1h/1d rollups are updated from the inserted rows only, so
+        # they never count a row twice.
+        inserted, skipped = self.db_client.copy_insert(
+            CryptoPrice, crypto_price_objects,
+            on_inserted=rollup.ON_INSERTED)
+        if skipped:
+            logger.INFO("Skipped %d duplicate records out of %d" %
+                        (skipped, inserted + skipped))
+
+    def get_latest_crypto_price_objects(self, symbols):
         latest_crypto_price_objects = []
-        for symbol, details in self.last_recorded.items():
-            data = {
+        for symbol in symbols:
+            slot = self.slots[symbol]
+            latest_crypto_price_objects.append({
                 "symbol": symbol,
-                "price": details["price"],
-                "datetime": details["dt"],
-            }
-            if details["id"]:
-                data["id"] = details["id"]
-            latest_crypto_price_objects.append(data)
+                "price": self.last_recorded_prices[slot],
+                "datetime": datetime.fromtimestamp(
+                    self.last_recorded_times[slot]),
+            })
         return latest_crypto_price_objects
 
+    @staticmethod
+    def get_latest_price_payload(latest_crypto_price_objects):
+        # The updated prices, or nothing when they don't fit in a
+        # notification, in which case listeners read latest_crypto_price
+        payload = json.dumps([
+            [entry["symbol"], entry["price"], entry["datetime"].isoformat()]
+            for entry in latest_crypto_price_objects], separators=(",", ":"))
+        if len(payload.encode()) >= MAX_NOTIFY_PAYLOAD:
+            return ""
+        return payload
+
     def do_work(self):
         try:
-            for symbol in self.symbols:
-                asyncio.ensure_future(self.task_trade_socket(symbol=symbol))
-            asyncio.ensure_future(
-                every(self.db_update_interval, self.flush_to_db))
+            if self.metrics_port:
+                self.metrics_server = self.loop.run_until_complete(
+                    metrics.serve(self.metrics, self.metrics_port))
+                logger.INFO("Serving metrics on port %d" % self.metrics_port)
+            self.start_socket_tasks()
+            self.start_storage_tasks()
             self.loop.run_forever()
         except KeyboardInterrupt:
             logger.INFO("Keyboard Interrupt received")
         finally:
             logger.INFO("Closing Loop")
             self.loop.close()
+            self.close_storage()
+
+    def start_socket_tasks(self):
+        if self.combined_stream:
+            for symbols in self.get_symbol_shards():
+                logger.INFO("Opening combined stream for %d symbols" %
+                            len(symbols))
+                asyncio.ensure_future(
+                    self.task_multiplex_socket(symbols=symbols))
+        else:
+            for symbol in self.symbols:
+                asyncio.ensure_future(self.task_trade_socket(symbol=symbol))
+
+    def start_storage_tasks(self):
+        asyncio.ensure_future(self.db_writer.run())
+        asyncio.ensure_future(self.flush_scheduler.run(self.flush_to_db))
+        if self.partition_ahead_days:
+            asyncio.ensure_future(
+                every(PARTITION_CHECK_INTERVAL,
+                      self.schedule_ensure_partitions))
+
+    def close_storage(self):
+        self.db_writer.close()
+        self.spool.close()
+        self.db_client.close()
 
 
 if __name__ == "__main__":
@@ -145,10 +489,26 @@ if __name__ == "__main__":
         description="A script to capture data for cryptocurrency symbols from Binance")
     parser.add_argument("-k", "--api_key",
                         help='API Key to access Binance APIs',
-                        type=str, required=True)
+                        type=str, default=None)
     parser.add_argument("-s", "--api_secret",
                         help='Secret Key to access Binance APIs',
-                        type=str, required=True)
+                        type=str, default=None)
+    parser.add_argument("-a", "--record_file",
+                        help='File to record the received trade streams in, '
+                             'for replaying them later',
+                        type=str, default=None)
+    parser.add_argument("-f", "--replay_file",
+                        help='Replay the trades recorded in this file instead '
+                             'of receiving them from Binance',
+                        type=str, default=None)
+    parser.add_argument("-g", "--synthetic",
+                        help='Generate synthetic trades instead of receiving '
+                             'them from Binance',
+                        required=False, action='store_true')
+    parser.add_argument("-e", "--replay_rate",
+                        help='Trades per second to replay or generate, 0 for '
+                             'as fast as possible. Default: 100',
+                        type=float, default=100)
     parser.add_argument("-c", "--cryptocurrency_symbols",
                         help='List of Cryptocurrency symbols separated by comma',
                         type=str, default="BNBBTC,BTCUSDT,ETHUSDT")
@@ -159,6 +519,56 @@ if __name__ == "__main__":
                         help='Interval for updating the captured price data '
                              'to DB in seconds. Default: 5',
                         type=int, default=5)
+    parser.add_argument("-m", "--combined_stream",
+                        help='Multiplex the trade streams of all symbols over '
+                             'combined stream connections instead of opening '
+                             'one connection per symbol',
+                        required=False, action='store_true')
+    parser.add_argument("-t", "--stream_connections",
+                        help='Number of combined stream connections the '
+                             'symbols are sharded across. Default: 1',
+                        type=int, default=1)
+    parser.add_argument("-q", "--db_write_queue_size",
+                        help='Maximum number of DB writes waiting to be '
+                             'executed. Default: 100',
+                        type=int, default=100)
+    parser.add_argument("-w", "--db_write_overflow_policy",
+                        help='What to do with a DB write when the write queue '
+                             'is full. Default: block',
+                        choices=OVERFLOW_POLICIES, default=BLOCK)
+    parser.add_argument("-l", "--spool_dir",
+                        help='Directory to spool the captured data in until '
+                             'it is stored in DB. Default: Current working '
+                             'dir/spool',
+                        type=str, default=None)
+    parser.add_argument("-z", "--spool_segment_size",
+                        help='Size of a spool segment file in MiB. Default: 64',
+                        type=int, default=64)
+    parser.add_argument("-j", "--workers",
+                        help='Number of worker processes to capture the '
+                             'trades in, the symbols being hash partitioned '
+                             'across them. Default: 0, capture in this '
+                             'process',
+                        type=int, default=0)
+    parser.add_argument("-x", "--metrics_port",
+                        help='Port to serve Prometheus metrics on at '
+                             '/metrics. Default: No metrics served',
+                        type=int, default=None)
+    parser.add_argument("-b", "--partition_granularity",
+                        help='Range of a crypto_price partition. '
+                             'Default: week',
+                        choices=partitions.GRANULARITIES, default="week")
+    parser.add_argument("-y", "--partition_ahead_days",
+                        help='Days ahead to create crypto_price partitions '
+                             'for, 0 to leave partitions alone. Default: 14',
+                        type=int, default=14)
+    parser.add_argument("-v", "--flush_batch_size",
+                        help='Number of captured prices flushing them before '
+                             'the next db_update_interval, and the initial '
+                             'number of spooled records written to DB in one '
+                             'transaction, which follows the DB write '
+                             'latency from then on. Default: 10000',
+                        type=int, default=10000)
     parser.add_argument("-o", "--db_host",
                         help='DB Host',
                         type=str, required=True)
@@ -174,10 +584,14 @@ if __name__ == "__main__":
     parser.add_argument("-d", "--debug", help="Enable debug messages",
                         required=False, action='store_true')
     parsed_args = parser.parse_args()
+    replay = parsed_args.replay_file or parsed_args.synthetic
+    if not replay and not (parsed_args.api_key and parsed_args.api_secret):
+        parser.error("--api_key and --api_secret are required to receive "
+                     "trades from Binance")
     if parsed_args.debug:
         logger.setup_logging(log_level="DEBUG")
     logger.INFO("configuration: %s" % pformat(vars(parsed_args)))
-    receiver = DataReceiver(
+    receiver_options = dict(
         api_key=parsed_args.api_key,
         api_secret=parsed_args.api_secret,
         symbols=parsed_args.cryptocurrency_symbols,
@@ -186,6 +600,38 @@ if __name__ == "__main__":
         db_host=parsed_args.db_host,
         db_user_name=parsed_args.db_user_name,
         db_password=parsed_args.db_password,
-        db_update_interval=parsed_args.db_update_interval
+        db_update_interval=parsed_args.db_update_interval,
+        combined_stream=parsed_args.combined_stream,
+        stream_connections=parsed_args.stream_connections,
+        db_write_queue_size=parsed_args.db_write_queue_size,
+        db_write_overflow_policy=parsed_args.db_write_overflow_policy,
+        spool_dir=parsed_args.spool_dir,
+        spool_segment_size=parsed_args.spool_segment_size,
+        metrics_port=parsed_args.metrics_port,
+        partition_granularity=parsed_args.partition_granularity,
+        partition_ahead_days=parsed_args.partition_ahead_days,
+        flush_batch_size=parsed_args.flush_batch_size
     )
+    if parsed_args.workers:
+        # Imported here as it builds on this module
+        from supervisor import Supervisor
+        receiver = Supervisor(
+            workers=parsed_args.workers,
+            source_options=dict(replay_file=parsed_args.replay_file,
+                                synthetic=parsed_args.synthetic,
+                                replay_rate=parsed_args.replay_rate,
+                                record_file=parsed_args.record_file),
+            debug=parsed_args.debug,
+            **receiver_options)
+    else:
+        if replay:
+            stream_source = ReplaySource(
+                re.split(r'\s*,\s*', parsed_args.cryptocurrency_symbols),
+                rate=parsed_args.replay_rate,
+                replay_file=parsed_args.replay_file)
+        else:
+            stream_source = BinanceSource.create(
+                parsed_args.api_key, parsed_args.api_secret,
+                record_file=parsed_args.record_file)
+        receiver = DataReceiver(source=stream_source, **receiver_options)
     receiver.do_work()
@@ -0,0 +1,55 @@
+"""Binary encoding of the rows spooled by the data receiver.
+
+Every record starts with a one byte kind, followed by the fixed size fields
+of the row and the symbol as the remaining bytes.
+"""
+
+import struct
+from datetime import datetime
+
+CRYPTO_PRICE = 1
+CRYPTO_PRICE_BAR = 2
+
+# kind, epoch seconds, price
+_PRICE = struct.Struct("<Bqd")
+# kind, interval, epoch seconds, open, high, low, close, volume, vwap,
+# trade count
+_BAR = struct.Struct("<Bqqddddddq")
+
+
+def encode_price(symbol, timestamp, price):
+    """Encodes a crypto_price row given its trade time in epoch seconds"""
+    return _PRICE.pack(CRYPTO_PRICE, timestamp, float(price)) + symbol.encode()
+
+
+def encode_bar(bar):
+    return _BAR.pack(CRYPTO_PRICE_BAR, bar["interval"],
+                     int(bar["datetime"].timestamp()), bar["open"],
+                     bar["high"], bar["low"], bar["close"], bar["volume"],
+                     bar["vwap"], bar["trade_count"]) + bar["symbol"].encode()
+
+
+def decode(record):
+    """Returns the kind of the record and the row it holds, as a dict of
+    column values"""
+    if record[0] == CRYPTO_PRICE:
+        _, timestamp, price = _PRICE.unpack_from(record)
+        return CRYPTO_PRICE, {
+            "symbol": record[_PRICE.size:].decode(),
+            "price": price,
+            "datetime": datetime.fromtimestamp(timestamp)
+        }
+    (_, interval, timestamp, open_price, high, low, close, volume, vwap,
+     trade_count) = _BAR.unpack_from(record)
+    return CRYPTO_PRICE_BAR, {
+        "symbol": record[_BAR.size:].decode(),
+        "interval": interval,
+        "datetime": datetime.fromtimestamp(timestamp),
+        "open": open_price,
+        "high": high,
+        "low": low,
+        "close": close,
+        "volume": volume,
+        "vwap": vwap,
+        "trade_count": trade_count
+    }
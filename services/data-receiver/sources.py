@@ -0,0 +1,237 @@
+"""Sources of trade streams for DataReceiver.
+
+A source hands out sockets for the trade stream of a single symbol
+(trade_socket) and for combined trade streams of many symbols
+(multiplex_socket). Sockets are async context managers whose recv() returns
+the next decoded message, just like the ones of python-binance.
+recv_batch() returns whatever messages are already waiting on a socket,
+so that they can be handled in one go.
+"""
+
+import asyncio
+import itertools
+import json
+import random
+import time
+from binance import AsyncClient, BinanceSocketManager
+
+# python-binance drops the connection once 100 decoded messages are pending
+# in its queue, which a busy combined stream can reach in a few milliseconds.
+# This and recv_batch rely on internals of the sockets of the python-binance
+# version pinned in requirements.txt, tests/test_sources.py checks them.
+MULTIPLEX_QUEUE_SIZE = 10000
+
+
+async def recv_batch(socket, max_messages):
+    """Waits for the next message of the socket and returns it along with
+    the messages already received after it
+
+    Args:
+      socket (object): Socket handed out by a source
+      max_messages (int): Maximum number of messages to return
+
+    Returns:
+      list: Decoded messages
+    """
+    if hasattr(socket, "recv_batch"):
+        return await socket.recv_batch(max_messages)
+    msgs = [await socket.recv()]
+    # python-binance sockets queue up the messages they decoded, taking
+    # them from there directly saves a task and a timeout per message
+    queue = getattr(socket, "_queue", None)
+    if queue is not None:
+        while len(msgs) < max_messages and not queue.empty():
+            msgs.append(queue.get_nowait())
+    return msgs
+
+
+class BinanceSource(object):
+    """Trade streams from Binance, optionally recorded to a file that
+    ReplaySource can play back later"""
+
+    def __init__(self, bm, record_file=None):
+        """Initialize BinanceSource object
+
+        Args:
+          bm (BinanceSocketManager): Socket manager to open sockets with
+          record_file (str): File to append every received message to, one
+                             JSON document per line. Default: None
+        """
+        self.bm = bm
+        self.record_file = open(record_file, "a") if record_file else None
+        # Reconnect attempts of all sockets
+        self.reconnects = 0
+
+    @classmethod
+    def create(cls, api_key, api_secret, record_file=None):
+        # asyncio.run can be used if no other eventloops of asyncio are running
+        client = asyncio.run(AsyncClient.create(api_key, api_secret))
+        return cls(BinanceSocketManager(client), record_file=record_file)
+
+    def trade_socket(self, symbol):
+        return self._record(self._count_reconnects(
+            self.bm.trade_socket(symbol)))
+
+    def multiplex_socket(self, streams):
+        socket = self.bm.multiplex_socket(streams)
+        socket.MAX_QUEUE_SIZE = MULTIPLEX_QUEUE_SIZE
+        return self._record(self._count_reconnects(socket))
+
+    def _count_reconnects(self, socket):
+        # python-binance calls before_reconnect before every reconnect
+        # attempt of the socket
+        before_reconnect = socket.before_reconnect
+
+        async def counting_before_reconnect():
+            self.reconnects += 1
+            await before_reconnect()
+
+        socket.before_reconnect = counting_before_reconnect
+        return socket
+
+    def _record(self, socket):
+        if self.record_file:
+            return RecordingSocket(socket, self.record_file)
+        return socket
+
+
+class RecordingSocket(object):
+
+    def __init__(self, socket, record_file):
+        self.socket = socket
+        self.record_file = record_file
+
+    async def __aenter__(self):
+        await self.socket.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.record_file.flush()
+        return await self.socket.__aexit__(exc_type, exc_val, exc_tb)
+
+    async def recv(self):
+        msg = await self.socket.recv()
+        self.record_file.write(json.dumps(msg) + "\n")
+        return msg
+
+    async def recv_batch(self, max_messages):
+        msgs = await recv_batch(self.socket, max_messages)
+        self.record_file.writelines(json.dumps(msg) + "\n" for msg in msgs)
+        return msgs
+
+
+class ReplaySource(object):
+    """Plays recorded or synthetic trades in-process, without any network.
+
+    Recorded trades are replayed in a loop, with their trade and event
+    times set to the time they are played at.
+    """
+
+    def __init__(self, symbols, rate=0, replay_file=None):
+        """Initialize ReplaySource object
+
+        Args:
+          symbols (list): All symbols that will be asked for
+          rate (float): Total number of messages per second over all
+                        sockets, 0 for as fast as possible. Default: 0
+          replay_file (str): File recorded by BinanceSource to play.
+                             Synthetic trades are generated if not given.
+        """
+        self.symbols = symbols
+        self.rate = rate
+        self.recorded = None
+        # Replayed sockets never reconnect
+        self.reconnects = 0
+        if replay_file:
+            self.recorded = {}
+            with open(replay_file) as f:
+                for line in f:
+                    msg = json.loads(line)
+                    # Messages of combined streams are wrapped
+                    msg = msg.get("data", msg)
+                    if msg.get("e") == "trade":
+                        self.recorded.setdefault(msg["s"], []).append(msg)
+
+    def trade_socket(self, symbol):
+        return self._socket([symbol], combined=False)
+
+    def multiplex_socket(self, streams):
+        symbols = [stream.split("@")[0].upper() for stream in streams]
+        return self._socket(symbols, combined=True)
+
+    def _socket(self, symbols, combined):
+        rate = self.rate * len(symbols) / len(self.symbols)
+        if self.recorded is None:
+            trades = _synthetic_trades(symbols)
+        else:
+            recorded = [msg for symbol in symbols
+                        for msg in self.recorded.get(symbol, [])]
+            if not recorded:
+                raise ValueError(f"No recorded trades for {symbols}")
+            trades = itertools.cycle(recorded)
+        return ReplaySocket(trades, rate, combined)
+
+
+def _synthetic_trades(symbols):
+    prices = {symbol: random.uniform(10, 1000) for symbol in symbols}
+    for trade_id in itertools.count():
+        symbol = symbols[trade_id % len(symbols)]
+        prices[symbol] *= random.uniform(0.999, 1.001)
+        yield {
+            "e": "trade",
+            "s": symbol,
+            "t": trade_id,
+            "p": "%.8f" % prices[symbol],
+            "q": "%.5f" % random.uniform(0.001, 1),
+            "m": False,
+            "M": True
+        }
+
+
+class ReplaySocket(object):
+    # A socket which is behind schedule yields to the event loop at least
+    # every this many messages
+    YIELD_EVERY = 100
+
+    def __init__(self, trades, rate, combined):
+        self.trades = trades
+        self.interval = 1 / rate if rate else 0
+        self.combined = combined
+        self.count = 0
+        self.next_time = None
+
+    async def __aenter__(self):
+        self.next_time = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    async def recv(self):
+        return (await self.recv_batch(1))[0]
+
+    async def recv_batch(self, max_messages):
+        count = max_messages
+        if self.interval:
+            # The messages which are due by now, at least one
+            self.next_time += self.interval
+            delay = self.next_time - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                self.count, count = 0, 1
+            else:
+                count = min(max_messages, 1 + int(-delay / self.interval))
+                self.next_time += (count - 1) * self.interval
+        self.count += count
+        if self.count >= self.YIELD_EVERY:
+            self.count = 0
+            await asyncio.sleep(0)
+        now = int(time.time() * 1e3)
+        msgs = []
+        for _ in range(count):
+            msg = dict(next(self.trades))
+            msg["T"] = msg["E"] = now
+            if self.combined:
+                msg = {"stream": f"{msg['s'].lower()}@trade", "data": msg}
+            msgs.append(msg)
+        return msgs
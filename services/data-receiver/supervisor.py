@@ -0,0 +1,253 @@
+"""Multi-process ingestion: worker processes capture, the supervisor writes.
+
+The symbols are hash partitioned across worker processes, each running the
+capture side of DataReceiver on a core of its own. On every flush a worker
+sends what it captured to the supervisor as one compact batch over its
+pipe: spool records, the latest prices and counts for the metrics. The
+supervisor is the single writer. It spools the batches and writes them to
+DB the way a single process DataReceiver does. Workers that exit are
+restarted on a fresh pipe, so a batch cut short by a crash is never read.
+
+Every symbol is captured by exactly one worker, and the inserts skip rows
+that already exist, so restarts don't lead to duplicate rows.
+"""
+
+import asyncio
+import multiprocessing
+import time
+import zlib
+from array import array
+
+import lib.logger as logger
+import lib.metrics as metrics
+
+from binance_websock import DataReceiver
+from sources import BinanceSource, ReplaySource
+
+# Delay before restarting a worker, doubled while workers keep exiting
+# soon after being started
+WORKER_RESTART_DELAY = 1
+MAX_WORKER_RESTART_DELAY = 60
+# A worker that ran for this many seconds resets the restart delay
+WORKER_STABLE_TIME = 60
+# A worker whose pipe closed is checked for having exited every
+# WORKER_EXIT_POLL_INTERVAL seconds, and killed when still running after
+# WORKER_EXIT_TIMEOUT seconds
+WORKER_EXIT_POLL_INTERVAL = 0.1
+WORKER_EXIT_TIMEOUT = 5
+
+
+def shard_symbols(symbols, count):
+    """Hash partitions the symbols into 'count' shards. Unlike hash(), CRC32
+    gives every process the same partitioning.
+
+    Returns:
+      list: Lists of symbols, some of them possibly empty
+    """
+    shards = [[] for _ in range(count)]
+    for symbol in symbols:
+        shards[zlib.crc32(symbol.encode()) % count].append(symbol)
+    return shards
+
+
+class Samples(list):
+    """Collects observations to be sent to the supervisor in place of a
+    histogram"""
+    observe = list.append
+
+
+class WorkerSource(object):
+    """Stands in for the stream source of the supervisor, whose trades come
+    from the workers"""
+
+    def __init__(self):
+        self.reconnects = 0
+
+
+class ShardWorker(DataReceiver):
+    """Captures the trades of a shard of the symbols and sends them to the
+    supervisor instead of writing them to DB"""
+
+    def __init__(self, conn, **kwargs):
+        self.conn = conn
+        self.reported_reconnects = 0
+        super(ShardWorker, self).__init__(
+            db_name=None, db_host=None, db_user_name=None, db_password=None,
+            **kwargs)
+
+    def init_metrics(self):
+        super(ShardWorker, self).init_metrics()
+        self.receive_lag_histogram = Samples()
+        self.batch_size_histogram = Samples()
+
+    def initialize_storage(self, *args):
+        pass
+
+    def start_storage_tasks(self):
+        asyncio.ensure_future(self.flush_scheduler.run(self.send_batch))
+
+    def close_storage(self):
+        self.conn.close()
+
+    def send_batch(self):
+        latest = [(symbol, self.last_recorded_times[self.slots[symbol]],
+                   self.last_recorded_prices[self.slots[symbol]])
+                  for symbol in self.dirty_symbols]
+        self.dirty_symbols = set()
+        message_counts = self.message_counts
+        self.message_counts = array('q', [0] * len(self.symbols))
+        reconnects = self.source.reconnects - self.reported_reconnects
+        self.reported_reconnects = self.source.reconnects
+        batch = {
+            "records": self.take_spool_records(),
+            "latest": latest,
+            "messages": {symbol: message_counts[slot]
+                         for symbol, slot in self.slots.items()
+                         if message_counts[slot]},
+            "reconnects": reconnects,
+            "receive_lags": self.receive_lag_histogram,
+            "batch_sizes": self.batch_size_histogram
+        }
+        self.receive_lag_histogram = Samples()
+        self.batch_size_histogram = Samples()
+        try:
+            self.conn.send(batch)
+        except OSError as e:
+            # The supervisor is gone, nobody would store the trades
+            logger.ERROR(f"Sending to the supervisor failed: {e}")
+            self.loop.stop()
+
+
+def run_worker(conn, index, symbols, options, source_options, debug):
+    if debug:
+        logger.setup_logging(log_level="DEBUG")
+    if source_options.get("replay_file") or source_options.get("synthetic"):
+        source = ReplaySource(symbols, rate=source_options["replay_rate"],
+                              replay_file=source_options.get("replay_file"))
+    else:
+        record_file = source_options.get("record_file")
+        source = BinanceSource.create(
+            options["api_key"], options["api_secret"],
+            record_file=f"{record_file}.{index}" if record_file else None)
+    worker = ShardWorker(conn, symbols=",".join(symbols), source=source,
+                         **options)
+    worker.do_work()
+
+
+class Supervisor(DataReceiver):
+    """Runs the workers and writes what they capture to DB"""
+
+    def __init__(self, workers, source_options=None, debug=False, **kwargs):
+        """Initialize Supervisor object
+
+        Args:
+          workers (int): Number of worker processes
+          source_options (dict): replay_file, synthetic, replay_rate and
+                                 record_file options of the workers' sources
+          debug (bool): Enable debug messages in the workers
+          kwargs: Arguments of DataReceiver
+        """
+        self.worker_count = workers
+        self.source_options = dict(source_options or {})
+        self.debug = debug
+        self.worker_options = {
+            name: kwargs[name]
+            for name in ("api_key", "api_secret", "interval",
+                         "db_update_interval", "combined_stream",
+                         "stream_connections", "flush_batch_size")
+            if name in kwargs
+        }
+        # Spawned rather than forked, so that the workers don't inherit the
+        # DB connections and the event loop of the supervisor
+        self.context = multiprocessing.get_context("spawn")
+        self.processes = {}
+        self.started = {}
+        self.restart_delays = {}
+        super(Supervisor, self).__init__(source=WorkerSource(), **kwargs)
+        self.shards = [symbols for symbols in
+                       shard_symbols(self.symbols, self.worker_count)
+                       if symbols]
+        self.worker_restarts = metrics.Counter(
+            self.metrics, "receiver_worker_restarts_total",
+            "Worker processes restarted after exiting")
+
+    def start_socket_tasks(self):
+        for index in range(len(self.shards)):
+            self.start_worker(index)
+
+    def start_worker(self, index):
+        symbols = self.shards[index]
+        source_options = dict(self.source_options)
+        if source_options.get("replay_rate"):
+            # The rate is for all symbols together
+            source_options["replay_rate"] *= len(symbols) / len(self.symbols)
+        reader, writer = self.context.Pipe(duplex=False)
+        process = self.context.Process(
+            target=run_worker, name=f"worker-{index}", daemon=True,
+            args=(writer, index, symbols, self.worker_options, source_options,
+                  self.debug))
+        process.start()
+        # Only the worker keeps the sending end open, so that its exit
+        # shows as end of file here
+        writer.close()
+        self.processes[index] = process
+        self.started[index] = time.monotonic()
+        self.loop.add_reader(reader.fileno(), self.receive_batch, index,
+                             reader)
+        logger.INFO(f"Started worker {index} (pid {process.pid}) for "
+                    f"{len(symbols)} symbols")
+
+    def receive_batch(self, index, reader):
+        try:
+            batch = reader.recv()
+        except (EOFError, OSError):
+            self.loop.remove_reader(reader.fileno())
+            reader.close()
+            self.restart_worker(index)
+            return
+        if batch["records"]:
+            self.spool.append(batch["records"])
+            self.flush_scheduler.add(len(batch["records"]))
+        for symbol, trade_time, price in batch["latest"]:
+            slot = self.slots[symbol]
+            self.last_recorded_times[slot] = trade_time
+            self.last_recorded_prices[slot] = price
+            self.dirty_symbols.add(symbol)
+        for symbol, count in batch["messages"].items():
+            self.message_counts[self.slots[symbol]] += count
+        self.source.reconnects += batch["reconnects"]
+        for lag in batch["receive_lags"]:
+            self.receive_lag_histogram.observe(lag)
+        for size in batch["batch_sizes"]:
+            self.batch_size_histogram.observe(size)
+
+    def restart_worker(self, index):
+        self.reap_worker(index, self.processes.pop(index), time.monotonic())
+
+    def reap_worker(self, index, process, closed):
+        # The pipe closes before the worker is done exiting. It is polled
+        # for rather than joined, which would block the event loop.
+        if process.is_alive():
+            if time.monotonic() - closed >= WORKER_EXIT_TIMEOUT:
+                logger.ERROR(f"Worker {index} (pid {process.pid}) closed its "
+                             f"pipe but doesn't exit, killing it")
+                process.kill()
+                closed = time.monotonic()
+            self.loop.call_later(WORKER_EXIT_POLL_INTERVAL, self.reap_worker,
+                                 index, process, closed)
+            return
+        delay = self.restart_delays.get(index, WORKER_RESTART_DELAY)
+        if time.monotonic() - self.started[index] >= WORKER_STABLE_TIME:
+            delay = WORKER_RESTART_DELAY
+        self.restart_delays[index] = min(delay * 2, MAX_WORKER_RESTART_DELAY)
+        logger.ERROR(f"Worker {index} exited with code {process.exitcode}, "
+                     f"restarting it in {delay} seconds")
+        self.worker_restarts.inc()
+        self.loop.call_later(delay, self.start_worker, index)
+
+    def close_storage(self):
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            process.join()
+        super(Supervisor, self).close_storage()
@@ -0,0 +1,12 @@
+"""Tests of lib and the data receiver, run from the repository root with:
+
+    python -m unittest discover -s tests -t .
+"""
+
+import os
+import sys
+
+# The modules of the data receiver import each other as top-level modules
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "services", "data-receiver"))
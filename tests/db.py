@@ -0,0 +1,71 @@
+"""Scratch databases for the tests that need Postgres.
+
+The server is found through the DB_HOST, POSTGRES_NAME, POSTGRES_USER and
+POSTGRES_PASSWORD environment variables, like the webserver does, and the
+tests are skipped when it can't be reached. Every test case gets a database
+of its own, created from db/init-scripts/init.sql and dropped afterwards.
+"""
+
+import os
+import unittest
+
+import psycopg2
+from psycopg2 import sql
+
+INIT_SCRIPT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "db", "init-scripts", "init.sql")
+
+
+def connection_options():
+    return dict(host=os.environ.get("DB_HOST", "localhost"),
+                user_name=os.environ.get("POSTGRES_USER", "app"),
+                password=os.environ.get("POSTGRES_PASSWORD", "secret"))
+
+
+def connect(db_name):
+    """Connection in autocommit mode, for statements out of the clients"""
+    options = connection_options()
+    connection = psycopg2.connect(
+        dbname=db_name, host=options["host"], user=options["user_name"],
+        password=options["password"])
+    connection.autocommit = True
+    return connection
+
+
+class ScratchDatabase(object):
+    """Mixin for test cases, giving them a database named db_name, with the
+    tables of init.sql, and the options to connect to it"""
+
+    @classmethod
+    def setUpClass(cls):
+        super(ScratchDatabase, cls).setUpClass()
+        try:
+            admin = connect(os.environ.get("POSTGRES_NAME", "app_test"))
+        except psycopg2.OperationalError as e:
+            raise unittest.SkipTest(f"No database to test against: {e}")
+        cls.db_name = f"test_{cls.__name__.lower()}_{os.getpid()}"
+        with admin.cursor() as cursor:
+            cursor.execute(sql.SQL("DROP DATABASE IF EXISTS {}").format(
+                sql.Identifier(cls.db_name)))
+            cursor.execute(sql.SQL("CREATE DATABASE {}").format(
+                sql.Identifier(cls.db_name)))
+        admin.close()
+        connection = cls.connect()
+        with open(INIT_SCRIPT) as f, connection.cursor() as cursor:
+            cursor.execute(f.read())
+        connection.close()
+        cls.client_options = dict(db_name=cls.db_name, **connection_options())
+
+    @classmethod
+    def tearDownClass(cls):
+        admin = connect(os.environ.get("POSTGRES_NAME", "app_test"))
+        with admin.cursor() as cursor:
+            cursor.execute(sql.SQL("DROP DATABASE {} WITH (FORCE)").format(
+                sql.Identifier(cls.db_name)))
+        admin.close()
+        super(ScratchDatabase, cls).tearDownClass()
+
+    @classmethod
+    def connect(cls):
+        return connect(cls.db_name)
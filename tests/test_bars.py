@@ -0,0 +1,70 @@
+import unittest
+from datetime import datetime
+
+from bars import BarAggregator
+
+# 2024-04-01T00:00:00 in epoch seconds, local time as the bars are
+START = int(datetime(2024, 4, 1).timestamp())
+
+
+class BarAggregatorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.bars = BarAggregator(["BTCUSDT", "ETHUSDT"], 60)
+        self.slot = self.bars.slots["BTCUSDT"]
+
+    def add(self, seconds, price, quantity=1.0):
+        self.bars.add(self.slot, (START + seconds) * 1000, price, quantity)
+
+    def test_bar(self):
+        for seconds, price, quantity in ((1, 100.0, 1.0), (10, 110.0, 2.0),
+                                         (20, 90.0, 1.0), (59, 95.0, 4.0)):
+            self.add(seconds, price, quantity)
+        # The next interval completes the bar
+        self.add(60, 96.0)
+        bars = self.bars.take_completed(START + 61)
+        assert bars == [{
+            "symbol": "BTCUSDT", "interval": 60,
+            "datetime": datetime(2024, 4, 1), "open": 100.0,
+            "high": 110.0, "low": 90.0, "close": 95.0, "volume": 8.0,
+            "vwap": (100.0 + 220.0 + 90.0 + 380.0) / 8, "trade_count": 4
+        }], bars
+
+    def test_quiet_symbol(self):
+        self.add(1, 100.0)
+        assert self.bars.take_completed(START + 59) == []
+        # Completed once its interval has passed, without another trade
+        bars = self.bars.take_completed(START + 60)
+        assert [bar["datetime"] for bar in bars] == [datetime(2024, 4, 1)]
+        assert self.bars.take_completed(START + 120) == []
+
+    def test_straggler_in_open_bar(self):
+        self.add(59, 100.0)
+        self.add(61, 101.0)
+        # Late for the first bar, which was completed by the trade before
+        self.add(58, 99.0)
+        bars = self.bars.take_completed(START + 120)
+        assert [(bar["datetime"].minute, bar["trade_count"], bar["low"])
+                for bar in bars] == [(0, 1, 100.0), (1, 1, 101.0)], bars
+        assert self.bars.late_trades[self.slot] == 1
+
+    def test_straggler_after_completion(self):
+        self.add(30, 100.0)
+        bars = self.bars.take_completed(START + 61)
+        assert [bar["datetime"].minute for bar in bars] == [0]
+        # Late for the bar taken already, it is left out rather than
+        # opening the next bar
+        self.add(59, 99.0, 2.0)
+        assert self.bars.take_completed(START + 121) == []
+        self.add(62, 101.0)
+        self.add(121, 102.0)
+        bars = self.bars.take_completed(START + 121)
+        assert [(bar["datetime"].minute, bar["open"], bar["volume"],
+                 bar["trade_count"]) for bar in bars] == \
+            [(1, 101.0, 1.0, 1)], bars
+        self.add(119, 98.0)
+        bars = self.bars.take_completed(START + 180)
+        assert [(bar["datetime"].minute, bar["trade_count"])
+                for bar in bars] == [(2, 1)], bars
+        assert self.bars.late_trades[self.slot] == 2
+        assert self.bars.late_trades[self.bars.slots["ETHUSDT"]] == 0
@@ -0,0 +1,121 @@
+import unittest
+from datetime import datetime
+
+from sqlalchemy import exc, select, text
+
+from lib.db.client import AsyncClient, Client
+from lib.db.models.schema import LatestCryptoPrice
+from tests.db import ScratchDatabase
+
+NOW = datetime(2024, 4, 1, 12)
+
+
+class ClientTestCase(ScratchDatabase, unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client(pool_size=1, max_overflow=0, pool_timeout=1,
+                             **self.client_options)
+        self.client.connect()
+
+    def tearDown(self):
+        with self.client.session() as session:
+            session.execute(text("TRUNCATE latest_crypto_price"))
+        self.client.close()
+
+    def prices(self):
+        return sorted((row["symbol"], row["price"]) for row in
+                      self.client.get_all(LatestCryptoPrice,
+                                          ["symbol", "price"]))
+
+    def test_insert(self):
+        self.client.insert(LatestCryptoPrice, [
+            {"symbol": "BTCUSDT", "price": 70000, "datetime": NOW},
+            {"symbol": "ETHUSDT", "price": 3000, "datetime": NOW}])
+        assert self.prices() == [("BTCUSDT", 70000), ("ETHUSDT", 3000)]
+        # A duplicate fails the whole insert, which is rolled back
+        duplicates = [{"symbol": "BNBUSDT", "price": 600, "datetime": NOW},
+                      {"symbol": "BTCUSDT", "price": 1, "datetime": NOW}]
+        with self.assertRaises(exc.IntegrityError):
+            self.client.insert(LatestCryptoPrice, duplicates)
+        self.client.insert(LatestCryptoPrice, duplicates,
+                           ignore_duplicates=True)
+        assert self.prices() == [("BTCUSDT", 70000), ("ETHUSDT", 3000)]
+        # The connection went back to the pool in a usable state
+        self.client.upsert(LatestCryptoPrice, duplicates, ["symbol"],
+                           update_columns=["price"])
+        assert self.prices() == [("BNBUSDT", 600), ("BTCUSDT", 1),
+                                 ("ETHUSDT", 3000)]
+
+    def test_pool_options(self):
+        pool = self.client.engine.pool
+        assert pool.size() == 1
+        assert pool.timeout() == 1
+        # All connections in use, the next one is waited for and given up
+        # on after pool_timeout
+        with self.client.session() as session:
+            session.execute(text("SELECT 1"))
+            with self.assertRaises(exc.TimeoutError):
+                self.client.get_all(LatestCryptoPrice)
+        assert self.client.get_all(LatestCryptoPrice) == []
+
+    def test_pre_ping(self):
+        with self.client.session() as session:
+            pid = session.execute(text("SELECT pg_backend_pid()")).scalar()
+        # The pooled connection is dropped by the server, e.g. on a restart
+        connection = self.connect()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_terminate_backend(%s)", (pid,))
+        connection.close()
+        # and is replaced before being handed out, instead of failing
+        with self.client.session() as session:
+            assert session.execute(
+                text("SELECT pg_backend_pid()")).scalar() != pid
+
+
+class AsyncClientTestCase(ScratchDatabase, unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.client = AsyncClient(pool_size=2, **self.client_options)
+        await self.client.connect()
+
+    async def asyncTearDown(self):
+        await self.client.execute(text("TRUNCATE latest_crypto_price"))
+        await self.client.close()
+
+    async def test_operations(self):
+        await self.client.insert(LatestCryptoPrice, [
+            {"symbol": "BTCUSDT", "price": 70000, "datetime": NOW}])
+        await self.client.upsert(LatestCryptoPrice, [
+            {"symbol": "BTCUSDT", "price": 71000, "datetime": NOW},
+            {"symbol": "ETHUSDT", "price": 3000, "datetime": NOW}],
+            ["symbol"], update_columns=["price"])
+        rows = await self.client.get_all(LatestCryptoPrice,
+                                         ["symbol", "price"])
+        assert sorted((row["symbol"], row["price"]) for row in rows) == \
+            [("BTCUSDT", 71000), ("ETHUSDT", 3000)]
+        objects = await self.client.get_all(LatestCryptoPrice)
+        assert {entry["symbol"] for entry in objects} == \
+            {"BTCUSDT", "ETHUSDT"}
+        assert await self.client.execute(
+            select(LatestCryptoPrice.price).where(
+                LatestCryptoPrice.symbol == "ETHUSDT")) == [(3000,)]
+        assert await self.client.execute(
+            text("UPDATE latest_crypto_price SET price = 0")) == []
+        # A failed statement is rolled back
+        with self.assertRaises(exc.IntegrityError):
+            await self.client.insert(LatestCryptoPrice, [
+                {"symbol": "SOLUSDT", "price": 150, "datetime": NOW},
+                {"symbol": "BTCUSDT", "price": 1, "datetime": NOW}])
+        assert len(await self.client.get_all(LatestCryptoPrice)) == 2
+
+    async def test_pool_options(self):
+        pool = self.client.engine.pool
+        assert pool.size() == 2
+        # Both sessions get a connection of their own
+        async with self.client.session() as first, \
+                self.client.session() as second:
+            first_pid = (await first.execute(
+                text("SELECT pg_backend_pid()"))).scalar()
+            second_pid = (await second.execute(
+                text("SELECT pg_backend_pid()"))).scalar()
+        assert first_pid != second_pid
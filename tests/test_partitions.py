@@ -0,0 +1,189 @@
+import json
+import unittest
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from lib.db import partitions, rollup
+from lib.db.client import Client
+from lib.db.models.schema import CryptoPrice
+from tests.db import ScratchDatabase
+
+DAY = datetime(2024, 4, 1)
+SYMBOLS = ("BTCUSDT", "ETHUSDT")
+
+
+class PartitionsTestCase(ScratchDatabase, unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client(**self.client_options)
+        self.client.connect()
+        # Daily partitions from DAY to DAY + 2 days
+        partitions.ensure_partitions(self.client, ahead_days=2,
+                                     granularity="day", now=DAY)
+        self.set_setting(rollup.ROLLUP_START_SETTING, DAY)
+        # A price every 10 seconds over the first two hours of the first
+        # two days, rolled up as the data receiver does
+        prices = [{"symbol": symbol,
+                   "price": 100.0 * (index + 1) + second % 70,
+                   "datetime": day + timedelta(seconds=second)}
+                  for day in (DAY, DAY + timedelta(days=1))
+                  for second in range(0, 7200, 10)
+                  for index, symbol in enumerate(SYMBOLS)]
+        self.client.copy_insert(CryptoPrice, prices,
+                                on_inserted=rollup.ON_INSERTED)
+        self.first, self.second = [
+            name for name, _, _ in self.partitions()][:2]
+
+    def tearDown(self):
+        with self.client.engine.begin() as connection:
+            for name, _, _ in partitions.get_partitions(connection):
+                connection.execute(text(f'DROP TABLE "{name}"'))
+            connection.execute(text("TRUNCATE crypto_price_rollup, settings"))
+        self.client.close()
+
+    def set_setting(self, name, value):
+        with self.client.engine.begin() as connection:
+            connection.execute(text(
+                "INSERT INTO settings (name, value) VALUES (:name, :value) "
+                "ON CONFLICT (name) DO UPDATE SET value = excluded.value"),
+                {"name": name, "value": str(value)})
+
+    def get_setting(self, name):
+        with self.client.engine.connect() as connection:
+            return connection.execute(text(
+                "SELECT value FROM settings WHERE name = :name"),
+                {"name": name}).scalar()
+
+    def partitions(self):
+        with self.client.engine.connect() as connection:
+            return partitions.get_partitions(connection)
+
+    def compaction(self, name):
+        with self.client.engine.connect() as connection:
+            return partitions.get_compaction(connection, name)
+
+    def rows(self, name):
+        with self.client.engine.connect() as connection:
+            return connection.execute(text(
+                f'SELECT id, symbol, price, datetime FROM "{name}" '
+                f"ORDER BY symbol, datetime")).all()
+
+    def rollups(self):
+        with self.client.engine.connect() as connection:
+            return connection.execute(text(
+                "SELECT symbol, resolution, datetime, price_count, price_sum, "
+                "price_min, price_max, first_price, last_price "
+                "FROM crypto_price_rollup "
+                "ORDER BY symbol, resolution, datetime")).all()
+
+    def test_compaction(self):
+        raw = self.rows(self.first)
+        rollups = self.rollups()
+        compacted = partitions.compact_partitions(
+            self.client, 1, now=DAY + timedelta(days=2))
+        # Only the partitions older than a day
+        assert compacted == [self.first], compacted
+        assert self.compaction(self.first) == 60
+        assert self.compaction(self.second) is None
+        assert len(self.rows(self.second)) == len(raw)
+        # Still attached, in the place of the raw partition
+        assert [name for name, _, _ in self.partitions()][:2] == \
+            [self.first, self.second]
+
+        # An average price per symbol and minute, with the smallest id
+        buckets = {}
+        for row_id, symbol, price, dt in raw:
+            buckets.setdefault((symbol, dt.replace(second=0)), []).append(
+                (row_id, price))
+        expected = [(min(row_id for row_id, _ in values), symbol,
+                     sum(price for _, price in values) / len(values), minute)
+                    for (symbol, minute), values in sorted(buckets.items())]
+        assert len(expected) == len(SYMBOLS) * 120
+        assert self.rows(self.first) == expected
+        # Stored in time order, which the BRIN index on datetime needs
+        with self.client.engine.connect() as connection:
+            stored = connection.execute(text(
+                f'SELECT datetime FROM "{self.first}" ORDER BY ctid')
+            ).scalars().all()
+        assert stored == sorted(stored)
+        # The rollups keep the statistics of the raw prices
+        assert self.rollups() == rollups
+        assert json.loads(self.get_setting(
+            partitions.COMPACTED_RANGES_SETTING)) == \
+            [["2024-04-01 00:00:00", "2024-04-02 00:00:00", 60]]
+
+        # Compacted partitions are left alone from then on
+        assert partitions.compact_partitions(
+            self.client, 1, now=DAY + timedelta(days=2)) == []
+        assert self.rows(self.first) == expected
+        # And the later ones move the end of the compacted range
+        assert partitions.compact_partitions(
+            self.client, 0, now=DAY + timedelta(days=2)) == [self.second]
+        assert json.loads(self.get_setting(
+            partitions.COMPACTED_RANGES_SETTING)) == \
+            [["2024-04-01 00:00:00", "2024-04-03 00:00:00", 60]]
+        assert self.rollups() == rollups
+
+    def test_refused_before_rollup_start(self):
+        raw = self.rows(self.first)
+        # The rollups of the first hours are missing
+        self.set_setting(rollup.ROLLUP_START_SETTING, DAY + timedelta(hours=1))
+        assert partitions.compact_partitions(
+            self.client, 1, now=DAY + timedelta(days=2)) == []
+        assert self.compaction(self.first) is None
+        assert self.rows(self.first) == raw
+        assert self.get_setting(partitions.COMPACTED_RANGES_SETTING) is None
+
+    def test_ranges_of_compacted_partitions_only(self):
+        # The first partition is refused, the second one compacted
+        self.set_setting(rollup.ROLLUP_START_SETTING, DAY + timedelta(days=1))
+        assert partitions.compact_partitions(
+            self.client, 0, now=DAY + timedelta(days=2)) == [self.second]
+        # Only the second one is recorded as compacted, not all the prices
+        # before its end
+        assert json.loads(self.get_setting(
+            partitions.COMPACTED_RANGES_SETTING)) == \
+            [["2024-04-02 00:00:00", "2024-04-03 00:00:00", 60]]
+
+    def test_refused_with_incomplete_rollups(self):
+        raw = self.rows(self.first)
+        with self.client.engine.begin() as connection:
+            connection.execute(text(
+                "DELETE FROM crypto_price_rollup WHERE datetime = :minute"),
+                {"minute": DAY + timedelta(minutes=30)})
+        assert partitions.compact_partitions(
+            self.client, 1, now=DAY + timedelta(days=2)) == []
+        assert self.compaction(self.first) is None
+        assert self.rows(self.first) == raw
+
+    def test_refused_without_rollup_start(self):
+        with self.client.engine.begin() as connection:
+            connection.execute(text("DELETE FROM settings"))
+        assert partitions.compact_partitions(
+            self.client, 1, now=DAY + timedelta(days=2)) == []
+        assert self.compaction(self.first) is None
+
+    def test_rebuild_keeps_compacted_rollups(self):
+        rollups = self.rollups()
+        partitions.compact_partitions(self.client, 1,
+                                      now=DAY + timedelta(days=2))
+        # The rollups of the raw partition are recomputed, those of the
+        # compacted one kept, rather than recomputed from the averages
+        with self.client.engine.begin() as connection:
+            connection.execute(text("TRUNCATE crypto_price_rollup"))
+            connection.execute(text(
+                f"INSERT INTO crypto_price_rollup (symbol, resolution, "
+                f"datetime, price_count, price_sum, price_sum_of_squares, "
+                f"price_min, price_max, first_price, first_datetime, "
+                f"last_price, last_datetime) "
+                f"VALUES ('BTCUSDT', 60, '{DAY}', 1, 1, 1, 1, 1, 1, "
+                f"'{DAY}', 1, '{DAY}')"))
+        rollup.rebuild(self.client, DAY, DAY + timedelta(days=3))
+        rebuilt = self.rollups()
+        assert [row for row in rebuilt if row.datetime >= DAY +
+                timedelta(days=1)] == \
+            [row for row in rollups if row.datetime >= DAY +
+             timedelta(days=1)]
+        assert [row for row in rebuilt if row.datetime < DAY +
+                timedelta(days=1)] == [("BTCUSDT", 60, DAY, 1, 1, 1, 1, 1, 1)]
@@ -0,0 +1,146 @@
+import asyncio
+import collections
+import shutil
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+
+from lib.db.models.schema import CryptoPrice
+from lib.db.writer import DROP_NEWEST, Writer
+from lib.spool import Spool
+
+from binance_websock import DataReceiver
+
+
+class OfflineStorage(object):
+    """Mixin keeping the DB writes of a receiver in memory: the writes are
+    only queued, and drained spool rows are collected by model"""
+
+    def initialize_storage(self, db_name, db_host, db_user_name, db_password,
+                           db_write_queue_size, db_write_overflow_policy,
+                           spool_dir, spool_segment_size):
+        self.copied = collections.defaultdict(list)
+        self.db_client = SimpleNamespace(
+            upsert=lambda *args, **kwargs: None, notify=lambda *args: None,
+            copy_insert=self.copy_insert, close=lambda: None)
+        self.db_writer = Writer(max_queue_size=db_write_queue_size,
+                                overflow_policy=db_write_overflow_policy)
+        self.spool = Spool(spool_dir, segment_size=1024 * 1024)
+        self.init_storage_metrics()
+
+    def copy_insert(self, table, objects, **kwargs):
+        self.copied[table].extend(objects)
+        return len(objects), 0
+
+
+class OfflineReceiver(OfflineStorage, DataReceiver):
+
+    def __init__(self, spool_dir, **kwargs):
+        options = dict(api_key=None, api_secret=None, interval=1,
+                       symbols="BTCUSDT,ETHUSDT", db_name=None, db_host=None,
+                       db_user_name=None, db_password=None,
+                       db_update_interval=1, spool_dir=spool_dir,
+                       source=SimpleNamespace(reconnects=0))
+        options.update(kwargs)
+        super(OfflineReceiver, self).__init__(**options)
+
+    def trade(self, symbol, price, delay=5):
+        # A trade far enough ahead to be captured
+        timestamp = int((time.time() + delay) * 1000)
+        self.handle_socket_messages([{"s": symbol, "T": timestamp,
+                                      "E": timestamp, "p": str(price),
+                                      "q": "0.5"}])
+
+
+class DataReceiverTestCase(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+
+    async def asyncTearDown(self):
+        self.receiver.spool.close()
+        self.receiver.db_writer.close()
+        shutil.rmtree(self.spool_dir)
+
+    async def test_dropped_latest_prices_stay_dirty(self):
+        self.receiver = OfflineReceiver(
+            self.spool_dir, db_write_queue_size=1,
+            db_write_overflow_policy=DROP_NEWEST)
+        self.receiver.trade("BTCUSDT", 70000)
+        # The spool drain takes the only slot of the queue, so the upsert
+        # and the notification are dropped
+        await self.receiver.flush_to_db()
+        assert self.receiver.db_writer.stats()["dropped"] == 2
+        assert self.receiver.dirty_symbols == {"BTCUSDT"}
+        # And go out with the next flush, once there is room
+        drain = self.receiver.db_writer.queue.get_nowait()[0]
+        drain()
+        self.receiver.db_writer.close()
+        self.receiver.db_writer = Writer(max_queue_size=10)
+        self.receiver.trade("ETHUSDT", 3000)
+        await self.receiver.flush_to_db()
+        assert self.receiver.dirty_symbols == set()
+        jobs = [self.receiver.db_writer.queue.get_nowait()[0]
+                for _ in range(self.receiver.db_writer.queue_depth)]
+        assert [job.func for job in jobs] == [
+            self.receiver.drain_spool, self.receiver.db_client.upsert,
+            self.receiver.db_client.notify], jobs
+        assert {entry["symbol"] for entry in jobs[1].args[1]} == \
+            {"BTCUSDT", "ETHUSDT"}, jobs[1].args
+
+    async def test_failed_latest_prices_stay_dirty(self):
+        self.receiver = OfflineReceiver(self.spool_dir)
+
+        def fail(*args, **kwargs):
+            raise RuntimeError("DB is down")
+
+        self.receiver.db_client.upsert = fail
+        self.receiver.trade("BTCUSDT", 70000)
+        await self.receiver.flush_to_db()
+        assert self.receiver.dirty_symbols == set()
+        runner = asyncio.ensure_future(self.receiver.db_writer.run())
+        await self.receiver.db_writer.drain()
+        runner.cancel()
+        # The failed upsert is retried with the next flush
+        assert self.receiver.db_writer.stats()["failed"] == 1
+        assert self.receiver.dirty_symbols == {"BTCUSDT"}
+
+    async def test_drains_are_coalesced(self):
+        self.receiver = OfflineReceiver(self.spool_dir)
+        # While DB hangs, the flushes keep spooling but queue a single drain
+        for index, price in enumerate((70000, 70001, 70002)):
+            self.receiver.trade("BTCUSDT", price, delay=5 + 2 * index)
+            await self.receiver.flush_to_db()
+        jobs = [self.receiver.db_writer.queue.get_nowait()[0]
+                for _ in range(self.receiver.db_writer.queue_depth)]
+        drains = [job for job in jobs if job.func == self.receiver.drain_spool]
+        assert len(drains) == 1, jobs
+        drains[0]()
+        assert [row["price"]
+                for row in self.receiver.copied[CryptoPrice]] == \
+            [70000, 70001, 70002]
+        assert not self.receiver.spool.pending
+        # Once it has started, the next flush queues another one
+        self.receiver.trade("BTCUSDT", 70003, delay=11)
+        await self.receiver.flush_to_db()
+        assert self.receiver.db_writer.queue.get_nowait()[0].func == \
+            self.receiver.drain_spool
+
+    async def test_replay_after_restart(self):
+        self.receiver = OfflineReceiver(self.spool_dir)
+        self.receiver.trade("BTCUSDT", 70000)
+        self.receiver.trade("ETHUSDT", 3000)
+        await self.receiver.flush_to_db()
+        # Stopped before the writer got to the spool
+        self.receiver.db_writer.close()
+        self.receiver.spool.close()
+        self.receiver = OfflineReceiver(self.spool_dir)
+        assert self.receiver.spool.pending
+        self.receiver.drain_spool()
+        assert sorted((row["symbol"], row["price"])
+                      for row in self.receiver.copied[CryptoPrice]) == \
+            [("BTCUSDT", 70000), ("ETHUSDT", 3000)]
+        # Written once only
+        self.receiver.drain_spool()
+        assert len(self.receiver.copied[CryptoPrice]) == 2
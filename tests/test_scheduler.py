@@ -0,0 +1,148 @@
+import asyncio
+import math
+import selectors
+import unittest
+
+from lib.scheduler import FlushScheduler
+
+
+class _Selector(selectors.DefaultSelector):
+    """Selector that moves the clock of its loop ahead by the timeout
+    instead of waiting for it"""
+
+    def select(self, timeout=None):
+        if timeout:
+            self.loop.now += timeout
+            timeout = 0
+        return super(_Selector, self).select(timeout)
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """Event loop on a virtual clock starting at 0. It jumps to the next
+    timer whenever the loop would wait, and only moves otherwise when
+    advanced, e.g. to make a flush take some time."""
+
+    def __init__(self):
+        selector = _Selector()
+        super(VirtualClockLoop, self).__init__(selector)
+        selector.loop = self
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class Stop(Exception):
+    pass
+
+
+class FlushSchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = VirtualClockLoop()
+        self.flush_times = []
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_flushes(self, scheduler, count, durations=()):
+        """Runs the scheduler until 'count' flushes are done, the n-th one
+        taking durations[n] seconds, if given"""
+        durations = list(durations)
+
+        def flush():
+            # Rounded off the float error of adding up the timeouts
+            self.flush_times.append(round(self.loop.time(), 6))
+            if durations:
+                self.loop.advance(durations.pop(0))
+            if len(self.flush_times) == count:
+                raise Stop()
+
+        with self.assertRaises(Stop):
+            self.loop.run_until_complete(scheduler.run(flush))
+
+    def test_deadline_grid(self):
+        scheduler = FlushScheduler(1)
+        # The time spent flushing doesn't push the later deadlines back
+        self.run_flushes(scheduler, 4, durations=[0.3, 0.6, 0.9])
+        assert self.flush_times == [1, 2, 3, 4], self.flush_times
+        stats = scheduler.stats()
+        assert stats["deadline_flushes"] == 3
+        assert stats["size_flushes"] == 0
+        assert math.isclose(stats["max_flush_duration"], 0.9)
+        assert stats["overruns"] == 0
+
+    def test_size_trigger(self):
+        scheduler = FlushScheduler(1, batch_size=10)
+        # Short of the batch size, only the deadline flushes
+        self.loop.call_at(0.25, scheduler.add, 9)
+        self.loop.call_at(1.5, scheduler.add, 4)
+        self.loop.call_at(1.75, scheduler.add, 6)
+        self.run_flushes(scheduler, 4)
+        # The early flush keeps the deadline of the grid
+        assert self.flush_times == [1, 1.75, 2, 3], self.flush_times
+        assert scheduler.stats()["size_flushes"] == 1
+        assert scheduler.stats()["deadline_flushes"] == 2
+
+    def test_pending_at_start(self):
+        scheduler = FlushScheduler(1, batch_size=10)
+        scheduler.add(10)
+        self.run_flushes(scheduler, 2)
+        assert self.flush_times == [0, 1], self.flush_times
+        assert scheduler.pending == 0
+
+    def test_overrun(self):
+        scheduler = FlushScheduler(1)
+        # The flush at 1 runs until 3.5, past the deadlines at 2 and 3,
+        # which are skipped rather than caught up on
+        self.run_flushes(scheduler, 3, durations=[2.5])
+        assert self.flush_times == [1, 4, 5], self.flush_times
+        assert scheduler.overruns == 1
+        assert scheduler.missed_deadlines == 2
+
+    def test_overrun_to_deadline(self):
+        scheduler = FlushScheduler(1)
+        # Ending right on the next deadline misses that one too
+        self.run_flushes(scheduler, 2, durations=[1])
+        assert self.flush_times == [1, 3], self.flush_times
+        assert scheduler.missed_deadlines == 1
+
+    def test_write_batch_size_adaptation(self):
+        scheduler = FlushScheduler(1, batch_size=10000, write_batch_size=10000,
+                                   min_write_batch_size=100,
+                                   max_write_batch_size=50000)
+        # 1000 items/s, for writes of half the interval
+        scheduler.observe_latency(1.0, 1000)
+        assert scheduler.write_rate == 1000
+        assert scheduler.write_batch_size == 500
+        # The rate moves by RATE_SMOOTHING of the difference
+        scheduler.observe_latency(1.0, 2000)
+        assert scheduler.write_rate == 1300
+        assert scheduler.write_batch_size == 650
+        # Empty or instant writes tell nothing
+        scheduler.observe_latency(0, 100)
+        scheduler.observe_latency(1.0, 0)
+        assert scheduler.write_rate == 1300
+        # Bounded on both sides
+        for _ in range(20):
+            scheduler.observe_latency(0.001, 1000)
+        assert scheduler.write_batch_size == 50000
+        for _ in range(60):
+            scheduler.observe_latency(10, 1)
+        assert scheduler.write_batch_size == 100
+        # The flush trigger is left alone
+        assert scheduler.batch_size == 10000
+
+    def test_flush_trigger_stays_fixed(self):
+        scheduler = FlushScheduler(1, batch_size=1000)
+        scheduler.observe_latency(0.5, 300)
+        assert scheduler.write_batch_size == 300
+        # Pending items short of the trigger wait for the deadline, however
+        # small the write batches got
+        self.loop.call_at(0.25, scheduler.add, 300)
+        self.loop.call_at(0.5, scheduler.add, 700)
+        self.run_flushes(scheduler, 2)
+        assert self.flush_times == [0.5, 1], self.flush_times
@@ -0,0 +1,46 @@
+import inspect
+import unittest
+
+from binance import AsyncClient, BinanceSocketManager
+from binance.streams import ReconnectingWebsocket
+
+import sources
+from sources import BinanceSource, recv_batch
+
+
+class BinanceSourceTestCase(unittest.IsolatedAsyncioTestCase):
+    """BinanceSource and recv_batch reach into internals of the sockets of
+    python-binance, which the pinned version has. These tests fail, without
+    connecting to Binance, once an upgrade takes them away."""
+
+    async def asyncSetUp(self):
+        self.client = AsyncClient()
+        self.source = BinanceSource(BinanceSocketManager(self.client))
+
+    async def asyncTearDown(self):
+        await self.client.close_connection()
+
+    async def test_multiplex_queue_size(self):
+        socket = self.source.multiplex_socket(["btcusdt@trade"])
+        assert isinstance(socket, ReconnectingWebsocket)
+        # The read loop checks the limit on the instance, so overriding it
+        # there raises the limit of this socket only
+        assert "self.MAX_QUEUE_SIZE" in inspect.getsource(
+            ReconnectingWebsocket._read_loop)
+        assert socket.MAX_QUEUE_SIZE == sources.MULTIPLEX_QUEUE_SIZE
+        assert ReconnectingWebsocket.MAX_QUEUE_SIZE < \
+            sources.MULTIPLEX_QUEUE_SIZE
+
+    async def test_recv_batch_from_queue(self):
+        socket = self.source.trade_socket("BTCUSDT")
+        # recv() takes the messages the read loop decoded from _queue, and
+        # recv_batch the ones waiting behind it
+        for index in range(5):
+            socket._queue.put_nowait({"t": index})
+        assert await recv_batch(socket, 3) == [{"t": 0}, {"t": 1}, {"t": 2}]
+        assert await recv_batch(socket, 3) == [{"t": 3}, {"t": 4}]
+
+    async def test_reconnects_counted(self):
+        socket = self.source.trade_socket("BTCUSDT")
+        await socket.before_reconnect()
+        assert self.source.reconnects == 1
@@ -0,0 +1,175 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+
+import records
+from lib.spool import HEADER, Spool
+
+
+def payloads(count, start=0):
+    return [b"record %04d" % index for index in range(start, start + count)]
+
+
+class SpoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spools = []
+
+    def tearDown(self):
+        for spool in self.spools:
+            if not spool.mmap.closed:
+                spool.close()
+        shutil.rmtree(self.directory)
+
+    def open(self, segment_size=1024):
+        spool = Spool(self.directory, segment_size=segment_size)
+        self.spools.append(spool)
+        return spool
+
+    def restart(self, spool, segment_size=1024):
+        spool.close()
+        return self.open(segment_size)
+
+    def segment_files(self):
+        return sorted(name for name in os.listdir(self.directory)
+                      if name.endswith(".seg"))
+
+    def test_append_and_read(self):
+        spool = self.open()
+        assert not spool.pending
+        spool.append(payloads(5))
+        assert spool.pending
+        assert spool.pending_bytes == 5 * (HEADER.size + 11)
+        found, position = spool.read(spool.checkpoint, 3)
+        assert found == payloads(3)
+        found, position = spool.read(position, 10)
+        assert found == payloads(2, 3)
+        assert position == spool.write_position
+        assert spool.read(position, 10) == ([], position)
+
+    def test_segment_rotation(self):
+        # Room for 4 records and the end marker per segment
+        spool = self.open(segment_size=4 * (HEADER.size + 11) + HEADER.size)
+        spool.append(payloads(10))
+        assert len(self.segment_files()) == 3
+        assert spool.write_position == (2, 2 * (HEADER.size + 11))
+        found, position = spool.read(spool.checkpoint, 100)
+        assert found == payloads(10)
+        # Segments before the checkpoint are removed
+        spool.commit(spool.read(spool.checkpoint, 5)[1])
+        assert len(self.segment_files()) == 2
+        spool.commit(position)
+        assert self.segment_files() == ["%012d.seg" % 2]
+        assert not spool.pending
+
+    def test_record_too_large(self):
+        spool = self.open(segment_size=64)
+        with self.assertRaises(ValueError):
+            spool.append([b"x" * 64])
+        assert not spool.pending
+
+    def test_commit_is_idempotent(self):
+        spool = self.open()
+        spool.append(payloads(4))
+        _, middle = spool.read(spool.checkpoint, 2)
+        _, end = spool.read(spool.checkpoint, 4)
+        spool.commit(end)
+        spool.commit(end)
+        # A stale commit, e.g. of a retried batch, doesn't move it back
+        spool.commit(middle)
+        assert spool.checkpoint == end
+        assert not spool.pending
+        spool = self.restart(spool)
+        assert spool.checkpoint == end
+        assert spool.read(spool.checkpoint, 10) == ([], end)
+
+    def test_replay_after_restart(self):
+        spool = self.open()
+        spool.append(payloads(6))
+        _, position = spool.read(spool.checkpoint, 2)
+        spool.commit(position)
+        spool = self.restart(spool)
+        # The uncommitted records are read again and new ones follow them
+        assert spool.pending
+        spool.append(payloads(1, 6))
+        found, position = spool.read(spool.checkpoint, 10)
+        assert found == payloads(5, 2)
+        spool.commit(position)
+        spool = self.restart(spool)
+        assert not spool.pending
+
+    def test_torn_record(self):
+        spool = self.open()
+        spool.append(payloads(3))
+        end = spool.write_position
+        # A crash in the middle of an append leaves the payload of the next
+        # record written, but only part of its header
+        spool.mmap[end[1] + HEADER.size:end[1] + HEADER.size + 11] = \
+            b"record 0003"
+        spool.mmap[end[1]:end[1] + 4] = (11).to_bytes(4, "little")
+        spool = self.restart(spool)
+        assert spool.write_position == end
+        found, _ = spool.read(spool.checkpoint, 10)
+        assert found == payloads(3)
+        # The next append takes its place
+        spool.append(payloads(2, 3))
+        found, _ = spool.read(spool.checkpoint, 10)
+        assert found == payloads(5)
+
+    def test_crc_mismatch(self):
+        spool = self.open()
+        spool.append(payloads(3))
+        # Flips a byte of the payload of the second record
+        offset = 2 * HEADER.size + 11 + 3
+        spool.mmap[offset] ^= 0xFF
+        spool = self.restart(spool)
+        # Nothing from the corrupted record on is taken for data
+        assert spool.write_position == (0, HEADER.size + 11)
+        found, _ = spool.read(spool.checkpoint, 10)
+        assert found == payloads(1)
+
+    def test_concurrent_append_and_drain(self):
+        spool = self.open(segment_size=256)
+        found = []
+        done = threading.Event()
+
+        def drain():
+            while True:
+                finished = done.is_set()
+                batch, position = spool.read(spool.checkpoint, 7)
+                found.extend(batch)
+                spool.commit(position)
+                if finished and not batch:
+                    break
+
+        consumer = threading.Thread(target=drain)
+        consumer.start()
+        for start in range(0, 1000, 10):
+            spool.append(payloads(10, start))
+        done.set()
+        consumer.join()
+        assert found == payloads(1000)
+        assert not spool.pending
+        assert len(self.segment_files()) == 1
+
+
+class RecordsTestCase(unittest.TestCase):
+
+    def test_price(self):
+        timestamp = int(datetime(2024, 4, 1, 12).timestamp())
+        record = records.encode_price("BTCUSDT", timestamp, "70000.5")
+        assert records.decode(record) == (records.CRYPTO_PRICE, {
+            "symbol": "BTCUSDT", "price": 70000.5,
+            "datetime": datetime(2024, 4, 1, 12)})
+
+    def test_bar(self):
+        bar = {"symbol": "ETHUSDT", "interval": 60,
+               "datetime": datetime(2024, 4, 1, 12, 1), "open": 3000.0,
+               "high": 3010.0, "low": 2990.0, "close": 3005.0,
+               "volume": 12.5, "vwap": 3001.25, "trade_count": 42}
+        assert records.decode(records.encode_bar(bar)) == \
+            (records.CRYPTO_PRICE_BAR, bar)
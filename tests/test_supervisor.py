@@ -0,0 +1,103 @@
+import asyncio
+import collections
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import records
+
+import supervisor
+from supervisor import Supervisor, shard_symbols
+from tests.test_receiver import OfflineStorage
+
+SYMBOLS = ["BTCUSDT", "ETHUSDT", "BNBUSDT", "XRPUSDT", "ADAUSDT", "SOLUSDT"]
+
+
+class OfflineSupervisor(OfflineStorage, Supervisor):
+    pass
+
+
+class HungProcess(object):
+    """Worker process which closed its pipe but only exits when killed"""
+    pid = 1
+    exitcode = None
+
+    def is_alive(self):
+        return self.exitcode is None
+
+    def kill(self):
+        self.exitcode = -9
+
+
+class SupervisorTestCase(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.supervisor = OfflineSupervisor(
+            workers=2, source_options={"synthetic": True, "replay_rate": 600},
+            api_key=None, api_secret=None, interval=1,
+            symbols=",".join(SYMBOLS), db_name=None, db_host=None,
+            db_user_name=None, db_password=None, db_update_interval=1,
+            spool_dir=self.spool_dir)
+
+    async def asyncTearDown(self):
+        self.supervisor.close_storage()
+        shutil.rmtree(self.spool_dir)
+
+    def spooled_prices(self):
+        spool = self.supervisor.spool
+        found, _ = spool.read(spool.checkpoint, 1000000)
+        return [row for kind, row in map(records.decode, found)
+                if kind == records.CRYPTO_PRICE]
+
+    async def wait_for(self, condition, timeout=60):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            assert time.monotonic() < deadline, "Timed out"
+            await asyncio.sleep(0.1)
+
+    async def test_restart_without_duplicates(self):
+        shards = shard_symbols(SYMBOLS, 2)
+        assert all(shards), shards
+        self.supervisor.start_socket_tasks()
+        await self.wait_for(lambda: {row["symbol"]
+                                     for row in self.spooled_prices()} ==
+                            set(SYMBOLS))
+        # A worker crashing is reaped and restarted without blocking the
+        # event loop
+        killed = self.supervisor.processes[0]
+        killed.kill()
+        killed_at = time.time()
+        await self.wait_for(lambda: self.supervisor.processes.get(0) not in
+                            (None, killed))
+        assert self.supervisor.worker_restarts.values[()] == 1
+        await self.wait_for(lambda: {
+            row["symbol"] for row in self.spooled_prices()
+            if row["datetime"].timestamp() > killed_at + 1} == set(SYMBOLS))
+
+        # Every symbol is captured by the worker of its shard only, before
+        # and after the restart, so no row is spooled twice
+        rows = self.spooled_prices()
+        counts = collections.Counter((row["symbol"], row["datetime"])
+                                     for row in rows)
+        assert max(counts.values()) == 1, \
+            [key for key, count in counts.items() if count > 1]
+        assert self.supervisor.shards == shards
+
+    async def test_hung_worker_is_killed(self):
+        process = HungProcess()
+        self.supervisor.processes[0] = process
+        self.supervisor.started[0] = time.monotonic()
+        started = []
+        with mock.patch.object(supervisor, "WORKER_EXIT_TIMEOUT", 0.5), \
+                mock.patch.object(self.supervisor, "start_worker",
+                                  started.append):
+            self.supervisor.restart_worker(0)
+            await asyncio.sleep(0.3)
+            # Still waited for, without the loop being blocked
+            assert process.exitcode is None
+            await self.wait_for(lambda: process.exitcode == -9, timeout=2)
+            await self.wait_for(lambda: started == [0], timeout=3)
+        assert self.supervisor.worker_restarts.values[()] == 1
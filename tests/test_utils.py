@@ -0,0 +1,35 @@
+import asyncio
+import unittest
+
+from lib.utils import every, shard
+
+
+class UtilsTestCase(unittest.IsolatedAsyncioTestCase):
+
+    async def test_every_awaits_coroutines(self):
+        calls = []
+
+        async def flush():
+            calls.append("start")
+            await asyncio.sleep(0.02)
+            calls.append("end")
+
+        task = asyncio.ensure_future(every(0.001, flush))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        # A round only starts once the previous one has finished
+        assert len(calls) >= 4, calls
+        assert calls[:len(calls) // 2 * 2] == \
+            ["start", "end"] * (len(calls) // 2), calls
+
+    async def test_every_calls_functions(self):
+        calls = []
+        task = asyncio.ensure_future(every(0.001, calls.append, 1))
+        await asyncio.sleep(0.02)
+        task.cancel()
+        assert len(calls) >= 2 and set(calls) == {1}, calls
+
+    def test_shard(self):
+        assert shard(["a", "b", "c", "d", "e"], 2) == \
+            [["a", "c", "e"], ["b", "d"]]
+        assert shard(["a"], 3) == [["a"]]
@@ -0,0 +1,105 @@
+import asyncio
+import math
+import time
+import unittest
+
+from lib.db.writer import BLOCK, DROP_NEWEST, DROP_OLDEST, Writer
+
+
+class WriterTestCase(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.done = []
+        self.dropped = []
+        self.runner = None
+
+    async def asyncTearDown(self):
+        if self.runner is not None:
+            self.runner.cancel()
+
+    def start(self, writer):
+        self.runner = asyncio.ensure_future(writer.run())
+
+    async def submit(self, writer, value):
+        return await writer.submit(
+            self.done.append, value,
+            on_dropped=lambda: self.dropped.append(value))
+
+    async def test_block(self):
+        writer = Writer(max_queue_size=1, overflow_policy=BLOCK)
+        assert await self.submit(writer, 1)
+        blocked = asyncio.ensure_future(self.submit(writer, 2))
+        await asyncio.sleep(0.01)
+        # Waits for a free slot rather than dropping anything
+        assert not blocked.done()
+        assert writer.queue_depth == 1
+        self.start(writer)
+        assert await blocked
+        await writer.drain()
+        assert self.done == [1, 2], self.done
+        assert self.dropped == []
+        assert writer.stats()["dropped"] == 0
+        writer.close()
+
+    async def test_drop_oldest(self):
+        writer = Writer(max_queue_size=2, overflow_policy=DROP_OLDEST)
+        for value in (1, 2, 3):
+            assert await self.submit(writer, value)
+        assert self.dropped == [1]
+        self.start(writer)
+        await writer.drain()
+        assert self.done == [2, 3], self.done
+        assert writer.stats()["dropped"] == 1
+        writer.close()
+
+    async def test_drop_newest(self):
+        writer = Writer(max_queue_size=2, overflow_policy=DROP_NEWEST)
+        assert await self.submit(writer, 1)
+        assert await self.submit(writer, 2)
+        assert not await self.submit(writer, 3)
+        assert self.dropped == [3]
+        self.start(writer)
+        await writer.drain()
+        assert self.done == [1, 2], self.done
+        assert writer.stats()["dropped"] == 1
+        writer.close()
+
+    async def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            Writer(overflow_policy="drop_all")
+
+    async def test_failed(self):
+        def fail():
+            raise RuntimeError("DB is down")
+
+        failed = []
+        writer = Writer()
+        await writer.submit(fail, on_failed=lambda: failed.append(1))
+        await self.submit(writer, 2)
+        self.start(writer)
+        await writer.drain()
+        # Only called for the write that failed, and the next ones still run
+        assert failed == [1]
+        assert self.done == [2]
+        assert writer.stats()["failed"] == 1
+        writer.close()
+
+    async def test_stats(self):
+        def fail():
+            raise RuntimeError("DB is down")
+
+        writer = Writer()
+        await writer.submit(time.sleep, 0.02)
+        await writer.submit(fail)
+        assert writer.stats()["queue_depth"] == 2
+        self.start(writer)
+        await writer.drain()
+        stats = writer.stats()
+        assert stats["queue_depth"] == 0
+        assert stats["written"] == 1 and stats["failed"] == 1, stats
+        assert stats["max_flush_latency"] >= 0.02, stats
+        assert stats["last_flush_latency"] < stats["max_flush_latency"]
+        assert math.isclose(
+            stats["avg_flush_latency"],
+            (stats["max_flush_latency"] + stats["last_flush_latency"]) / 2)
+        writer.close()
@@ -0,0 +1,80 @@
+from django.db.models import (Aggregate, Avg, Count, F, FloatField, Max, Min,
+                              StdDev, Subquery, Sum)
+from django.db.models.functions import Cast, Extract
+
+
+class Median(Aggregate):
+    """Median interpolated between the two middle values, like
+    numpy.median"""
+    function = "PERCENTILE_CONT"
+    template = "%(function)s(0.5) WITHIN GROUP (ORDER BY %(expressions)s)"
+    output_field = FloatField()
+
+
+class FirstByTime(Aggregate):
+    """Value of the row with the earliest time. Taken as the minimum of
+    [epoch, value] arrays, which needs neither a sort nor memory per row as
+    array_agg(value ORDER BY time) would."""
+    function = "MIN"
+    template = "(%(function)s(ARRAY[%(expressions)s]))[2]"
+    output_field = FloatField()
+
+    def __init__(self, expression, time_field="datetime", **extra):
+        super(FirstByTime, self).__init__(
+            Cast(Extract(time_field, "epoch"), FloatField()), expression,
+            **extra)
+
+
+class LastByTime(FirstByTime):
+    """Value of the row with the latest time"""
+    function = "MAX"
+
+
+def price_statistics(queryset):
+    """Statistics of the prices of the queryset in a single query and scan
+
+    Returns:
+      dict: total_count, average_price, median_price, standard_deviation
+            (of the population, like numpy.std), min_price, max_price,
+            first_price and last_price, None if there are no prices
+    """
+    statistics = queryset.aggregate(
+        total_count=Count('id'), average_price=Avg('price'),
+        median_price=Median('price'),
+        standard_deviation=StdDev('price', sample=False),
+        min_price=Min('price'), max_price=Max('price'),
+        first_price=FirstByTime('price'), last_price=LastByTime('price'))
+    if not statistics['total_count']:
+        return None
+    return statistics
+
+
+def bar_statistics(queryset):
+    """Statistics of the trades aggregated into the bars of the queryset in
+    a single query, over the bars of the finest interval unless the
+    queryset selects one
+
+    Returns:
+      dict: total_count (of the trades), average_price (their VWAP),
+            median_price and standard_deviation (of the population) of the
+            bar closes, min_price, max_price, first_price (open of the first
+            bar), last_price (close of the last bar) and volume, None if
+            there are no bars
+    """
+    queryset = queryset.filter(interval=Subquery(
+        queryset.order_by('interval').values('interval')[:1]))
+    statistics = queryset.aggregate(
+        total_count=Sum('trade_count'), total_volume=Sum('volume'),
+        notional=Sum(F('vwap') * F('volume')), average_close=Avg('close'),
+        median_price=Median('close'),
+        standard_deviation=StdDev('close', sample=False),
+        min_price=Min('low'), max_price=Max('high'),
+        first_price=FirstByTime('open'), last_price=LastByTime('close'))
+    if not statistics['total_count']:
+        return None
+    notional = statistics.pop('notional')
+    average_close = statistics.pop('average_close')
+    statistics['volume'] = statistics.pop('total_volume')
+    statistics['average_price'] = (notional / statistics['volume']
+                                   if statistics['volume'] else average_close)
+    return statistics
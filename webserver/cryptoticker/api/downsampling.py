@@ -0,0 +1,185 @@
+"""Price history reduced to a bounded number of points for charts.
+
+interval= groups the prices into time buckets, aggregated in SQL, or
+from the rollups of the data receiver when the interval and the range are
+made of their buckets. max_points= keeps the prices that
+Largest-Triangle-Three-Buckets finds to preserve the shape of the price
+curve best.
+"""
+
+import re
+from datetime import datetime, timedelta
+from itertools import islice
+
+import numpy as np
+from django.db.models import (Avg, Count, DateTimeField, DurationField,
+                              ExpressionWrapper, F, FloatField, Func, Max,
+                              Min, Sum, Value)
+
+from .aggregates import FirstByTime, LastByTime
+from .models import CryptoPriceRollup
+from .rollups import RESOLUTIONS, choose_resolution
+
+INTERVAL_PATTERN = re.compile(r"^([1-9][0-9]*)([smhd])$")
+INTERVAL_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+# Buckets start at multiples of the interval since the epoch, as the
+# buckets of the rollups do
+ORIGIN = datetime(1970, 1, 1)
+
+
+def parse_interval(interval):
+    """Returns the seconds of an interval such as 30s, 15m, 1h or 1d"""
+    count, unit = INTERVAL_PATTERN.match(interval).groups()
+    return int(count) * INTERVAL_UNITS[unit]
+
+
+class DateBin(Func):
+    """Start of the bucket of the given seconds the time falls in"""
+    function = "DATE_BIN"
+    output_field = DateTimeField()
+
+    def __init__(self, expression, seconds, **extra):
+        super(DateBin, self).__init__(
+            Value(timedelta(seconds=seconds), output_field=DurationField()),
+            expression, Value(ORIGIN, output_field=DateTimeField()), **extra)
+
+
+def rollup_resolution(seconds, start_dt, end_dt):
+    """Returns the coarsest rollup resolution (in seconds) whose buckets
+    make up both the buckets of the given seconds and [start_dt, end_dt],
+    or None if only the raw prices can answer for them"""
+    resolution = choose_resolution(start_dt, end_dt)
+    if resolution is None:
+        return None
+    # Coarsest first, and every resolution divides the coarser ones
+    for candidate in RESOLUTIONS:
+        if seconds % candidate == 0 and resolution % candidate == 0:
+            return candidate
+    return None
+
+
+def bucket_prices(queryset, seconds, symbol=None, start_dt=None,
+                  end_dt=None):
+    """Groups the prices of the queryset, those of the symbol if given
+    within [start_dt, end_dt], into buckets of the given seconds
+
+    Returns:
+      QuerySet: dicts of the bucket, symbol, open, high, low, close,
+                average_price and count of every bucket, in time order
+    """
+    resolution = rollup_resolution(seconds, start_dt, end_dt)
+    if resolution:
+        return _bucket_rollups(seconds, resolution, symbol, start_dt, end_dt)
+    return queryset.annotate(
+        bucket=DateBin('datetime', seconds)
+    ).values('bucket', 'symbol').annotate(
+        open=FirstByTime('price'), high=Max('price'), low=Min('price'),
+        close=LastByTime('price'), average_price=Avg('price'),
+        count=Count('id')
+    ).order_by('bucket', 'symbol')
+
+
+def _bucket_rollups(seconds, resolution, symbol, start_dt, end_dt):
+    rollups = CryptoPriceRollup.objects.filter(
+        resolution=resolution, datetime__gte=start_dt, datetime__lte=end_dt)
+    if symbol:
+        rollups = rollups.filter(symbol=symbol)
+    if resolution == seconds:
+        # The rollups hold the buckets already
+        return rollups.values(
+            'symbol', bucket=F('datetime'), open=F('first_price'),
+            high=F('price_max'), low=F('price_min'), close=F('last_price'),
+            average_price=ExpressionWrapper(
+                F('price_sum') / F('price_count'), output_field=FloatField()),
+            count=F('price_count')
+        ).order_by('bucket', 'symbol')
+    return rollups.annotate(
+        bucket=DateBin('datetime', seconds)
+    ).values('bucket', 'symbol').annotate(
+        open=FirstByTime('first_price', time_field='first_datetime'),
+        high=Max('price_max'), low=Min('price_min'),
+        close=LastByTime('last_price', time_field='last_datetime'),
+        average_price=ExpressionWrapper(
+            Sum('price_sum') / Sum('price_count'), output_field=FloatField()),
+        count=Sum('price_count')
+    ).order_by('bucket', 'symbol')
+
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets downsampling.
+
+    The first and the last point are kept, the points between them are
+    split into threshold - 2 buckets, and the point of every bucket forming
+    the largest triangle with the point kept of the previous bucket and the
+    average of the next bucket is kept.
+
+    Args:
+      x (numpy.ndarray): Increasing x of the points, as float64
+      y (numpy.ndarray): y of the points, as float64
+      threshold (int): Number of points to keep, at least 3
+
+    Returns:
+      numpy.ndarray: Indices of the kept points, in increasing order
+    """
+    count = len(x)
+    if threshold >= count:
+        return np.arange(count)
+    # Bucket i holds the points [edges[i], edges[i + 1])
+    edges = np.linspace(1, count - 1, threshold - 1).astype(np.int64)
+    sizes = np.diff(edges)
+    # The averages of all buckets at once, from cumulative sums
+    sums_x = np.concatenate(([0.0], np.cumsum(x)))
+    sums_y = np.concatenate(([0.0], np.cumsum(y)))
+    averages_x = (sums_x[edges[1:]] - sums_x[edges[:-1]]) / sizes
+    averages_y = (sums_y[edges[1:]] - sums_y[edges[:-1]]) / sizes
+    # The last bucket is followed by the last point
+    averages_x = np.append(averages_x[1:], x[-1])
+    averages_y = np.append(averages_y[1:], y[-1])
+
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, count - 1
+    previous = 0
+    # Each bucket depends on the point kept of the one before, but the
+    # areas within a bucket are computed at once
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        areas = np.abs(
+            (x[previous] - averages_x[bucket]) * (y[start:end] - y[previous]) -
+            (x[previous] - x[start:end]) * (averages_y[bucket] - y[previous]))
+        previous = start + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+    return kept
+
+
+def downsample_prices(queryset, symbol, max_points, chunk_size):
+    """Keeps up to max_points prices of the queryset, of a single symbol,
+    chosen by LTTB
+
+    The prices are read through a server-side cursor, chunk_size at a time,
+    into arrays, rather than as a Python object per row.
+
+    Returns:
+      list: The kept prices as dicts of their fields, in time order
+    """
+    rows = queryset.order_by('datetime', 'id').values_list(
+        'id', 'datetime', 'price').iterator(chunk_size=chunk_size)
+    chunks = []
+    chunk = list(islice(rows, chunk_size))
+    while chunk:
+        ids, timestamps, prices = zip(*chunk)
+        chunks.append((np.array(ids, dtype=np.int64),
+                       np.array(timestamps, dtype='datetime64[us]'),
+                       np.array(prices, dtype=np.float64)))
+        chunk = list(islice(rows, chunk_size))
+    if not chunks:
+        return []
+    ids, timestamps, prices = (np.concatenate(column)
+                               for column in zip(*chunks))
+    if len(ids) > max_points:
+        # Seconds since the first price, which keeps the sums precise
+        x = (timestamps - timestamps[0]) / np.timedelta64(1, 's')
+        kept = lttb(x, prices, max_points)
+        ids, timestamps, prices = ids[kept], timestamps[kept], prices[kept]
+    return [{"id": row_id, "datetime": dt, "symbol": symbol, "price": price}
+            for row_id, dt, price in zip(ids.tolist(), timestamps.tolist(),
+                                         prices.tolist())]
@@ -0,0 +1,136 @@
+"""Prices of a range streamed as a file, for bulk downloads.
+
+The rows are read through a server-side cursor, EXPORT_CHUNK_SIZE at a time,
+and every chunk is sent as soon as it is encoded. So the memory used doesn't
+depend on the size of the range, and the first bytes go out right away.
+
+The stream is an async iterator, which the ASGI server sends as it goes.
+Under WSGI, Django would read all of it before sending anything.
+"""
+
+import csv
+import io
+from itertools import islice
+
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
+from asgiref.sync import sync_to_async
+
+FIELDS = ('id', 'datetime', 'symbol', 'price')
+
+
+class CSVExporter(object):
+    content_type = "text/csv"
+    extension = "csv"
+
+    def header(self):
+        return self._encode([FIELDS])
+
+    def chunk(self, rows):
+        return self._encode(
+            (row_id, timestamp.isoformat(), symbol, price)
+            for row_id, timestamp, symbol, price in rows)
+
+    def footer(self):
+        return b""
+
+    @staticmethod
+    def _encode(rows):
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(rows)
+        return buffer.getvalue().encode()
+
+
+class NDJSONExporter(object):
+    """A JSON object per line, with the same fields as the price list"""
+    content_type = "application/x-ndjson"
+    extension = "ndjson"
+
+    def header(self):
+        return b""
+
+    def chunk(self, rows):
+        return b"".join(orjson.dumps(dict(zip(FIELDS, row))) + b"\n"
+                        for row in rows)
+
+    def footer(self):
+        return b""
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file handing out what was written since the last take(),
+    while its position keeps counting from the start of the file, as the
+    Parquet footer refers to the row groups by their offsets"""
+
+    def __init__(self):
+        super(_Sink, self).__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class ParquetExporter(object):
+    """A Parquet file with a row group per chunk"""
+    content_type = "application/vnd.apache.parquet"
+    extension = "parquet"
+    schema = pa.schema([("id", pa.int64()), ("datetime", pa.timestamp("us")),
+                        ("symbol", pa.string()), ("price", pa.float64())])
+
+    def __init__(self):
+        self.sink = _Sink()
+        self.writer = pq.ParquetWriter(self.sink, self.schema)
+
+    def header(self):
+        return self.sink.take()
+
+    def chunk(self, rows):
+        self.writer.write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type)
+             for column, field in zip(zip(*rows), self.schema)],
+            schema=self.schema))
+        return self.sink.take()
+
+    def footer(self):
+        self.writer.close()
+        return self.sink.take()
+
+
+EXPORTERS = {"csv": CSVExporter, "ndjson": NDJSONExporter,
+             "parquet": ParquetExporter}
+
+
+async def stream_export(queryset, exporter, chunk_size):
+    """Yields the prices of the queryset encoded by the exporter, a chunk
+    of chunk_size rows at a time"""
+    # QuerySet.aiterator() of Django 4.2 runs values_list() queries from the
+    # event loop, so the rows are fetched from iterator() in a thread instead
+    rows = queryset.values_list(*FIELDS).iterator(chunk_size=chunk_size)
+    fetch = sync_to_async(lambda: list(islice(rows, chunk_size)))
+    try:
+        yield exporter.header()
+        chunk = await fetch()
+        while chunk:
+            yield exporter.chunk(chunk)
+            chunk = await fetch()
+        footer = exporter.footer()
+        if footer:
+            yield footer
+    finally:
+        # Closes the server-side cursor when the client goes away early
+        await sync_to_async(rows.close)()
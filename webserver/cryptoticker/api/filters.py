@@ -1,5 +1,13 @@
 import django_filters
-from .models import CryptoPrice
+from django import forms
+from django.conf import settings
+from django.core.validators import RegexValidator
+from .downsampling import INTERVAL_PATTERN
+from .models import CryptoPrice, CryptoPriceBar
+
+
+class IntegerFilter(django_filters.NumberFilter):
+    field_class = forms.IntegerField
 
 
 class CryptoPriceFilter(django_filters.FilterSet):
@@ -9,7 +17,29 @@ class CryptoPriceFilter(django_filters.FilterSet):
         field_name='datetime', lookup_expr='lte')
     symbol = django_filters.CharFilter(
         field_name='symbol', lookup_expr='exact')
+    # These reshape the prices rather than filter them, which the list view
+    # does, they are only validated here
+    interval = django_filters.CharFilter(
+        method='reshaped_by_view', validators=[RegexValidator(
+            INTERVAL_PATTERN, "Enter an interval such as 30s, 15m, 1h or 1d")])
+    max_points = IntegerFilter(
+        method='reshaped_by_view', min_value=3,
+        max_value=settings.DOWNSAMPLING_MAX_POINTS)
 
     class Meta:
         model = CryptoPrice
-        fields = ['start_datetime', 'end_datetime', 'symbol']
+        fields = ['start_datetime', 'end_datetime', 'symbol', 'interval',
+                  'max_points']
+
+    def reshaped_by_view(self, queryset, name, value):
+        return queryset
+
+
+class CryptoPriceBarFilter(CryptoPriceFilter):
+    interval = django_filters.NumberFilter(
+        field_name='interval', lookup_expr='exact')
+    max_points = None
+
+    class Meta:
+        model = CryptoPriceBar
+        fields = ['start_datetime', 'end_datetime', 'symbol', 'interval']
@@ -0,0 +1,202 @@
+"""The most recent prices of each symbol, held in memory by every worker.
+
+Dashboards ask for the last few hours of a symbol over and over. The first
+request for a symbol loads its last HOT_WINDOW_HOURS of prices into NumPy
+arrays. Later requests only fetch the rows newer than the newest one held
+and drop the rows that fell out of the window. Ranges starting inside the
+window are then cut out of the arrays with a binary search over the
+timestamps instead of querying crypto_price.
+
+The prices of a symbol are written by one receiver in time order, so a row
+older than the newest one held never shows up later.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+from django.conf import settings
+
+from .models import CryptoPrice
+
+# Rows the buffers of a symbol start with
+INITIAL_CAPACITY = 1024
+
+
+class PriceRows(object):
+    """Prices selected from a window, as a sequence of dicts built on
+    access, so that paginating only builds the rows of the page"""
+
+    def __init__(self, symbol, ids, timestamps, prices):
+        self.symbol = symbol
+        self.ids = ids
+        self.timestamps = timestamps
+        self.prices = prices
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._row(position)
+                    for position in range(*index.indices(len(self)))]
+        return self._row(index)
+
+    def after(self, key_datetime, key_id):
+        """Returns the rows after the given (datetime, id), as PriceRows"""
+        key = np.datetime64(key_datetime, 'us')
+        first = int(np.searchsorted(self.timestamps, key, side='left'))
+        last = int(np.searchsorted(self.timestamps, key, side='right'))
+        first += int(np.count_nonzero(self.ids[first:last] <= key_id))
+        return PriceRows(self.symbol, self.ids[first:],
+                         self.timestamps[first:], self.prices[first:])
+
+    def _row(self, position):
+        return {
+            'id': int(self.ids[position]),
+            'datetime': self.timestamps[position].item(),
+            'symbol': self.symbol,
+            'price': float(self.prices[position])
+        }
+
+
+class PriceWindow(object):
+    """Prices of one symbol in time order, complete from 'start' on.
+
+    A ring buffer over preallocated arrays, with the live rows in
+    [head, tail): rows are appended at the tail and expire by moving the
+    head. When the tail reaches the end, the live rows are moved back to the
+    front, or into arrays twice the size when they fill half of them, which
+    keeps the rows contiguous for the binary search."""
+
+    def __init__(self, start):
+        self.start = start
+        self.ids = np.empty(INITIAL_CAPACITY, dtype=np.int64)
+        self.timestamps = np.empty(INITIAL_CAPACITY, dtype='datetime64[us]')
+        self.prices = np.empty(INITIAL_CAPACITY, dtype=np.float64)
+        self.head = 0
+        self.tail = 0
+        self.refreshed = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.tail - self.head
+
+    @property
+    def last_datetime(self):
+        if not len(self):
+            return None
+        return self.timestamps[self.tail - 1].item()
+
+    def append(self, ids, timestamps, prices):
+        count = len(ids)
+        if self.tail + count > len(self.ids):
+            self._make_room(count)
+        end = self.tail + count
+        self.ids[self.tail:end] = ids
+        self.timestamps[self.tail:end] = timestamps
+        self.prices[self.tail:end] = prices
+        self.tail = end
+
+    def _make_room(self, count):
+        live = len(self)
+        capacity = len(self.ids)
+        if (live + count) * 2 > capacity:
+            capacity = max(capacity * 2, (live + count) * 2)
+        for name in ('ids', 'timestamps', 'prices'):
+            rows = getattr(self, name)
+            moved = rows if capacity == len(rows) else np.empty(
+                capacity, dtype=rows.dtype)
+            moved[:live] = rows[self.head:self.tail]
+            setattr(self, name, moved)
+        self.head, self.tail = 0, live
+
+    def expire(self, cutoff):
+        self.head += int(np.searchsorted(
+            self.timestamps[self.head:self.tail], np.datetime64(cutoff, 'us')))
+        self.start = max(self.start, cutoff)
+
+    def select(self, symbol, start_dt, end_dt=None):
+        """Returns the rows within [start_dt, end_dt] as PriceRows"""
+        timestamps = self.timestamps[self.head:self.tail]
+        first = self.head + int(np.searchsorted(
+            timestamps, np.datetime64(start_dt, 'us'), side='left'))
+        last = self.tail if end_dt is None else self.head + int(
+            np.searchsorted(timestamps, np.datetime64(end_dt, 'us'),
+                            side='right'))
+        # Copies, as the buffers change with the next refresh
+        return PriceRows(symbol, self.ids[first:last].copy(),
+                         self.timestamps[first:last].copy(),
+                         self.prices[first:last].copy())
+
+
+class HotWindowCache(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.windows = OrderedDict()
+
+    def reset(self):
+        """Forgets all windows, e.g. when the tables were recreated"""
+        with self.lock:
+            self.windows = OrderedDict()
+
+    def get(self, symbol, start_dt, end_dt=None):
+        """Returns the prices of the symbol within [start_dt, end_dt] from
+        its window
+
+        Returns:
+          PriceRows: The prices, or None if the range doesn't start inside
+                     the window
+        """
+        hours = settings.HOT_WINDOW_HOURS
+        if not hours or not symbol or start_dt is None:
+            return None
+        window_start = datetime.now() - timedelta(hours=hours)
+        if start_dt < window_start:
+            return None
+        window = self._window(symbol, window_start)
+        with window.lock:
+            self._refresh(symbol, window, window_start)
+            if start_dt < window.start:
+                return None
+            return window.select(symbol, start_dt, end_dt)
+
+    def _window(self, symbol, window_start):
+        with self.lock:
+            window = self.windows.get(symbol)
+            if window is None:
+                window = self.windows[symbol] = PriceWindow(window_start)
+                # The least recently used symbols make room
+                while len(self.windows) > settings.HOT_WINDOW_MAX_SYMBOLS:
+                    self.windows.popitem(last=False)
+            else:
+                self.windows.move_to_end(symbol)
+            return window
+
+    @staticmethod
+    def _refresh(symbol, window, window_start):
+        now = time.monotonic()
+        if window.refreshed is not None and \
+                now - window.refreshed < settings.HOT_WINDOW_REFRESH_INTERVAL:
+            return
+        window.refreshed = now
+        last_datetime = window.last_datetime
+        queryset = CryptoPrice.objects.filter(symbol=symbol)
+        if last_datetime is None:
+            queryset = queryset.filter(datetime__gte=window.start)
+        else:
+            queryset = queryset.filter(datetime__gt=last_datetime)
+        rows = list(queryset.order_by('datetime').values_list(
+            'id', 'datetime', 'price'))
+        if rows:
+            ids, timestamps, prices = zip(*rows)
+            window.append(np.array(ids, dtype=np.int64),
+                          np.array(timestamps, dtype='datetime64[us]'),
+                          np.array(prices, dtype=np.float64))
+        window.expire(window_start)
+
+
+cache = HotWindowCache()
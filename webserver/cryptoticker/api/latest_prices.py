@@ -0,0 +1,57 @@
+"""Latest prices read through the cache shared by the workers.
+
+The data receiver only updates latest_crypto_price once per flush, every
+DATA_UPDATING_INTERVAL seconds, so the cached prices expire after that long
+and are at most one flush behind. Symbols missing from the cache are
+fetched from the DB together, in one query. Symbols the DB has no price of
+are cached too, as MISSING, for a shorter time, so that polling an unknown
+symbol doesn't query the DB every time.
+"""
+
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import LatestCryptoPrice
+
+CACHE_KEY = "latest_price:%s"
+# Cached for the symbols without a price
+MISSING = "missing"
+# Anything else can't be a symbol and would not make a valid cache key
+SYMBOL_PATTERN = re.compile(r"^[A-Za-z0-9]{1,20}$")
+
+
+def get_latest_prices(symbols):
+    """Returns the latest prices of the symbols
+
+    Args:
+      symbols (list): Symbols to look up
+
+    Returns:
+      dict: Maps every symbol with a price to a dict of its latest_price
+            and datetime
+    """
+    keys = {symbol: CACHE_KEY % symbol for symbol in symbols
+            if SYMBOL_PATTERN.match(symbol)}
+    cached = cache.get_many(keys.values())
+    prices = {symbol: cached[key] for symbol, key in keys.items()
+              if key in cached}
+    missing = [symbol for symbol in keys if symbol not in prices]
+    if missing:
+        fetched = {
+            entry.symbol: {
+                "latest_price": entry.price,
+                "datetime": entry.datetime
+            } for entry in LatestCryptoPrice.objects.filter(
+                symbol__in=missing)
+        }
+        cache.set_many({keys[symbol]: price
+                        for symbol, price in fetched.items()},
+                       timeout=settings.LATEST_PRICE_CACHE_TIMEOUT)
+        cache.set_many({keys[symbol]: MISSING for symbol in missing
+                        if symbol not in fetched},
+                       timeout=settings.MISSING_PRICE_CACHE_TIMEOUT)
+        prices.update(fetched)
+    return {symbol: price for symbol, price in prices.items()
+            if price != MISSING}
@@ -0,0 +1,203 @@
+"""Latest prices pushed to clients as Server-Sent Events.
+
+The data receiver sends one notification on LIVE_PRICE_CHANNEL per flush,
+carrying the prices it updated. Every worker process listens on a single
+connection of its own and fans the prices out to all of its subscribers, so
+the DB work per update doesn't grow with the number of clients. Subscribers
+that can't keep up only miss intermediate prices, they always get the
+newest price of each symbol.
+
+Needs an ASGI server, the event loop of which the listening connection is
+watched from.
+"""
+
+import asyncio
+import json
+import logging
+
+import psycopg2
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from .models import LatestCryptoPrice
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before listening again after losing the connection
+RECONNECT_DELAY = 5
+
+
+def read_latest_prices(symbols=None):
+    queryset = LatestCryptoPrice.objects.all()
+    if symbols is not None:
+        queryset = queryset.filter(symbol__in=symbols)
+    return [price_event(entry.symbol, entry.price, entry.datetime.isoformat())
+            for entry in queryset]
+
+
+def price_event(symbol, price, datetime):
+    # The same fields as the current_price endpoint
+    return {"symbol": symbol, "latest_price": price, "datetime": datetime}
+
+
+def open_listening_connection():
+    connection = psycopg2.connect(
+        **connections['default'].get_connection_params())
+    connection.autocommit = True
+    connection.cursor().execute(f"LISTEN {settings.LIVE_PRICE_CHANNEL}")
+    return connection
+
+
+class Subscription(object):
+    """Prices of the subscribed symbols, all of them if symbols is None,
+    not yet sent to the client"""
+
+    def __init__(self, symbols=None):
+        self.symbols = symbols
+        self.pending = {}
+        self.event = asyncio.Event()
+
+    def publish(self, prices):
+        for price in prices:
+            if self.symbols is None or price["symbol"] in self.symbols:
+                self.pending[price["symbol"]] = price
+        if self.pending:
+            self.event.set()
+
+    async def get(self, timeout):
+        """Returns the pending prices, waiting up to timeout seconds for
+        some to arrive"""
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self.event.clear()
+        prices, self.pending = self.pending, {}
+        return list(prices.values())
+
+
+class PriceBroadcaster(object):
+
+    def __init__(self):
+        self.subscriptions = set()
+        self.connection = None
+        # Kept apart, as a connection closed on an error has none any more
+        self.fileno = None
+        self.connecting = None
+        self.loop = None
+
+    def subscribe(self, symbols=None):
+        """Starts listening if needed, must run on the event loop"""
+        self._listen(asyncio.get_running_loop())
+        subscription = Subscription(symbols)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscriptions.discard(subscription)
+
+    def publish(self, prices):
+        for subscription in list(self.subscriptions):
+            subscription.publish(prices)
+
+    def dispatch(self, payload):
+        """Publishes the prices of a notification of the data receiver"""
+        if payload:
+            self.publish([price_event(*entry)
+                          for entry in json.loads(payload)])
+        else:
+            # Too many prices for a notification, all are read instead
+            self.loop.create_task(self._publish_all())
+
+    async def _publish_all(self):
+        self.publish(await sync_to_async(read_latest_prices)())
+
+    def _listen(self, loop):
+        """Starts connecting, unless listening or connecting on the loop
+        already"""
+        if self.loop is loop and (self.connection is not None or (
+                self.connecting is not None and not self.connecting.done())):
+            return
+        self.close()
+        self.loop = loop
+        self.connecting = loop.create_task(self._connect())
+
+    async def _connect(self):
+        task = asyncio.current_task()
+        loop = self.loop
+        try:
+            # Blocks until the server answers, so not on the event loop
+            connection = await loop.run_in_executor(
+                None, open_listening_connection)
+        except psycopg2.Error as e:
+            logger.error("Listening for prices failed: %s", e)
+            if self.connecting is task:
+                loop.call_later(RECONNECT_DELAY, self._listen, loop)
+            return
+        if self.connecting is not task:
+            # Closed while connecting
+            connection.close()
+            return
+        self.fileno = connection.fileno()
+        loop.add_reader(self.fileno, self._on_readable)
+        self.connection = connection
+        # The updates notified while not listening are lost, the current
+        # prices are published in their place
+        if self.subscriptions:
+            await self._publish_all()
+
+    def _on_readable(self):
+        try:
+            self.connection.poll()
+        except psycopg2.Error as e:
+            logger.error("Lost the connection listening for prices: %s", e)
+            self.close()
+            self.loop.call_later(RECONNECT_DELAY, self._listen, self.loop)
+            return
+        while self.connection.notifies:
+            self.dispatch(self.connection.notifies.pop(0).payload)
+
+    def close(self):
+        """Stops listening"""
+        # A connection still being opened is closed once open
+        self.connecting = None
+        if self.connection is None:
+            return
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.remove_reader(self.fileno)
+        self.connection.close()
+        self.connection = None
+        self.fileno = None
+
+
+broadcaster = PriceBroadcaster()
+
+
+async def stream_prices(symbols=None):
+    """Server-Sent Events with the current prices of the symbols first, then
+    every update, and a comment to keep the connection open when there is
+    none. Ends after LIVE_PRICE_STREAM_DURATION, the client reconnecting
+    right away, so that streams of clients gone unnoticed don't pile up."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.LIVE_PRICE_STREAM_DURATION
+    # Subscribed before reading the current prices, for no update to fall
+    # between them. Updates before the broadcaster listens are covered by
+    # the current prices it publishes once listening
+    subscription = broadcaster.subscribe(symbols)
+    try:
+        yield "retry: 1000\n\n"
+        prices = await sync_to_async(read_latest_prices)(symbols)
+        while True:
+            if prices:
+                yield "".join(f"data: {json.dumps(price)}\n\n"
+                              for price in prices)
+            else:
+                yield ": keepalive\n\n"
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            prices = await subscription.get(
+                min(settings.LIVE_PRICE_KEEPALIVE, remaining))
+    finally:
+        broadcaster.unsubscribe(subscription)
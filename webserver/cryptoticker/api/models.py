@@ -44,6 +44,52 @@ class LatestCryptoPrice(CustomBaseModel):
         db_table = "latest_crypto_price"
 
 
+class CryptoPriceBar(CustomBaseModel):
+
+    symbol = models.CharField("Symbol", max_length=20)
+    interval = models.IntegerField("Interval")
+    datetime = models.DateTimeField("Datetime")
+    open = models.FloatField("Open")
+    high = models.FloatField("High")
+    low = models.FloatField("Low")
+    close = models.FloatField("Close")
+    volume = models.FloatField("Volume")
+    vwap = models.FloatField("VWAP")
+    trade_count = models.IntegerField("Trade count")
+
+    def __str__(self):
+        return "DateTime: {}, Symbol: {}, Interval: {}, Close: {}".format(
+            self.datetime, self.symbol, self.interval, self.close)
+
+    class Meta:
+        managed = False
+        db_table = "crypto_price_bar"
+
+
+class CryptoPriceRollup(CustomBaseModel):
+
+    symbol = models.CharField("Symbol", max_length=20)
+    resolution = models.IntegerField("Resolution")
+    datetime = models.DateTimeField("Datetime")
+    price_count = models.IntegerField("Price count")
+    price_sum = models.FloatField("Price sum")
+    price_sum_of_squares = models.FloatField("Price sum of squares")
+    price_min = models.FloatField("Minimum price")
+    price_max = models.FloatField("Maximum price")
+    first_price = models.FloatField("First price")
+    first_datetime = models.DateTimeField("First datetime")
+    last_price = models.FloatField("Last price")
+    last_datetime = models.DateTimeField("Last datetime")
+
+    def __str__(self):
+        return "DateTime: {}, Symbol: {}, Resolution: {}, Count: {}".format(
+            self.datetime, self.symbol, self.resolution, self.price_count)
+
+    class Meta:
+        managed = False
+        db_table = "crypto_price_rollup"
+
+
 class Settings(CustomBaseModel):
 
     name = models.CharField("Name", max_length=255, primary_key=True)
@@ -0,0 +1,109 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .hot_window import PriceRows
+
+
+class KeysetPagination(BasePagination):
+    """Pagination seeking to the (datetime, id) of the last row of the
+    previous page, which the 'cursor' of the next link encodes.
+
+    Unlike an offset, the cursor turns into a lower bound on datetime that
+    the (symbol, datetime) index seeks to, so every page of a range costs
+    about the same however deep it is. The count of the whole range is only
+    computed with count=true."""
+    limit_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    max_limit = 10000
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        key = self.decode_cursor(request)
+        self.count = None
+        if request.query_params.get(self.count_query_param, '').lower() \
+                == 'true':
+            self.count = len(queryset) if isinstance(queryset, PriceRows) \
+                else queryset.count()
+
+        if isinstance(queryset, PriceRows):
+            # Rows of the hot window, in time order already
+            if key:
+                queryset = queryset.after(*key)
+        else:
+            queryset = queryset.order_by('datetime', 'id')
+            if key:
+                key_datetime, key_id = key
+                # The bound on datetime alone is what the index seeks to, the
+                # id only decides between rows of that same datetime
+                queryset = queryset.filter(datetime__gte=key_datetime).filter(
+                    Q(datetime__gt=key_datetime) | Q(id__gt=key_id))
+        # One more row than the page tells whether there is a next one
+        rows = list(queryset[:self.limit + 1])
+        self.next_key = None
+        if len(rows) > self.limit:
+            rows = rows[:self.limit]
+            self.next_key = self._key(rows[-1])
+        return rows
+
+    def get_paginated_response(self, data):
+        response = {}
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['results'] = data
+        return Response(response)
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return api_settings.PAGE_SIZE
+        if limit <= 0:
+            return api_settings.PAGE_SIZE
+        return min(limit, self.max_limit)
+
+    def get_next_link(self):
+        if self.next_key is None:
+            return None
+        url = self.request.build_absolute_uri()
+        # The count of the range doesn't change between pages
+        url = remove_query_param(url, self.count_query_param)
+        return replace_query_param(url, self.cursor_query_param,
+                                   self.encode_cursor(*self.next_key))
+
+    def get_previous_link(self):
+        return None
+
+    @staticmethod
+    def encode_cursor(key_datetime, key_id):
+        cursor = f"{key_datetime.isoformat()} {key_id}"
+        return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+    def decode_cursor(self, request):
+        """Returns the (datetime, id) of the cursor, None if there is none"""
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            key_datetime, key_id = base64.urlsafe_b64decode(
+                cursor.encode()).decode().split(' ')
+            return datetime.fromisoformat(key_datetime), int(key_id)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def _key(row):
+        if isinstance(row, dict):
+            return row['datetime'], row['id']
+        return row.datetime, row.id
@@ -0,0 +1,29 @@
+import numpy as np
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSONRenderer rendering with orjson, which encodes large lists of rows
+    several times faster than the json module. Renders the same JSON, except
+    that NaN and infinite floats become null. Pretty printing, as the
+    browsable API asks for, is left to JSONRenderer."""
+    encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super(ORJSONRenderer, self).render(
+                data, accepted_media_type, renderer_context)
+        return orjson.dumps(data, default=self.default)
+
+    @classmethod
+    def default(cls, obj):
+        # orjson only handles the exact builtin types and datetimes itself
+        if isinstance(obj, np.generic):
+            return obj.item()
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        return cls.encoder.default(obj)
@@ -0,0 +1,189 @@
+import json
+import math
+from datetime import datetime, timedelta
+from django.db.models import Count, F, Max, Min, Sum
+
+from .aggregates import FirstByTime, LastByTime, Median, price_statistics
+from .models import CryptoPriceRollup, Settings
+
+# Rollup resolutions maintained by the data receiver, coarsest first
+RESOLUTIONS = {86400: "1d", 3600: "1h", 60: "1m"}
+
+# Settings entry holding the time from which on the rollups are complete
+ROLLUP_START_SETTING = "rollup_start_date"
+# Settings entry holding the ranges of the compacted partitions of the
+# prices, see lib/db/partitions.py
+COMPACTED_RANGES_SETTING = "compacted_ranges"
+
+
+def _get_setting_datetime(name):
+    setting = Settings.objects.filter(name=name).first()
+    if setting is None:
+        return None
+    return datetime.strptime(setting.value, '%Y-%m-%d %H:%M:%S')
+
+
+def compacted_ranges(start_dt, end_dt):
+    """Returns the ranges of compacted prices overlapping [start_dt,
+    end_dt], open on the sides that are None. Their prices are averages of
+    buckets of bucket_seconds, dated at the start of the bucket.
+
+    Returns:
+      list: Dicts of start_datetime, end_datetime (exclusive) and
+            bucket_seconds, in time order
+    """
+    setting = Settings.objects.filter(name=COMPACTED_RANGES_SETTING).first()
+    if setting is None:
+        return []
+    ranges = []
+    for start, end, bucket_seconds in json.loads(setting.value):
+        start = datetime.fromisoformat(start)
+        end = datetime.fromisoformat(end)
+        if (end_dt is None or start <= end_dt) and \
+                (start_dt is None or end > start_dt):
+            ranges.append({'start_datetime': start, 'end_datetime': end,
+                           'bucket_seconds': bucket_seconds})
+    return ranges
+
+
+def choose_resolution(start_dt, end_dt):
+    """Returns the coarsest rollup resolution (in seconds) whose buckets
+    cover [start_dt, end_dt] exactly, or None if only the raw prices can
+    answer for that range."""
+    if start_dt is None or end_dt is None:
+        return None
+    rollup_start_dt = _get_setting_datetime(ROLLUP_START_SETTING)
+    if rollup_start_dt is None:
+        return None
+    # Buckets starting before the rollups were set up may be incomplete
+    if start_dt < rollup_start_dt:
+        return None
+    # Prices are stored for whole seconds and end_datetime is inclusive
+    end_dt = end_dt + timedelta(seconds=1)
+    for resolution in RESOLUTIONS:
+        if _is_aligned(start_dt, resolution) and \
+                _is_aligned(end_dt, resolution):
+            return resolution
+    return None
+
+
+def _is_aligned(dt, resolution):
+    seconds = dt.hour * 3600 + dt.minute * 60 + dt.second
+    return dt.microsecond == 0 and seconds % resolution == 0
+
+
+def split_range(start_dt, end_dt):
+    """Splits [start_dt, end_dt], open on the sides that are None, into the
+    buckets of the coarsest rollups that fit in it whole, and the raw
+    prices left at its edges
+
+    Returns:
+      list: (resolution, start_dt, end_dt) pieces in time order, the
+            resolution None for raw prices, end_dt exclusive and either
+            datetime None where the range is open
+    """
+    rollup_start_dt = _get_setting_datetime(ROLLUP_START_SETTING)
+    if rollup_start_dt is None:
+        return [(None, start_dt, end_dt and end_dt + timedelta(seconds=1))]
+    pieces = []
+    # Buckets starting before the rollups were set up may be incomplete
+    if start_dt is None or start_dt < rollup_start_dt:
+        pieces.append((None, start_dt, rollup_start_dt))
+        start_dt = rollup_start_dt
+    # Prices are stored for whole seconds and end_datetime is inclusive.
+    # Past the last whole minute, the prices still coming in are raw.
+    if end_dt is None:
+        end_dt = _floor(datetime.now(), min(RESOLUTIONS))
+        tail = [(None, end_dt, None)]
+    else:
+        end_dt = end_dt + timedelta(seconds=1)
+        tail = []
+    if start_dt < end_dt:
+        pieces.extend(_split(start_dt, end_dt, list(RESOLUTIONS)))
+    elif pieces:
+        # Ends before the rollups start
+        return [(None, pieces[0][1], end_dt)]
+    return pieces + tail
+
+
+def _split(start_dt, end_dt, resolutions):
+    for index, resolution in enumerate(resolutions):
+        first_dt = _ceil(start_dt, resolution)
+        last_dt = _floor(end_dt, resolution)
+        if first_dt < last_dt:
+            finer = resolutions[index + 1:]
+            return _split(start_dt, first_dt, finer) + \
+                [(resolution, first_dt, last_dt)] + \
+                _split(last_dt, end_dt, finer)
+    return [(None, start_dt, end_dt)] if start_dt < end_dt else []
+
+
+def _floor(dt, resolution):
+    seconds = dt.hour * 3600 + dt.minute * 60 + dt.second
+    return dt - timedelta(seconds=seconds % resolution,
+                          microseconds=dt.microsecond)
+
+
+def _ceil(dt, resolution):
+    floor_dt = _floor(dt, resolution)
+    return floor_dt if floor_dt == dt else \
+        floor_dt + timedelta(seconds=resolution)
+
+
+def summarize_prices(queryset, symbol, start_dt, end_dt):
+    """Statistics of the prices of the queryset, of a single symbol over
+    [start_dt, end_dt], taken from the rollups where whole buckets fit in
+    the range. Only the median and the edges left over go to the raw
+    prices. A range without a whole minute of rollups is summarized from
+    the raw prices in a single query.
+
+    Returns:
+      dict: The statistics of price_statistics, None if there are no
+            prices
+    """
+    pieces = split_range(start_dt, end_dt)
+    if all(resolution is None for resolution, _, _ in pieces):
+        return price_statistics(queryset)
+    totals = []
+    for resolution, piece_start_dt, piece_end_dt in pieces:
+        if resolution is None:
+            prices = queryset
+            if piece_start_dt is not None:
+                prices = prices.filter(datetime__gte=piece_start_dt)
+            if piece_end_dt is not None:
+                prices = prices.filter(datetime__lt=piece_end_dt)
+            totals.append(prices.aggregate(
+                count=Count('id'), sum=Sum('price'),
+                sum_of_squares=Sum(F('price') * F('price')),
+                min=Min('price'), max=Max('price'),
+                first=FirstByTime('price'), last=LastByTime('price')))
+        else:
+            totals.append(CryptoPriceRollup.objects.filter(
+                symbol=symbol, resolution=resolution,
+                datetime__gte=piece_start_dt,
+                datetime__lt=piece_end_dt).aggregate(
+                count=Sum('price_count'), sum=Sum('price_sum'),
+                sum_of_squares=Sum('price_sum_of_squares'),
+                min=Min('price_min'), max=Max('price_max'),
+                first=FirstByTime('first_price', time_field='first_datetime'),
+                last=LastByTime('last_price', time_field='last_datetime')))
+    totals = [piece for piece in totals if piece['count']]
+    if not totals:
+        return None
+    total_count = sum(piece['count'] for piece in totals)
+    average_price = sum(piece['sum'] for piece in totals) / total_count
+    # Population variance from the sums, floating point noise can make it
+    # slightly negative
+    variance = sum(piece['sum_of_squares'] for piece in totals) / \
+        total_count - average_price ** 2
+    return {
+        'total_count': total_count,
+        'average_price': average_price,
+        'median_price': queryset.aggregate(
+            median_price=Median('price'))['median_price'],
+        'standard_deviation': math.sqrt(max(variance, 0)),
+        'min_price': min(piece['min'] for piece in totals),
+        'max_price': max(piece['max'] for piece in totals),
+        'first_price': totals[0]['first'],
+        'last_price': totals[-1]['last']
+    }
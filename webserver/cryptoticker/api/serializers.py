@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import CryptoPrice, LatestCryptoPrice, Settings
+from .models import CryptoPrice, CryptoPriceBar, LatestCryptoPrice, Settings
 
 
 class CryptoPriceSerializer(serializers.ModelSerializer):
@@ -9,6 +9,17 @@ class CryptoPriceSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class CryptoPriceBucketSerializer(serializers.Serializer):
+    datetime = serializers.DateTimeField(source='bucket')
+    symbol = serializers.CharField()
+    open = serializers.FloatField()
+    high = serializers.FloatField()
+    low = serializers.FloatField()
+    close = serializers.FloatField()
+    average_price = serializers.FloatField()
+    count = serializers.IntegerField()
+
+
 class LatestCryptoPriceSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -16,6 +27,13 @@ class LatestCryptoPriceSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class CryptoPriceBarSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = CryptoPriceBar
+        fields = '__all__'
+
+
 class SettingsSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -1,13 +1,47 @@
+import csv
+import io
+import json
 import re
+from unittest import mock
+import numpy as np
+import pyarrow.parquet as pq
+from asgiref.sync import sync_to_async
 from deepdiff import DeepDiff
 from pprint import pformat
 from django.apps import apps
+from django.core.cache import cache
 from django.db import connection
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from datetime import datetime, timedelta
+from rest_framework.renderers import JSONRenderer
 
-from .models import CryptoPrice, LatestCryptoPrice, Settings
+from . import downsampling, export, hot_window, live_prices, rollups
+from .serializers import CryptoPriceSerializer
+from .models import (CryptoPrice, CryptoPriceBar, CryptoPriceRollup,
+                     LatestCryptoPrice, Settings)
+
+
+def _reference_lttb(x, y, threshold):
+    # LTTB as first described, one point at a time
+    if threshold >= len(x):
+        return list(range(len(x)))
+    every = (len(x) - 2) / (threshold - 2)
+    kept = [0]
+    for bucket in range(threshold - 2):
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+        next_end = min(int((bucket + 2) * every) + 1, len(x))
+        average_x = sum(x[end:next_end]) / (next_end - end)
+        average_y = sum(y[end:next_end]) / (next_end - end)
+        previous = kept[-1]
+        areas = [abs((x[previous] - average_x) * (y[index] - y[previous]) -
+                     (x[previous] - x[index]) * (average_y - y[previous]))
+                 for index in range(start, end)]
+        kept.append(start + areas.index(max(areas)))
+    kept.append(len(x) - 1)
+    return kept
 
 
 class CryptoTickerTestCase(TestCase):
@@ -15,6 +49,8 @@ class CryptoTickerTestCase(TestCase):
     current_crypto_price = reverse("current-crypto-price")
     crypto_price_list = reverse("crypto-price-list")
     crypto_price_statistics = reverse("crypto-price-statistics")
+    crypto_price_bars = reverse("crypto-price-bars")
+    crypto_price_export = reverse("crypto-price-export")
 
     def setUp(self):
         super(CryptoTickerTestCase, self).setUp()
@@ -25,6 +61,8 @@ class CryptoTickerTestCase(TestCase):
                 m for m in get_models() if not m._meta.managed]
             for m in self.unmanaged_models:
                 schema_editor.create_model(m)
+        hot_window.cache.reset()
+        cache.clear()
 
         # Supporting data
         self.data_collection_start_date = datetime.strptime(
@@ -51,6 +89,13 @@ class CryptoTickerTestCase(TestCase):
         CryptoPrice(symbol="BTCUSDT", price="3333.33",
                     datetime=self.min_2).save()
 
+        CryptoPriceBar(symbol="BTCUSDT", interval=60, datetime=self.min_4,
+                       open=1111.11, high=1500.0, low=1000.0, close=1200.0,
+                       volume=2.0, vwap=1250.0, trade_count=7).save()
+        CryptoPriceBar(symbol="BTCUSDT", interval=60, datetime=self.min_3,
+                       open=2222.22, high=2500.0, low=2000.0, close=2100.0,
+                       volume=1.0, vwap=2200.0, trade_count=3).save()
+
     def tearDown(self):
         super(CryptoTickerTestCase, self).tearDown()
 
@@ -78,6 +123,161 @@ class CryptoTickerTestCase(TestCase):
         assert DeepDiff(expected_output, response.json()
                         ) == {}, response.json()
 
+    def test_current_crypto_price_no_symbol(self):
+        for params in ({}, {"symbol": ""}, {"symbols": ""}, {"symbols": ","}):
+            response = self.client.get(self.current_crypto_price, params)
+            assert response.status_code == 400
+            expected_output = {
+                "detail": "No cryptocurrency pair given, in symbol or symbols"}
+            assert DeepDiff(expected_output, response.json()
+                            ) == {}, (params, response.json())
+
+    def test_unknown_crypto_price_cached(self):
+        self.client.get(self.current_crypto_price, {"symbol": "ETHUSDT"})
+        # Unknown symbols are looked up once, until the marker expires
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                self.current_crypto_price, {"symbol": "ETHUSDT"})
+        assert response.status_code == 400
+        LatestCryptoPrice(symbol="ETHUSDT", price=33.33,
+                          datetime=self.min_2).save()
+        # As when the marker expires
+        cache.clear()
+        response = self.client.get(
+            self.current_crypto_price, {"symbol": "ETHUSDT"})
+        assert response.status_code == 200
+        assert response.json()["latest_price"] == 33.33
+
+    def test_current_crypto_price_cached(self):
+        self.client.get(self.current_crypto_price, {"symbol": "BTCUSDT"})
+        # Served from the cache until the receiver's next update
+        LatestCryptoPrice.objects.filter(symbol="BTCUSDT").update(price=4444.44)
+        with self.assertNumQueries(0):
+            data = self.client.get(
+                self.current_crypto_price, {"symbol": "BTCUSDT"}).json()
+        assert data["latest_price"] == 3333.33, data
+        with override_settings(LATEST_PRICE_CACHE_TIMEOUT=0):
+            cache.clear()
+            self.client.get(self.current_crypto_price, {"symbol": "BTCUSDT"})
+            data = self.client.get(
+                self.current_crypto_price, {"symbol": "BTCUSDT"}).json()
+        assert data["latest_price"] == 4444.44, data
+
+    def test_current_crypto_prices_batch(self):
+        LatestCryptoPrice(symbol="ETHUSDT", price=33.33,
+                          datetime=self.min_2).save()
+        self.client.get(self.current_crypto_price, {"symbol": "BTCUSDT"})
+        # Only ETHUSDT is missing from the cache, fetched in one query
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                self.current_crypto_price, {"symbols": "BTCUSDT,ETHUSDT"})
+        assert response.status_code == 200
+        expected_output = {
+            "BTCUSDT": {"latest_price": 3333.33, "datetime": "2024-04-01T11:05:47"},
+            "ETHUSDT": {"latest_price": 33.33, "datetime": "2024-04-01T11:05:47"}}
+        assert DeepDiff(expected_output, response.json()) == {}, response.json()
+
+        response = self.client.get(
+            self.current_crypto_price, {"symbols": "BTCUSDT,JUNK,bad key"})
+        assert response.status_code == 400
+        expected_output = {
+            "detail": "The given cryptocurrency pair JUNK,bad key is either not supported or invalid"}
+        assert DeepDiff(expected_output, response.json()) == {}, response.json()
+
+    @override_settings(LIVE_PRICE_KEEPALIVE=0.05, LIVE_PRICE_STREAM_DURATION=1)
+    async def test_live_price_stream(self):
+        response = await self.async_client.get(
+            reverse("live-crypto-price"), {"symbols": "BTCUSDT"})
+        assert response.status_code == 200
+        assert response["Content-Type"] == "text/event-stream"
+        stream = response.streaming_content.__aiter__()
+        try:
+            assert (await stream.__anext__()).decode() == "retry: 1000\n\n"
+            # The current price first
+            event = (await stream.__anext__()).decode()
+            assert json.loads(event[len("data: "):]) == {
+                "symbol": "BTCUSDT", "latest_price": 3333.33,
+                "datetime": "2024-04-01T11:05:47"}, event
+            # Listening from then on, connected off the event loop
+            await live_prices.broadcaster.connecting
+            assert live_prices.broadcaster.connection is not None
+            # Then the updates of the subscribed symbols
+            live_prices.broadcaster.dispatch(
+                '[["ETHUSDT",33.33,"2024-04-01T11:06:47"],'
+                '["BTCUSDT",4444.44,"2024-04-01T11:06:47"]]')
+            event = (await stream.__anext__()).decode()
+            assert json.loads(event[len("data: "):]) == {
+                "symbol": "BTCUSDT", "latest_price": 4444.44,
+                "datetime": "2024-04-01T11:06:47"}, event
+            assert (await stream.__anext__()).decode() == ": keepalive\n\n"
+            # Without prices in the notification, they are read from DB
+            await LatestCryptoPrice.objects.filter(symbol="BTCUSDT").aupdate(
+                price=5555.55)
+            live_prices.broadcaster.dispatch("")
+            event = (await stream.__anext__()).decode()
+            while event == ": keepalive\n\n":
+                event = (await stream.__anext__()).decode()
+            assert json.loads(event[len("data: "):])["latest_price"] == 5555.55, event
+            # The stream ends after its duration and unsubscribes
+            async for event in stream:
+                assert event == b": keepalive\n\n", event
+            assert not live_prices.broadcaster.subscriptions
+        finally:
+            live_prices.broadcaster.close()
+
+    @override_settings(LIVE_PRICE_KEEPALIVE=0.05, LIVE_PRICE_STREAM_DURATION=5)
+    async def test_live_price_stream_reconnect(self):
+        response = await self.async_client.get(
+            reverse("live-crypto-price"), {"symbols": "BTCUSDT"})
+        stream = response.streaming_content.__aiter__()
+        broadcaster = live_prices.broadcaster
+        try:
+            await stream.__anext__()
+            await stream.__anext__()
+            await broadcaster.connecting
+            # The listening connection is dropped, e.g. on a DB restart, and
+            # a price updated before listening again
+            await LatestCryptoPrice.objects.filter(symbol="BTCUSDT").aupdate(
+                price=6666.66)
+            pid = broadcaster.connection.get_backend_pid()
+
+            def terminate():
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT pg_terminate_backend(%s)", [pid])
+
+            with mock.patch.object(live_prices, "RECONNECT_DELAY", 0):
+                await sync_to_async(terminate)()
+                # The current prices are published once listening again,
+                # before the stream ends
+                async for event in stream:
+                    event = event.decode()
+                    if event.startswith("data: ") and json.loads(
+                            event[len("data: "):])["latest_price"] == 6666.66:
+                        break
+                else:
+                    raise AssertionError("Not published after reconnecting")
+            assert broadcaster.connection.get_backend_pid() != pid
+        finally:
+            broadcaster.close()
+
+    def test_negative_live_price_stream(self):
+        response = self.client.get(
+            reverse("live-crypto-price"), {"symbols": "BTCUSDT,JUNK"})
+        assert response.status_code == 400
+        expected_output = {
+            "detail": "The given cryptocurrency pair JUNK is either not supported or invalid"}
+        assert DeepDiff(expected_output, response.json()) == {}, response.json()
+
+    def test_live_price_stream_empty_symbols(self):
+        # Empty entries are left out, none at all streams every symbol
+        for symbols, expected in (("BTCUSDT,", {"BTCUSDT"}), (",", None)):
+            with mock.patch.object(live_prices, "stream_prices",
+                                   return_value=iter(())) as stream_prices:
+                response = self.client.get(
+                    reverse("live-crypto-price"), {"symbols": symbols})
+            assert response.status_code == 200, response.content
+            stream_prices.assert_called_once_with(expected)
+
     def test_list_price(self):
         response = (self.client.get(
             self.crypto_price_list, {"symbol": "BTCUSDT",
@@ -89,6 +289,28 @@ class CryptoTickerTestCase(TestCase):
         assert DeepDiff(expected_output, response.json()
                         ) == {}, response.json()
 
+    def test_list_price_columnar(self):
+        params = {"symbol": "BTCUSDT",
+                  "start_datetime": self.data_collection_start_date.strftime('%Y-%m-%dT%H:%M:%S'),
+                  "end_datetime": self.min_3.strftime('%Y-%m-%dT%H:%M:%S'),
+                  "columnar": "true", "fields": "datetime,price"}
+        response = self.client.get(self.crypto_price_list, params)
+        assert response.status_code == 200
+        expected_output = {'count': 2, 'next': None, 'previous': None, 'results': {
+            'datetime': ['2024-04-01T11:03:47', '2024-04-01T11:04:47'], 'price': [1111.11, 2222.22]}}
+        assert DeepDiff(expected_output, response.json()) == {}, response.json()
+
+        # Rendered by orjson the same as the serializer and JSONRenderer do
+        del params["columnar"], params["fields"]
+        response = self.client.get(self.crypto_price_list, params)
+        expected = JSONRenderer().render(CryptoPriceSerializer(
+            CryptoPrice.objects.order_by('id')[:2], many=True).data)
+        assert response.content.decode().endswith(
+            '"results":%s}' % expected.decode()), response.content
+
+        response = self.client.get(self.crypto_price_list, {"fields": "datetime,junk"})
+        assert response.status_code == 400, response.json()
+
     def test_negative_1_list_price(self):
         response = (self.client.get(
             self.crypto_price_list, {"symbol": "JUNK",
@@ -121,16 +343,83 @@ class CryptoTickerTestCase(TestCase):
         assert re.search(
             "The specified end_datetime .+ must be lesser than current datetime .+", data["detail"]), pformat(data)
 
+    def test_list_bars(self):
+        response = (self.client.get(
+            self.crypto_price_bars, {"symbol": "BTCUSDT",
+                                     "interval": 60,
+                                     "start_datetime": self.min_3.strftime('%Y-%m-%dT%H:%M:%S'),
+                                     "end_datetime": self.min_2.strftime('%Y-%m-%dT%H:%M:%S')}))
+        assert response.status_code == 200
+        expected_output = {'count': 1, 'next': None, 'previous': None, 'results': [
+            {'id': 2, 'symbol': 'BTCUSDT', 'interval': 60, 'datetime': '2024-04-01T11:04:47', 'open': 2222.22, 'high': 2500.0, 'low': 2000.0,
+             'close': 2100.0, 'volume': 1.0, 'vwap': 2200.0, 'trade_count': 3}]}
+        assert DeepDiff(expected_output, response.json()
+                        ) == {}, response.json()
+
     def test_statistics(self):
         response = (self.client.get(
             self.crypto_price_statistics, {"symbol": "BTCUSDT",
                                            "start_datetime": self.data_collection_start_date.strftime('%Y-%m-%dT%H:%M:%S'),
-                                           "end_datetime": self.min_3.strftime('%Y-%m-%dT%H:%M:%S')}))
+                                           "end_datetime": self.min_3.strftime('%Y-%m-%dT%H:%M:%S'),
+                                           "include_prices": "true"}))
         assert response.status_code == 200
         expected_output = {'crypto_prices': [{'id': 1, 'datetime': '2024-04-01T11:03:47', 'symbol': 'BTCUSDT', 'price': 1111.11}, {'id': 2, 'datetime': '2024-04-01T11:04:47',
                                                                                                                                    'symbol': 'BTCUSDT', 'price': 2222.22}], 'total_count': 2, 'average_price': 1666.665, 'median_price': 1666.665, 'standard_deviation': 555.555, 'percentage_change': 100.0}
-        assert DeepDiff(expected_output, response.json()
-                        ) == {}, response.json()
+        assert DeepDiff(expected_output, response.json(),
+                        math_epsilon=1e-9) == {}, response.json()
+
+    def test_statistics_in_one_query(self):
+        start_dt = datetime(2024, 4, 2)
+        prices = [1000 + (index * 37) % 101 + index / 7 for index in range(101)]
+        for index, price in enumerate(reversed(prices)):
+            # Inserted out of time order, first/last must still go by time
+            CryptoPrice(symbol="BTCUSDT", price=price,
+                        datetime=start_dt + timedelta(seconds=100 - index)).save()
+        params = {"symbol": "BTCUSDT",
+                  "start_datetime": start_dt.strftime('%Y-%m-%dT%H:%M:%S'),
+                  "end_datetime": (start_dt + timedelta(seconds=100)).strftime('%Y-%m-%dT%H:%M:%S')}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.crypto_price_statistics, params)
+        assert response.status_code == 200, response.json()
+        price_queries = [query["sql"] for query in queries.captured_queries
+                         if '"crypto_price"' in query["sql"]]
+        assert len(price_queries) == 1, price_queries
+        expected_output = {
+            'total_count': 101,
+            'average_price': float(np.average(prices)),
+            'median_price': float(np.median(prices)),
+            'standard_deviation': float(np.std(prices)),
+            'percentage_change': (prices[-1] - prices[0]) / prices[0] * 100}
+        assert DeepDiff(expected_output, response.json(),
+                        math_epsilon=1e-9) == {}, response.json()
+
+    def test_statistics_from_bars(self):
+        params = {"symbol": "BTCUSDT", "source": "bars",
+                  "start_datetime": self.data_collection_start_date.strftime('%Y-%m-%dT%H:%M:%S'),
+                  "end_datetime": self.min_3.strftime('%Y-%m-%dT%H:%M:%S')}
+        # Bars of a coarser interval are left out
+        CryptoPriceBar(symbol="BTCUSDT", interval=3600, datetime=self.min_4,
+                       open=1.0, high=9999.0, low=1.0, close=1.0,
+                       volume=100.0, vwap=1.0, trade_count=100).save()
+        response = self.client.get(self.crypto_price_statistics, params)
+        assert response.status_code == 200, response.json()
+        expected_output = {
+            'total_count': 10,
+            'average_price': (1250.0 * 2 + 2200.0) / 3,
+            'median_price': 1650.0,
+            'standard_deviation': 450.0,
+            'min_price': 1000.0,
+            'max_price': 2500.0,
+            'volume': 3.0,
+            'percentage_change': (2100.0 - 1111.11) / 1111.11 * 100}
+        assert DeepDiff(expected_output, response.json(),
+                        math_epsilon=1e-9) == {}, response.json()
+        response = self.client.get(self.crypto_price_statistics,
+                                   dict(params, interval=3600,
+                                        include_prices="true"))
+        assert response.json()["total_count"] == 100, response.json()
+        assert [bar["interval"] for bar in
+                response.json()["crypto_price_bars"]] == [3600]
 
     def test_negative_1_statistics(self):
         response = (self.client.get(
@@ -141,3 +430,364 @@ class CryptoTickerTestCase(TestCase):
         expected_output = {'detail': 'symbol is a mandatory query param'}
         assert DeepDiff(expected_output, response.json()
                         ) == {}, response.json()
+
+    def _add_minute_rollups(self):
+        Settings(name="rollup_start_date",
+                 value=self.data_collection_start_date).save()
+        for dt, price in ((self.min_4, 1111.11), (self.min_3, 2222.22)):
+            CryptoPriceRollup(
+                symbol="BTCUSDT", resolution=60,
+                datetime=dt.replace(second=0), price_count=1,
+                price_sum=price, price_sum_of_squares=price * price,
+                price_min=price, price_max=price, first_price=price,
+                first_datetime=dt, last_price=price, last_datetime=dt).save()
+
+    def test_statistics_from_rollups(self):
+        self._add_minute_rollups()
+        params = {"symbol": "BTCUSDT",
+                  "start_datetime": self.data_collection_start_date.strftime('%Y-%m-%dT%H:%M:%S'),
+                  "end_datetime": self.min_2.strftime('%Y-%m-%dT%H:%M:%S')}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.crypto_price_statistics, params)
+        assert response.status_code == 200, response.json()
+        # 11:03 and 11:04 from the rollups, the seconds before and after
+        # them and the median from the raw prices
+        price_queries = [query["sql"] for query in queries.captured_queries
+                         if '"crypto_price"' in query["sql"]]
+        assert len(price_queries) == 3, price_queries
+        assert any('"crypto_price_rollup"' in query["sql"]
+                   for query in queries.captured_queries)
+        Settings.objects.filter(name="rollup_start_date").delete()
+        expected = self.client.get(self.crypto_price_statistics, params).json()
+        assert expected["total_count"] == 3, pformat(expected)
+        assert DeepDiff(expected, response.json(),
+                        math_epsilon=1e-6) == {}, pformat(response.json())
+
+    def test_split_range(self):
+        Settings(name="rollup_start_date", value="2024-04-01 00:00:00").save()
+        assert rollups.split_range(datetime(2024, 4, 1, 10, 59, 30),
+                                   datetime(2024, 4, 3, 1, 30, 59)) == [
+            (None, datetime(2024, 4, 1, 10, 59, 30), datetime(2024, 4, 1, 11)),
+            (3600, datetime(2024, 4, 1, 11), datetime(2024, 4, 2)),
+            (86400, datetime(2024, 4, 2), datetime(2024, 4, 3)),
+            (3600, datetime(2024, 4, 3), datetime(2024, 4, 3, 1)),
+            (60, datetime(2024, 4, 3, 1), datetime(2024, 4, 3, 1, 31))]
+        # Raw before the rollups start
+        assert rollups.split_range(None, datetime(2024, 4, 1, 0, 59, 59)) == [
+            (None, None, datetime(2024, 4, 1)),
+            (3600, datetime(2024, 4, 1), datetime(2024, 4, 1, 1))]
+        assert rollups.split_range(datetime(2024, 3, 31),
+                                   datetime(2024, 3, 31, 12)) == [
+            (None, datetime(2024, 3, 31), datetime(2024, 3, 31, 12, 0, 1))]
+        # And within a minute
+        assert rollups.split_range(datetime(2024, 4, 1, 0, 0, 10),
+                                   datetime(2024, 4, 1, 0, 0, 20)) == [
+            (None, datetime(2024, 4, 1, 0, 0, 10),
+             datetime(2024, 4, 1, 0, 0, 21))]
+
+    def _add_recent_prices(self, count):
+        # One price a minute up to a minute ago, inside the hot window
+        now = datetime.now().replace(microsecond=0)
+        for index in range(count):
+            CryptoPrice(symbol="BTCUSDT", price=1000.0 + index * 7 % 13,
+                        datetime=now - timedelta(minutes=count - index)).save()
+        return now - timedelta(minutes=count)
+
+    @override_settings(HOT_WINDOW_REFRESH_INTERVAL=0)
+    def test_list_price_from_hot_window(self):
+        start_dt = self._add_recent_prices(120)
+        params = {"symbol": "BTCUSDT",
+                  "start_datetime": (start_dt + timedelta(minutes=30)).strftime('%Y-%m-%dT%H:%M:%S'),
+                  "end_datetime": (start_dt + timedelta(minutes=100)).strftime('%Y-%m-%dT%H:%M:%S'),
+                  "limit": 20, "offset": 10}
+        response = self.client.get(self.crypto_price_list, params)
+        assert response.status_code == 200
+        assert "BTCUSDT" in hot_window.cache.windows
+        with override_settings(HOT_WINDOW_HOURS=0):
+            expected = self.client.get(self.crypto_price_list, params).json()
+        assert expected["count"] == 71, expected["count"]
+        assert DeepDiff(expected, response.json()) == {}, response.json()
+
+        # Only the new rows are fetched on the next request
+        CryptoPrice(symbol="BTCUSDT", price=4444.44,
+                    datetime=datetime.now().replace(microsecond=0) - timedelta(seconds=30)).save()
+        params = {"symbol": "BTCUSDT",
+                  "start_datetime": (start_dt + timedelta(minutes=119)).strftime('%Y-%m-%dT%H:%M:%S')}
+        data = self.client.get(self.crypto_price_list, params).json()
+        assert [row["price"] for row in data["results"]][-1] == 4444.44, pformat(data)
+        assert data["count"] == 2, pformat(data)
+
+    def _get_keyset_pages(self, params):
+        pages = [self.client.get(self.crypto_price_list, params).json()]
+        while pages[-1]["next"]:
+            pages.append(self.client.get(pages[-1]["next"]).json())
+        return pages
+
+    @override_settings(HOT_WINDOW_REFRESH_INTERVAL=0)
+    def test_list_price_keyset(self):
+        start_dt = self._add_recent_prices(120)
+        params = {"symbol": "BTCUSDT",
+                  "start_datetime": (start_dt + timedelta(minutes=10)).strftime('%Y-%m-%dT%H:%M:%S'),
+                  "end_datetime": (start_dt + timedelta(minutes=100)).strftime('%Y-%m-%dT%H:%M:%S'),
+                  "pagination": "keyset", "limit": 25}
+        expected = list(CryptoPrice.objects.filter(
+            symbol="BTCUSDT", datetime__gte=start_dt + timedelta(minutes=10),
+            datetime__lte=start_dt + timedelta(minutes=100)
+        ).order_by('datetime').values_list('id', flat=True))
+        assert len(expected) == 91, len(expected)
+        # From the DB and from the hot window
+        for hours in (0, 6):
+            with override_settings(HOT_WINDOW_HOURS=hours):
+                pages = self._get_keyset_pages(params)
+            assert [len(page["results"]) for page in pages] == [25, 25, 25, 16], pformat(pages)
+            assert [row["id"] for page in pages for row in page["results"]] == expected, pformat(pages)
+            assert all("count" not in page for page in pages), pformat(pages)
+
+        with override_settings(HOT_WINDOW_HOURS=0):
+            pages = self._get_keyset_pages(dict(params, count="true"))
+        assert pages[0]["count"] == 91, pformat(pages[0])
+        assert "count" not in pages[1], pformat(pages[1])
+
+    def test_list_price_keyset_across_symbols(self):
+        # Same datetime as the first BTCUSDT price, ordered after it by id
+        CryptoPrice(symbol="ETHUSDT", price=33.33, datetime=self.min_4).save()
+        pages = self._get_keyset_pages(
+            {"start_datetime": self.data_collection_start_date.strftime('%Y-%m-%dT%H:%M:%S'),
+             "end_datetime": self.min_3.strftime('%Y-%m-%dT%H:%M:%S'),
+             "pagination": "keyset", "limit": 1})
+        assert [row["price"] for page in pages for row in page["results"]] == \
+            [1111.11, 33.33, 2222.22], pformat(pages)
+
+        response = self.client.get(
+            self.crypto_price_list, {"pagination": "keyset", "cursor": "junk"})
+        assert response.status_code == 404, response.json()
+
+    def test_list_price_by_interval(self):
+        start_dt = self._add_recent_prices(120)
+        params = {"symbol": "BTCUSDT",
+                  "start_datetime": (start_dt + timedelta(minutes=10)).strftime('%Y-%m-%dT%H:%M:%S'),
+                  "end_datetime": (start_dt + timedelta(minutes=100)).strftime('%Y-%m-%dT%H:%M:%S'),
+                  "interval": "15m", "limit": 100}
+        response = self.client.get(self.crypto_price_list, params)
+        assert response.status_code == 200, response.json()
+        buckets = {}
+        for price in CryptoPrice.objects.filter(
+                symbol="BTCUSDT", datetime__gte=start_dt + timedelta(minutes=10),
+                datetime__lte=start_dt + timedelta(minutes=100)).order_by('datetime'):
+            bucket = price.datetime - timedelta(
+                seconds=(price.datetime - datetime(1970, 1, 1)).total_seconds() % 900)
+            buckets.setdefault(bucket, []).append(price.price)
+        expected_output = [
+            {"datetime": bucket.isoformat(), "symbol": "BTCUSDT",
+             "open": prices[0], "high": max(prices), "low": min(prices),
+             "close": prices[-1], "average_price": float(np.average(prices)),
+             "count": len(prices)}
+            for bucket, prices in sorted(buckets.items())]
+        data = response.json()
+        assert data["count"] == len(expected_output), pformat(data)
+        assert DeepDiff(expected_output, data["results"],
+                        math_epsilon=1e-9) == {}, pformat(data)
+
+    def test_list_price_by_interval_from_rollups(self):
+        self._add_minute_rollups()
+        params = {"symbol": "BTCUSDT", "start_datetime": "2024-04-01T11:03:00",
+                  "end_datetime": "2024-04-01T11:04:59", "interval": "1m"}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.crypto_price_list, params)
+        assert response.status_code == 200, response.json()
+        assert any('"crypto_price_rollup"' in query["sql"]
+                   for query in queries.captured_queries)
+        Settings.objects.filter(name="rollup_start_date").delete()
+        expected = self.client.get(self.crypto_price_list, params).json()
+        assert expected["count"] == 2, pformat(expected)
+        assert DeepDiff(expected, response.json(),
+                        math_epsilon=1e-9) == {}, pformat(response.json())
+
+    def test_list_price_by_minutes_from_rollups(self):
+        self._add_minute_rollups()
+        params = {"symbol": "BTCUSDT", "start_datetime": "2024-04-01T11:03:00",
+                  "end_datetime": "2024-04-01T11:04:59", "interval": "2m"}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.crypto_price_list, params)
+        assert response.status_code == 200, response.json()
+        assert any('"crypto_price_rollup"' in query["sql"]
+                   for query in queries.captured_queries)
+        Settings.objects.filter(name="rollup_start_date").delete()
+        expected = self.client.get(self.crypto_price_list, params).json()
+        assert expected["count"] == 2, pformat(expected)
+        assert DeepDiff(expected, response.json(),
+                        math_epsilon=1e-9) == {}, pformat(response.json())
+
+    def test_compacted_prices(self):
+        # The prices before 11:05 are compacted, their rollups are exact
+        self._add_minute_rollups()
+        Settings(name="compacted_ranges",
+                 value='[["2024-04-01 00:00:00", "2024-04-01 11:05:00", 60]]'
+                 ).save()
+        label = [{"start_datetime": "2024-04-01T00:00:00",
+                  "end_datetime": "2024-04-01T11:05:00", "bucket_seconds": 60}]
+        compacted = {"symbol": "BTCUSDT",
+                     "start_datetime": "2024-04-01T11:03:00",
+                     "end_datetime": "2024-04-01T11:04:59"}
+        # Served, with the compacted ranges they include, instead of
+        # refused, even without a range
+        for url, params, count in (
+                (self.crypto_price_list, {}, 3),
+                (self.crypto_price_list, {"symbol": "BTCUSDT"}, 3),
+                (self.crypto_price_list, compacted, 2),
+                (self.crypto_price_list, dict(compacted, max_points=10), 2),
+                (self.crypto_price_list, dict(compacted, interval="30s"), 2),
+                (self.crypto_price_list, dict(
+                    compacted, interval="1m",
+                    end_datetime="2024-04-01T11:04:30"), 1),
+                (self.crypto_price_statistics, {"symbol": "BTCUSDT"}, None),
+                (self.crypto_price_statistics, compacted, None)):
+            response = self.client.get(url, params)
+            assert response.status_code == 200, (url, params, response.json())
+            data = response.json()
+            assert data["compacted"] == label, (url, params, data)
+            if count is not None:
+                assert data["count"] == count, (url, params, data)
+        response = self.client.get(self.crypto_price_statistics, compacted)
+        assert response.json()["total_count"] == 2, response.json()
+        response = self.client.get(self.crypto_price_export, compacted)
+        assert response.status_code == 200
+        assert json.loads(response["X-Compacted"]) == label
+        # Buckets of whole minutes come from the rollups, exact as they are
+        response = self.client.get(self.crypto_price_list,
+                                   dict(compacted, interval="2m"))
+        assert response.status_code == 200, response.json()
+        assert "compacted" not in response.json(), response.json()
+        assert [(bucket["datetime"], bucket["open"], bucket["count"])
+                for bucket in response.json()["results"]] == [
+            ("2024-04-01T11:02:00", 1111.11, 1),
+            ("2024-04-01T11:04:00", 2222.22, 1)], response.json()
+        # The bars are not compacted
+        response = self.client.get(self.crypto_price_statistics,
+                                   dict(compacted, source="bars"))
+        assert response.status_code == 200, response.json()
+        assert "compacted" not in response.json(), response.json()
+        # Nor are the prices after the compacted ones, listed as before
+        params = {"symbol": "BTCUSDT", "start_datetime": "2024-04-01T11:05:00"}
+        response = self.client.get(self.crypto_price_list, params)
+        assert response.status_code == 200, response.json()
+        Settings.objects.filter(name="compacted_ranges").delete()
+        assert response.json() == \
+            self.client.get(self.crypto_price_list, params).json()
+        assert response.json()["count"] == 1, response.json()
+
+    def test_list_price_max_points(self):
+        start_dt = self._add_recent_prices(120)
+        rows = list(CryptoPrice.objects.filter(symbol="BTCUSDT", datetime__gte=start_dt).order_by('datetime'))
+        kept = _reference_lttb(
+            [(row.datetime - rows[0].datetime).total_seconds() for row in rows],
+            [row.price for row in rows], 20)
+        expected = [CryptoPriceSerializer(rows[index]).data for index in kept]
+        # Read in chunks, the last one partial, and the kept rows returned
+        # from them without querying them again
+        with override_settings(DOWNSAMPLING_CHUNK_SIZE=7), \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.crypto_price_list, {
+                "symbol": "BTCUSDT", "start_datetime": start_dt.strftime('%Y-%m-%dT%H:%M:%S'),
+                "max_points": 20})
+        assert response.status_code == 200, response.json()
+        assert not any('"crypto_price"."id" IN (' in query["sql"]
+                       for query in queries.captured_queries), queries.captured_queries
+        data = response.json()
+        assert data["count"] == 20, pformat(data)
+        assert data["results"] == json.loads(JSONRenderer().render(expected)), pformat(data)
+        # Fewer prices than max_points are all kept
+        response = self.client.get(self.crypto_price_list, {
+            "symbol": "BTCUSDT", "start_datetime": start_dt.strftime('%Y-%m-%dT%H:%M:%S'),
+            "max_points": 1000, "fields": "id,price"})
+        assert response.json()["results"] == [
+            {"id": row.id, "price": row.price} for row in rows], response.json()
+
+    def test_lttb(self):
+        random = np.random.default_rng(7)
+        for count, threshold in ((1000, 100), (1001, 3), (57, 56), (10, 20)):
+            x = np.cumsum(random.uniform(0.5, 1.5, count))
+            y = np.cumsum(random.normal(size=count))
+            kept = downsampling.lttb(x, y, threshold)
+            assert kept.tolist() == _reference_lttb(x.tolist(), y.tolist(), threshold), (count, threshold)
+
+    def test_negative_downsampling(self):
+        for params in ({"interval": "15x"}, {"max_points": 2},
+                       {"interval": "1m", "max_points": 100},
+                       {"max_points": 100},
+                       {"interval": "1m", "pagination": "keyset"}):
+            if params != {"max_points": 100}:
+                params["symbol"] = "BTCUSDT"
+            response = self.client.get(self.crypto_price_list, params)
+            assert response.status_code == 400, (params, response.json())
+
+    def test_statistics_from_hot_window(self):
+        start_dt = self._add_recent_prices(60)
+        params = {"symbol": "BTCUSDT",
+                  "start_datetime": (start_dt + timedelta(minutes=5)).strftime('%Y-%m-%dT%H:%M:%S'),
+                  "end_datetime": (start_dt + timedelta(minutes=50)).strftime('%Y-%m-%dT%H:%M:%S'),
+                  "include_prices": "true"}
+        response = self.client.get(self.crypto_price_statistics, params)
+        assert response.status_code == 200
+        assert "BTCUSDT" in hot_window.cache.windows
+        with override_settings(HOT_WINDOW_HOURS=0):
+            expected = self.client.get(
+                self.crypto_price_statistics, params).json()
+        assert expected["total_count"] == 46, expected["total_count"]
+        assert DeepDiff(expected, response.json(),
+                        math_epsilon=1e-9) == {}, response.json()
+
+    @override_settings(EXPORT_CHUNK_SIZE=50)
+    async def test_export(self):
+        await sync_to_async(self._add_recent_prices)(120)
+        expected = [dict(zip(export.FIELDS, row)) async for row in
+                    CryptoPrice.objects.filter(symbol="BTCUSDT").order_by(
+                        'datetime', 'id').values_list(*export.FIELDS)]
+        assert len(expected) == 123
+        exported = {}
+        for export_format in export.EXPORTERS:
+            response = await self.async_client.get(
+                self.crypto_price_export,
+                {"symbol": "BTCUSDT", "format": export_format})
+            assert response.status_code == 200
+            assert response["Content-Disposition"] == \
+                f'attachment; filename="BTCUSDT.{export_format}"'
+            chunks = [chunk async for chunk in response.streaming_content]
+            # Sent a chunk of rows at a time
+            assert len(chunks) >= 3, (export_format, len(chunks))
+            exported[export_format] = b"".join(chunks)
+
+        rows = list(csv.reader(io.StringIO(exported["csv"].decode())))
+        assert rows[0] == list(export.FIELDS), rows[0]
+        assert rows[1:] == [
+            [str(row["id"]), row["datetime"].isoformat(), row["symbol"],
+             str(row["price"])] for row in expected], rows
+        rows = [json.loads(line)
+                for line in exported["ndjson"].decode().splitlines()]
+        assert rows == [dict(row, datetime=row["datetime"].isoformat())
+                        for row in expected], rows
+        parquet = pq.ParquetFile(io.BytesIO(exported["parquet"]))
+        assert parquet.num_row_groups == 3
+        assert parquet.read().to_pylist() == expected
+
+    def test_negative_export(self):
+        for params in ({}, {"symbol": "BTCUSDT", "format": "xml"},
+                       {"symbol": "JUNK"}):
+            response = self.client.get(self.crypto_price_export, params)
+            assert response.status_code == 400, (params, response.json())
+
+    def test_price_window_growth_and_expiry(self):
+        window = hot_window.PriceWindow(datetime(2024, 4, 1))
+        start = np.datetime64("2024-04-01T00:00:00", "us")
+        for batch in range(10):
+            ids = np.arange(batch * 500, (batch + 1) * 500)
+            window.append(ids, start + ids * np.timedelta64(1, "s"),
+                          ids.astype(np.float64))
+            window.expire(datetime(2024, 4, 1) + timedelta(seconds=batch * 300))
+        assert len(window) == 5000 - 2700, len(window)
+        assert window.ids[window.head] == 2700
+        rows = window.select("BTCUSDT", datetime(2024, 4, 1, 1),
+                             datetime(2024, 4, 1, 1, 0, 9))
+        assert list(rows.ids) == list(range(3600, 3610)), rows.ids
+        assert rows[0] == {'id': 3600, 'datetime': datetime(2024, 4, 1, 1),
+                           'symbol': 'BTCUSDT', 'price': 3600.0}, rows[0]
@@ -1,11 +1,18 @@
 from django.urls import path
-from .views import LatestCryptoPriceView, CryptoPriceListAPIView, CryptoPriceStatisticsAPIView
+from .views import (LatestCryptoPriceView, CryptoPriceListAPIView,
+                    CryptoPriceBarListAPIView, CryptoPriceStatisticsAPIView,
+                    CryptoPriceExportAPIView, LivePriceView)
 
 urlpatterns = [
     path('current_price/', LatestCryptoPriceView.as_view(),
          name="current-crypto-price"),
+    path('live_price/', LivePriceView.as_view(), name="live-crypto-price"),
     path('crypto_price/', CryptoPriceListAPIView.as_view(),
          name='crypto-price-list'),
+    path('crypto_price/bars/', CryptoPriceBarListAPIView.as_view(),
+         name='crypto-price-bars'),
     path('crypto_price/statistics/', CryptoPriceStatisticsAPIView.as_view(),
          name='crypto-price-statistics'),
+    path('crypto_price/export/', CryptoPriceExportAPIView.as_view(),
+         name='crypto-price-export'),
 ]
@@ -1,39 +1,94 @@
+import json
 import numpy as np
 from datetime import datetime
-from statistics import median
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views import View
 from rest_framework import generics, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from django_filters import rest_framework as filters
 
-from .models import CryptoPrice, LatestCryptoPrice, Settings
-from .serializers import CryptoPriceSerializer
-from .filters import CryptoPriceFilter
+from .models import CryptoPrice, CryptoPriceBar, Settings
+from .serializers import (CryptoPriceSerializer, CryptoPriceBarSerializer,
+                          CryptoPriceBucketSerializer)
+from .filters import CryptoPriceFilter, CryptoPriceBarFilter
+from . import export, hot_window, live_prices
+from .aggregates import bar_statistics
+from .downsampling import (bucket_prices, downsample_prices, parse_interval,
+                           rollup_resolution)
+from .latest_prices import get_latest_prices
+from .pagination import KeysetPagination
+from .renderers import ORJSONRenderer
+from .rollups import compacted_ranges, summarize_prices
 
 
 class LatestCryptoPriceView(APIView):
     """
-    This view helps to retrieve latest price of the given cryptocurrency pair.
+    This view helps to retrieve latest price of the given cryptocurrency pair,
+    or of several pairs at once with symbols=A,B,C.
     """
 
     def get(self, request):
-        symbol = request.query_params.get('symbol')
-        queryset = LatestCryptoPrice.objects.filter(symbol=symbol)
-        if not queryset.count():
+        symbols = request.query_params.get('symbols')
+        if symbols is not None:
+            symbols = [symbol for symbol in symbols.split(',') if symbol]
+        else:
+            symbol = request.query_params.get('symbol')
+            symbols = [symbol] if symbol else []
+        if not symbols:
+            return Response(
+                status=status.HTTP_400_BAD_REQUEST,
+                data={"detail": "No cryptocurrency pair given, in symbol or "
+                                "symbols"}
+            )
+        prices = get_latest_prices(symbols)
+        unknown = [symbol for symbol in symbols if symbol not in prices]
+        if unknown:
             # Provided symbol is invalid or not supported yet
             return Response(
                 status=status.HTTP_400_BAD_REQUEST,
                 data={
-                    "detail": f"The given cryptocurrency pair {symbol} is "
-                              "either not supported or invalid"
+                    "detail": f"The given cryptocurrency pair "
+                              f"{','.join(unknown)} is either not supported "
+                              "or invalid"
                 }
             )
-        else:
-            return Response(
-                {
-                    "latest_price": queryset[0].price,
-                    "datetime": queryset[0].datetime
-                })
+        if 'symbols' in request.query_params:
+            return Response(prices)
+        return Response(prices[symbols[0]])
+
+
+class LivePriceView(View):
+    """
+    This view streams the latest prices of the given cryptocurrency pairs
+    (symbols=A,B,C, all of them if not given) as Server-Sent Events, every
+    time the data receiver updates them.
+    """
+
+    async def get(self, request):
+        symbols = [symbol for symbol in
+                   request.GET.get('symbols', '').split(',') if symbol]
+        if symbols:
+            prices = await sync_to_async(get_latest_prices)(symbols)
+            unknown = [symbol for symbol in symbols if symbol not in prices]
+            if unknown:
+                return JsonResponse(
+                    status=status.HTTP_400_BAD_REQUEST,
+                    data={
+                        "detail": f"The given cryptocurrency pair "
+                                  f"{','.join(unknown)} is either not "
+                                  "supported or invalid"
+                    }
+                )
+        response = StreamingHttpResponse(
+            live_prices.stream_prices(set(symbols) if symbols else None),
+            content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Unbuffered through nginx
+        response['X-Accel-Buffering'] = 'no'
+        return response
 
 
 class CryptoPriceListAPIView(generics.ListAPIView):
@@ -41,24 +96,161 @@ class CryptoPriceListAPIView(generics.ListAPIView):
     serializer_class = CryptoPriceSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filterset_class = CryptoPriceFilter
+    # Whether ranges starting in the hot window are served from memory
+    serve_hot_window = True
+    # Whether interval= and max_points= downsample the prices
+    downsample = True
+    # Whether the rows come from crypto_price, whose older partitions may
+    # be compacted
+    compactable = True
+
+    @property
+    def paginator(self):
+        # pagination=keyset pages by cursor instead of offset
+        if not hasattr(self, '_paginator'):
+            if self.request.query_params.get('pagination') == 'keyset':
+                self._paginator = KeysetPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
 
     def list(self, request, *args, **kwargs):
         error_response = self._check_filter_correctness(request)
         if error_response:
             return error_response
-        response = super(CryptoPriceListAPIView, self).list(
-            request, *args, **kwargs)
+        fields = self._get_fields(request)
+        if fields is None:
+            return Response(
+                status=status.HTTP_400_BAD_REQUEST,
+                data={
+                    "detail": "fields must be some of " +
+                              ",".join(self._get_fields())
+                }
+            )
+        if self.downsample and ('interval' in request.query_params or
+                                'max_points' in request.query_params):
+            return self._list_downsampled(request)
+        compacted = []
+        rows = self._get_hot_window_rows(request)
+        if rows is None:
+            compacted = self._get_compacted(request)
+            # Rows as dicts straight from the DB, rendered as they are,
+            # rather than model instances going through the serializer
+            rows = self.filter_queryset(self.get_queryset()).values(
+                *self._get_fields())
+        page = self.paginate_queryset(rows)
+        return self._label_compacted(self.get_paginated_response(
+            self._shape(request, page, fields)), compacted)
+
+    def _get_fields(self, request=None):
+        # All fields of the model in the order of the serializer, or those
+        # asked for with fields=, None if any of them doesn't exist
+        all_fields = [field.attname for field in
+                      self.get_queryset().model._meta.concrete_fields]
+        if request is None or not request.query_params.get('fields'):
+            return all_fields
+        fields = request.query_params['fields'].split(',')
+        return fields if set(fields) <= set(all_fields) else None
+
+    @staticmethod
+    def _shape(request, rows, fields):
+        # columnar=true returns a list of values per field instead of a dict
+        # per row, which is smaller and quicker to load into arrays
+        if request.query_params.get('columnar', '').lower() == 'true':
+            return {field: [row[field] for row in rows] for field in fields}
+        if request.query_params.get('fields'):
+            return [{field: row[field] for field in fields} for row in rows]
+        return rows
+
+    def _list_downsampled(self, request):
+        interval = request.query_params.get('interval')
+        max_points = request.query_params.get('max_points')
+        detail = None
+        if interval and max_points:
+            detail = "interval and max_points can't be combined"
+        elif max_points and not request.query_params.get('symbol'):
+            detail = "symbol is a mandatory query param with max_points"
+        elif request.query_params.get('pagination') == 'keyset':
+            detail = "keyset pagination doesn't support downsampling"
+        if detail:
+            return Response(
+                status=status.HTTP_400_BAD_REQUEST,
+                data={
+                    "detail": detail
+                }
+            )
+        # Also validates interval and max_points
+        queryset = self.filter_queryset(self.get_queryset())
+        start_dt, end_dt = self._get_range(request)
+        if max_points:
+            # At most DOWNSAMPLING_MAX_POINTS rows, all in one response
+            rows = downsample_prices(queryset,
+                                     request.query_params['symbol'],
+                                     int(max_points),
+                                     settings.DOWNSAMPLING_CHUNK_SIZE)
+            return self._label_compacted(Response({
+                'count': len(rows),
+                'results': self._shape(request, rows, self._get_fields(request))
+            }), self._get_compacted(request))
+        seconds = parse_interval(interval)
+        # Buckets from the rollups are exact over compacted prices too
+        compacted = []
+        if not rollup_resolution(seconds, start_dt, end_dt):
+            compacted = self._get_compacted(request)
+        queryset = bucket_prices(
+            queryset, seconds, request.query_params.get('symbol'),
+            start_dt, end_dt)
+        page = self.paginate_queryset(queryset)
+        serializer = CryptoPriceBucketSerializer(page, many=True)
+        return self._label_compacted(
+            self.get_paginated_response(serializer.data), compacted)
+
+    @staticmethod
+    def _get_range(request):
+        # start_datetime and end_datetime, None when not given
+        start = request.query_params.get('start_datetime')
+        end = request.query_params.get('end_datetime')
+        start_dt = datetime.strptime(
+            start, '%Y-%m-%dT%H:%M:%S') if start else None
+        end_dt = datetime.strptime(end, '%Y-%m-%dT%H:%M:%S') if end else None
+        return start_dt, end_dt
+
+    def _get_compacted(self, request):
+        # Ranges of the requested one whose prices are compacted averages
+        if not self.compactable:
+            return []
+        return compacted_ranges(*self._get_range(request))
+
+    @staticmethod
+    def _label_compacted(response, compacted):
+        # Responses including compacted prices say where they are, others
+        # stay as they were
+        if compacted:
+            response.data['compacted'] = compacted
         return response
 
+    def _get_hot_window_rows(self, request):
+        # The prices of the requested range from the in-memory window of
+        # the symbol, None if they have to come from DB
+        if not self.serve_hot_window:
+            return None
+        start = request.query_params.get('start_datetime')
+        end = request.query_params.get('end_datetime')
+        if not start:
+            return None
+        return hot_window.cache.get(
+            request.query_params.get('symbol'),
+            datetime.strptime(start, '%Y-%m-%dT%H:%M:%S'),
+            datetime.strptime(end, '%Y-%m-%dT%H:%M:%S') if end else None)
+
     @staticmethod
     def _check_filter_correctness(request):
         symbol = request.query_params.get('symbol')
         start = request.query_params.get('start_datetime')
         end = request.query_params.get('end_datetime')
         if symbol:
-            supported_symbols = LatestCryptoPrice.objects.values_list(
-                'symbol', flat=True)
-            if symbol not in supported_symbols:
+            # Symbols with a latest price are the supported ones
+            if symbol not in get_latest_prices([symbol]):
                 return Response(
                     status=status.HTTP_400_BAD_REQUEST,
                     data={
@@ -107,7 +299,47 @@ class CryptoPriceListAPIView(generics.ListAPIView):
                 )
 
 
+class CryptoPriceBarListAPIView(CryptoPriceListAPIView):
+    """
+    This view lists the open/high/low/close/volume/VWAP bars aggregated by
+    the data receiver from every trade of the given cryptocurrency pair.
+    """
+    queryset = CryptoPriceBar.objects.order_by('datetime')
+    serializer_class = CryptoPriceBarSerializer
+    filterset_class = CryptoPriceBarFilter
+    serve_hot_window = False
+    downsample = False
+    compactable = False
+
+
 class CryptoPriceStatisticsAPIView(CryptoPriceListAPIView):
+    """
+    This view computes statistics of the prices of the given cryptocurrency
+    pair over a time range, from the rollups for the whole minutes, hours
+    and days of the range, otherwise in a single aggregate query. The
+    prices themselves are only listed with include_prices=true. With source=bars,
+    the statistics are computed from the bars, which account for every
+    trade rather than for the captured prices only.
+    """
+
+    @property
+    def from_bars(self):
+        return self.request.query_params.get('source') == 'bars'
+
+    @property
+    def filterset_class(self):
+        return CryptoPriceBarFilter if self.from_bars else CryptoPriceFilter
+
+    def get_queryset(self):
+        if self.from_bars:
+            return CryptoPriceBar.objects.order_by('datetime')
+        return super(CryptoPriceStatisticsAPIView, self).get_queryset()
+
+    def get_serializer_class(self):
+        if self.from_bars:
+            return CryptoPriceBarSerializer
+        return super(CryptoPriceStatisticsAPIView, self).get_serializer_class()
+
     def list(self, request, *args, **kwargs):
         symbol = request.query_params.get('symbol')
         if not symbol:
@@ -120,13 +352,24 @@ class CryptoPriceStatisticsAPIView(CryptoPriceListAPIView):
         error_response = self._check_filter_correctness(request)
         if error_response:
             return error_response
-        queryset = self.filter_queryset(self.get_queryset())
-        serializer = self.get_serializer(queryset, many=True)
-
-        total_count = queryset.count()
+        compacted = []
+        rows = None if self.from_bars else self._get_hot_window_rows(request)
+        if rows is not None:
+            prices = rows
+            statistics = self._statistics_from_hot_window(rows)
+        elif self.from_bars:
+            prices = self.filter_queryset(self.get_queryset())
+            statistics = bar_statistics(prices)
+        else:
+            # The rollups are exact over compacted prices, the median and
+            # the edges of the range are not
+            compacted = self._get_compacted(request)
+            prices = self.filter_queryset(self.get_queryset())
+            statistics = summarize_prices(prices, symbol,
+                                          *self._get_range(request))
 
         # No data indicates invalid input
-        if not total_count:
+        if not statistics:
             return Response(
                 status=status.HTTP_400_BAD_REQUEST,
                 data={
@@ -134,25 +377,90 @@ class CryptoPriceStatisticsAPIView(CryptoPriceListAPIView):
                 }
             )
 
-        # Calculate additional statistics
-        values = queryset.values_list('price', flat=True)
-        average_price = np.average(values)
-        median_price = np.median(values)
-        standard_deviation = np.std(values)
-
-        # Compute percentage change
-        latest_price = queryset.latest('datetime').price
-        earliest_price = queryset.earliest('datetime').price
-        percentage_change = ((latest_price - earliest_price) /
-                             earliest_price) * 100 if earliest_price != 0 else 0
-
-        data = {
-            'crypto_prices': serializer.data,
-            'total_count': total_count,
-            'average_price': average_price,
-            'median_price': median_price,
-            'standard_deviation': standard_deviation,
-            'percentage_change': percentage_change
+        data = {}
+        if request.query_params.get('include_prices', '').lower() == 'true':
+            key = 'crypto_price_bars' if self.from_bars else 'crypto_prices'
+            data[key] = self.get_serializer(prices[:], many=True).data
+        first_price = statistics['first_price']
+        data.update({
+            'total_count': statistics['total_count'],
+            'average_price': statistics['average_price'],
+            'median_price': statistics['median_price'],
+            'standard_deviation': statistics['standard_deviation'],
+            'percentage_change': ((statistics['last_price'] - first_price) /
+                                  first_price) * 100 if first_price != 0 else 0
+        })
+        if self.from_bars:
+            data.update({
+                'min_price': statistics['min_price'],
+                'max_price': statistics['max_price'],
+                'volume': statistics['volume']
+            })
+        return self._label_compacted(Response(data), compacted)
+
+    @staticmethod
+    def _statistics_from_hot_window(rows):
+        # Same statistics as price_statistics, over the arrays of the
+        # window, which are in time order already
+        if not len(rows):
+            return None
+        values = rows.prices
+        return {
+            'total_count': len(rows),
+            'average_price': np.average(values),
+            'median_price': np.median(values),
+            'standard_deviation': np.std(values),
+            'first_price': values[0],
+            'last_price': values[-1]
         }
 
-        return Response(data)
+
+class CryptoPriceExportAPIView(CryptoPriceListAPIView):
+    """
+    This view streams all prices of the given cryptocurrency pair over a
+    time range as a file, in CSV, NDJSON or Parquet format (format=csv, the
+    default, ndjson or parquet).
+    """
+
+    def perform_content_negotiation(self, request, force=False):
+        # format= selects the file format rather than a renderer, errors are
+        # always JSON
+        renderer = ORJSONRenderer()
+        return renderer, renderer.media_type
+
+    def list(self, request, *args, **kwargs):
+        symbol = request.query_params.get('symbol')
+        if not symbol:
+            return Response(
+                status=status.HTTP_400_BAD_REQUEST,
+                data={
+                    "detail": "symbol is a mandatory query param"
+                }
+            )
+        export_format = request.query_params.get('format', 'csv')
+        if export_format not in export.EXPORTERS:
+            return Response(
+                status=status.HTTP_400_BAD_REQUEST,
+                data={
+                    "detail": "format must be one of " +
+                              ",".join(export.EXPORTERS)
+                }
+            )
+        error_response = self._check_filter_correctness(request)
+        if error_response:
+            return error_response
+        compacted = self._get_compacted(request)
+        queryset = self.filter_queryset(self.get_queryset()).order_by(
+            'datetime', 'id')
+        exporter = export.EXPORTERS[export_format]()
+        response = StreamingHttpResponse(
+            export.stream_export(queryset, exporter,
+                                 settings.EXPORT_CHUNK_SIZE),
+            content_type=exporter.content_type)
+        response['Content-Disposition'] = \
+            f'attachment; filename="{symbol}.{exporter.extension}"'
+        # The file has no room for it, the compacted ranges go in a header
+        if compacted:
+            response['X-Compacted'] = json.dumps(
+                compacted, default=datetime.isoformat)
+        return response
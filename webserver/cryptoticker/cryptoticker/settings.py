@@ -135,4 +135,58 @@ REST_FRAMEWORK = {
     'DEFAULT_VERSIONING_CLASS': 'rest_framework.versioning.AcceptHeaderVersioning',
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 50,
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
 }
+
+# Shared by all workers through memcached when MEMCACHED_LOCATION is set
+# (host:port), otherwise every worker caches in its own memory
+if os.environ.get("MEMCACHED_LOCATION"):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': os.environ["MEMCACHED_LOCATION"],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+# Seconds latest prices are cached for. The data receiver updates them every
+# DATA_UPDATING_INTERVAL seconds, so caching them longer only serves stale
+# prices
+LATEST_PRICE_CACHE_TIMEOUT = float(
+    os.environ.get("DATA_UPDATING_INTERVAL", 5))
+# Seconds symbols without a latest price are cached for, short enough for a
+# newly supported symbol to be served soon after its first price
+MISSING_PRICE_CACHE_TIMEOUT = 1
+
+# Channel the data receiver notifies after every update of latest prices
+LIVE_PRICE_CHANNEL = "latest_price"
+# Seconds between keepalive comments of live price streams without updates
+LIVE_PRICE_KEEPALIVE = 15
+# Seconds after which a live price stream ends and its client reconnects
+LIVE_PRICE_STREAM_DURATION = int(
+    os.environ.get("LIVE_PRICE_STREAM_DURATION", 300))
+
+# Most points max_points can ask the price list to downsample to
+DOWNSAMPLING_MAX_POINTS = 10000
+# Rows max_points reads from DB at a time
+DOWNSAMPLING_CHUNK_SIZE = 10000
+
+# Rows exports read from DB and send at a time
+EXPORT_CHUNK_SIZE = 10000
+
+# Hours of the most recent prices of a symbol every worker keeps in memory
+# to answer queries starting inside them, 0 to always query the DB
+HOT_WINDOW_HOURS = int(os.environ.get("HOT_WINDOW_HOURS", 6))
+# Seconds between fetching the new prices of a symbol into its window
+HOT_WINDOW_REFRESH_INTERVAL = float(
+    os.environ.get("HOT_WINDOW_REFRESH_INTERVAL", 1))
+# Symbols every worker keeps windows for, the least recently used first
+# make room for others
+HOT_WINDOW_MAX_SYMBOLS = int(os.environ.get("HOT_WINDOW_MAX_SYMBOLS", 100))
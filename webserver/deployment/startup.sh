@@ -10,5 +10,5 @@ python manage.py collectstatic
 python manage.py makemigrations; python manage.py migrate
 python manage.py createsuperuser --no-input --username $DJANGO_SUPERUSER_USERNAME --email $DJANGO_SUPERUSER_EMAIL
 
-(cd /crypto-ticker/webserver/cryptoticker; gunicorn cryptoticker.wsgi:application --user www-data --bind 0.0.0.0:8010 --workers 3) &
+(cd /crypto-ticker/webserver/cryptoticker; gunicorn cryptoticker.asgi:application --worker-class uvicorn.workers.UvicornWorker --user www-data --bind 0.0.0.0:8010 --workers 3) &
 nginx -g "daemon off;"
\ No newline at end of file